@@ -3,9 +3,11 @@ Black Rock Payment Terminal - API Models
 """
 
 from typing import Dict, Any, Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from enum import Enum
 
+from ..config.settings import BULK_VALIDATION_SETTINGS
+
 class PayoutMethod(str, Enum):
     BANK = "BANK"
     CRYPTO = "CRYPTO"
@@ -22,6 +24,13 @@ class PaymentRequest(BaseModel):
     transaction_type: str  # SALE, REFUND, etc.
     is_online: bool = True
     auth_code: Optional[str] = None  # Added auth code field
+    terminal_id: Optional[str] = None  # Defaults to the primary terminal
+
+class BulkValidationRequest(BaseModel):
+    approval_codes: Optional[List[str]] = Field(None, max_length=BULK_VALIDATION_SETTINGS["max_rows"])
+    protocol: Optional[str] = None  # Protocol of every approval code
+    protocols: Optional[List[str]] = Field(None, max_length=BULK_VALIDATION_SETTINGS["max_rows"])  # Or the protocol of each approval code
+    card_numbers: Optional[List[str]] = Field(None, max_length=BULK_VALIDATION_SETTINGS["max_rows"])
 
 class PayoutSettingsRequest(BaseModel):
     method: PayoutMethod
@@ -4,17 +4,20 @@ Black Rock Payment Terminal - API Routes
 
 import logging
 import datetime
-import uuid
 from typing import Dict, Any, Optional, List
-from fastapi import APIRouter, HTTPException, Request, BackgroundTasks, Depends
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, HTTPException, Request, Header
 
 from ..core.transaction import Transaction, TransactionStatus, TransactionType, PaymentMethod
 from ..core.processor import TransactionProcessor
-from ..protocols.handler import ProtocolHandler, MTIHandler
+from ..core.admission import AdmissionRejected
+from ..core.idempotency import IdempotencyEntry, request_fingerprint
+from ..core.settlement import build_reconciliation_message
+from ..utils.metrics import StageTimer
+from ..protocols.handler import get_protocol_handler, MTIHandler
+from ..protocols.bulk import validate_batch
 from ..utils.receipt import ReceiptGenerator
-from ..config.settings import PROTOCOLS, MTI_TYPES, SUPPORTED_CURRENCIES
-from .models import PaymentRequest, PayoutSettingsRequest, TransactionResponse, PayoutMethod, BankPayoutSettings, CryptoPayoutSettings
+from ..config.settings import PROTOCOLS, MTI_TYPES, SUPPORTED_CURRENCIES, IDEMPOTENCY_SETTINGS
+from .models import PaymentRequest, BulkValidationRequest, PayoutSettingsRequest, TransactionResponse, PayoutMethod, BankPayoutSettings, CryptoPayoutSettings
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -22,74 +25,63 @@ logger = logging.getLogger(__name__)
 # Create router
 router = APIRouter()
 
-# Get global processor and receipt generator from main app
-from ..main import processor, receipt_generator
+def get_processor(terminal_id: Optional[str] = None) -> TransactionProcessor:
+    """
+    Get the processor of a terminal hosted by this process
 
-# Database dependency
-def get_db():
-    from ..main import SessionLocal
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    Args:
+        terminal_id: The terminal ID; the default terminal when omitted
 
-@router.post("/payment", response_model=TransactionResponse)
-async def process_payment(request: PaymentRequest, background_tasks: BackgroundTasks, db: Session = Depends(get_db)):
+    Returns:
+        TransactionProcessor: The terminal's processor
     """
-    Process a payment transaction
+    # Resolved at request time: the registry is created in the app lifespan
+    from .. import main
+    processor = main.registry.get(terminal_id) if main.registry else None
+    if processor is None:
+        raise HTTPException(status_code=404, detail=f"Unknown terminal: {terminal_id}")
+    return processor
+
+def build_transaction(request: PaymentRequest, transaction_type: TransactionType,
+                      processor: TransactionProcessor) -> Transaction:
+    """
+    Build the transaction of a payment request
+
+    Transaction generates its own ID and takes card details through
+    set_card_data rather than as constructor arguments; card details typed
+    into the API are manual entry.
+
+    Args:
+        request: The validated payment request
+        transaction_type: The request's transaction type
+        processor: The processor of the request's terminal
+
+    Returns:
+        Transaction: The new transaction, with the request's auth code if one was given
     """
-    logger.info(f"Processing payment: {request.amount} {request.currency}")
-    
-    # Validate protocol
-    if request.protocol not in PROTOCOLS:
-        raise HTTPException(status_code=400, detail=f"Invalid protocol: {request.protocol}")
-    
-    # Validate currency
-    if request.currency not in SUPPORTED_CURRENCIES:
-        raise HTTPException(status_code=400, detail=f"Unsupported currency: {request.currency}")
-    
-    # Validate transaction type
-    try:
-        transaction_type = TransactionType[request.transaction_type]
-    except KeyError:
-        raise HTTPException(status_code=400, detail=f"Invalid transaction type: {request.transaction_type}")
-    
-    # Create protocol handler
-    protocol_handler = ProtocolHandler(request.protocol)
-    
-    # Validate auth code if provided
-    if request.auth_code:
-        if not protocol_handler.validate_approval_code(request.auth_code):
-            raise HTTPException(
-                status_code=400, 
-                detail=f"Invalid auth code for protocol {request.protocol}. Expected {protocol_handler.approval_length} digits."
-            )
-    
-    # Create transaction
     transaction = Transaction(
-        transaction_id=str(uuid.uuid4()),
         amount=request.amount,
         currency=request.currency,
-        card_number=request.card_number,
-        expiry_date=request.expiry_date,
-        cvv=request.cvv,
-        cardholder_name=request.cardholder_name,
         transaction_type=transaction_type,
-        payment_method=PaymentMethod.CARD,
+        payment_method=PaymentMethod.MANUAL_ENTRY,
+        protocol=request.protocol,
         merchant_id=processor.merchant_id,
         terminal_id=processor.terminal_id,
-        protocol=request.protocol
+        is_online=request.is_online
     )
-    
-    # If auth code was provided, set it directly
+    transaction.set_card_data({
+        "card_number": request.card_number,
+        "expiry_date": request.expiry_date,
+        "cvv": request.cvv,
+        "cardholder_name": request.cardholder_name,
+        "postal_code": request.postal_code
+    })
     if request.auth_code:
         transaction.set_approval_code(request.auth_code)
-    
-    # Process transaction
-    background_tasks.add_task(processor.process_transaction, transaction)
-    
-    # Return response
+    return transaction
+
+def transaction_response(transaction: Transaction) -> TransactionResponse:
+    """Build the API response for a transaction"""
     return TransactionResponse(
         transaction_id=transaction.transaction_id,
         status=transaction.status.value,
@@ -101,28 +93,169 @@ async def process_payment(request: PaymentRequest, background_tasks: BackgroundT
         response_message=transaction.response_message
     )
 
+async def replay_idempotent(entry: IdempotencyEntry) -> TransactionResponse:
+    """
+    Answer a duplicate request from the original request under the same idempotency key
+
+    Waits up to coalesce_wait for the original to finish; if it is still in
+    flight after that, its current state is returned.
+    """
+    from .. import main
+    await main.idempotency.wait(entry, IDEMPOTENCY_SETTINGS["coalesce_wait"])
+    
+    if entry.result.cancelled():
+        raise HTTPException(status_code=409, detail="Original request was not processed, retry", headers={"Retry-After": "1"})
+    if entry.completed:
+        return TransactionResponse(**entry.result.result())
+    if entry.transaction is None:
+        raise HTTPException(status_code=409, detail="Original request is still in progress", headers={"Retry-After": "1"})
+    return transaction_response(entry.transaction)
+
+@router.post("/payment", response_model=TransactionResponse)
+async def process_payment(
+    request: PaymentRequest,
+    idempotency_key: Optional[str] = Header(None)
+):
+    """
+    Process a payment transaction
+
+    Requests carrying an Idempotency-Key header are processed at most once
+    per terminal; repeats get the original transaction's response.
+    """
+    logger.debug("Processing payment: %s %s", request.amount, request.currency)
+    
+    with StageTimer("validation", request.protocol if request.protocol in PROTOCOLS else "unknown"):
+        # Validate protocol
+        if request.protocol not in PROTOCOLS:
+            raise HTTPException(status_code=400, detail=f"Invalid protocol: {request.protocol}")
+        
+        # Validate currency
+        if request.currency not in SUPPORTED_CURRENCIES:
+            raise HTTPException(status_code=400, detail=f"Unsupported currency: {request.currency}")
+        
+        # Validate transaction type
+        try:
+            transaction_type = TransactionType[request.transaction_type]
+        except KeyError:
+            raise HTTPException(status_code=400, detail=f"Invalid transaction type: {request.transaction_type}")
+        
+        # Shared handler, built once per protocol at startup
+        protocol_handler = get_protocol_handler(request.protocol)
+        
+        # Validate auth code if provided
+        if request.auth_code:
+            if not protocol_handler.validate_approval_code(request.auth_code):
+                raise HTTPException(
+                    status_code=400, 
+                    detail=f"Invalid auth code for protocol {request.protocol}. Expected {protocol_handler.approval_length} digits."
+                )
+    
+    processor = get_processor(request.terminal_id)
+    transaction = build_transaction(request, transaction_type, processor)
+    
+    from .. import main
+    
+    # Attach retries of an already seen request to the original
+    entry = None
+    if idempotency_key:
+        fingerprint = request_fingerprint(request.model_dump())
+        entry, created = await main.idempotency.reserve_async(processor.terminal_id, idempotency_key, fingerprint)
+        if not created:
+            if entry.fingerprint != fingerprint:
+                raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+            logger.info("Replaying idempotent payment %s for terminal %s", idempotency_key, processor.terminal_id)
+            return await replay_idempotent(entry)
+    
+    if entry is not None:
+        entry.transaction = transaction
+    
+    # Runs on the processor loop shared by every terminal, so store writes go to the store's I/O thread
+    def on_complete(processed: Transaction) -> None:
+        response = transaction_response(processed).model_dump()
+        if entry is not None:
+            main.idempotency.complete(entry, response)
+        if main.shared_state is not None:
+            main.shared_state.submit(main.shared_state.index_transaction, processed.terminal_id, response)
+    
+    # Queue the transaction for the worker pool, or shed it if the processors are saturated
+    try:
+        main.admission.submit(processor, transaction, on_complete=on_complete)
+    except AdmissionRejected as e:
+        if entry is not None:
+            main.idempotency.release(processor.terminal_id, idempotency_key, entry)
+        logger.warning("Rejected payment for terminal %s: %s", processor.terminal_id, e.reason)
+        raise HTTPException(
+            status_code=e.status_code,
+            detail=e.reason,
+            headers={"Retry-After": str(e.retry_after)}
+        )
+    
+    # Return response
+    return transaction_response(transaction)
+
 @router.get("/transaction/{transaction_id}", response_model=TransactionResponse)
-async def get_transaction(transaction_id: str, db: Session = Depends(get_db)):
+async def get_transaction(transaction_id: str, terminal_id: Optional[str] = None):
     """
     Get transaction details
     """
-    transaction = processor.get_transaction(transaction_id)
+    transaction = await get_processor(terminal_id).get_transaction_async(transaction_id)
     if not transaction:
+        # Processed by another worker process
+        from .. import main
+        indexed = await main.shared_state.get_indexed_transaction_async(transaction_id) if main.shared_state else None
+        if indexed is not None:
+            return TransactionResponse(**indexed)
         raise HTTPException(status_code=404, detail=f"Transaction not found: {transaction_id}")
     
-    return TransactionResponse(
-        transaction_id=transaction.transaction_id,
-        status=transaction.status.value,
-        amount=transaction.amount,
-        currency=transaction.currency,
-        timestamp=transaction.timestamp.isoformat(),
-        approval_code=transaction.approval_code,
-        response_code=transaction.response_code,
-        response_message=transaction.response_message
-    )
+    return transaction_response(transaction)
+
+@router.get("/admission")
+async def get_admission_stats():
+    """
+    Get payment admission queue depth and rejection counters
+    """
+    from .. import main
+    return dict(main.admission.get_stats(), idempotency=main.idempotency.get_stats())
+
+@router.post("/batch/close")
+async def close_batch(terminal_id: Optional[str] = None):
+    """
+    Close the open batch of a terminal and reconcile its totals with the host
+    """
+    return await get_processor(terminal_id).close_batch_async()
+
+@router.get("/batch/totals")
+async def get_batch_totals(terminal_id: Optional[str] = None, batch_number: Optional[int] = None):
+    """
+    Get the running totals of the open batch, or the final totals of a closed one
+    """
+    ledger = get_processor(terminal_id).settlement
+    batch_number = batch_number or ledger.allocator.batch_number(ledger.terminal_id)
+    return build_reconciliation_message(ledger.terminal_id, ledger.merchant_id, batch_number, ledger.totals(batch_number))
+
+@router.post("/validate/batch")
+async def validate_bulk(request: BulkValidationRequest):
+    """
+    Validate columns of approval codes and card numbers in one call
+
+    Returns a boolean per input value (same order) and the invalid counts.
+    """
+    try:
+        result = validate_batch(
+            approval_codes=request.approval_codes,
+            protocols=request.protocols if request.protocols is not None else request.protocol,
+            card_numbers=request.card_numbers
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    for column in ("approval_codes", "card_numbers"):
+        if column in result:
+            result[column] = result[column].tolist()
+    return result
 
 @router.post("/payout/settings")
-async def set_payout_settings(request: PayoutSettingsRequest, db: Session = Depends(get_db)):
+async def set_payout_settings(request: PayoutSettingsRequest):
     """
     Set payout settings for merchant
     """
@@ -2,16 +2,19 @@
 Black Rock Payment Terminal - Configuration Settings
 """
 
-# Protocol definitions
+import os
+
+# Protocol definitions; nii is the Network International Identifier that routes
+# a protocol's messages on ISO 8583 host links
 PROTOCOLS = {
-    "POS Terminal -101.1 (4-digit approval)": {"approval_length": 4, "is_onledger": True},
-    "POS Terminal -101.4 (6-digit approval)": {"approval_length": 6, "is_onledger": True},
-    "POS Terminal -101.6 (Pre-authorization)": {"approval_length": 6, "is_onledger": True},
-    "POS Terminal -101.7 (4-digit approval)": {"approval_length": 4, "is_onledger": True},
-    "POS Terminal -101.8 (PIN-LESS transaction)": {"approval_length": 4, "is_onledger": False},  # Example MO transaction
-    "POS Terminal -201.1 (6-digit approval)": {"approval_length": 6, "is_onledger": True},
-    "POS Terminal -201.3 (6-digit approval)": {"approval_length": 6, "is_onledger": False},  # Example MO transaction
-    "POS Terminal -201.5 (6-digit approval)": {"approval_length": 6, "is_onledger": False}   # Example MO transaction
+    "POS Terminal -101.1 (4-digit approval)": {"approval_length": 4, "is_onledger": True, "nii": "101"},
+    "POS Terminal -101.4 (6-digit approval)": {"approval_length": 6, "is_onledger": True, "nii": "104"},
+    "POS Terminal -101.6 (Pre-authorization)": {"approval_length": 6, "is_onledger": True, "nii": "106"},
+    "POS Terminal -101.7 (4-digit approval)": {"approval_length": 4, "is_onledger": True, "nii": "107"},
+    "POS Terminal -101.8 (PIN-LESS transaction)": {"approval_length": 4, "is_onledger": False, "nii": "108"},  # Example MO transaction
+    "POS Terminal -201.1 (6-digit approval)": {"approval_length": 6, "is_onledger": True, "nii": "211"},
+    "POS Terminal -201.3 (6-digit approval)": {"approval_length": 6, "is_onledger": False, "nii": "213"},  # Example MO transaction
+    "POS Terminal -201.5 (6-digit approval)": {"approval_length": 6, "is_onledger": False, "nii": "215"}   # Example MO transaction
 }
 
 # MTI (Message Type Indicator) definitions
@@ -23,7 +26,9 @@ MTI_TYPES = {
     "0220": "Financial Transaction Advice",
     "0230": "Financial Transaction Advice Response",
     "0500": "Reversal Request",
-    "0510": "Reversal Response"
+    "0510": "Reversal Response",
+    "0520": "Reconciliation Advice",
+    "0530": "Reconciliation Advice Response"
 }
 
 # Currency settings
@@ -31,12 +36,14 @@ SUPPORTED_CURRENCIES = {
     "USD": {
         "name": "US Dollar",
         "symbol": "$",
-        "decimal_places": 2
+        "decimal_places": 2,
+        "numeric_code": "840"  # ISO 4217, used in ISO 8583 field 49
     },
     "EUR": {
         "name": "Euro",
         "symbol": "€",
-        "decimal_places": 2
+        "decimal_places": 2,
+        "numeric_code": "978"  # ISO 4217, used in ISO 8583 field 49
     }
 }
 
@@ -67,7 +74,173 @@ NETWORK_SETTINGS = {
     "backup_server_url": "",  # To be set during initialization
     "heartbeat_interval": 60,  # Seconds between heartbeat messages
     "retry_attempts": 3,
-    "retry_delay": 5,  # Seconds between retry attempts
+    "retry_delay": 0.5,  # Base delay of the jittered exponential backoff between retry attempts
+    "retry_max_delay": 5,  # Upper bound for the retry backoff
+    "connect_timeout": 5,  # Seconds to establish a connection to the host
+    "read_timeout": 30,  # Seconds to wait for a host response
+    "pool_timeout": 5,  # Seconds to wait for a free pooled connection
+    "max_connections": 20,  # Connection pool size per host
+    "max_keepalive_connections": 10,  # Idle connections kept open per host
+    "keepalive_expiry": 60,  # Seconds an idle connection is kept alive
+    "hedging_enabled": False,  # Send hedged duplicates of idempotent messages to the backup host
+    "hedge_quantile": 0.95,  # Latency quantile of the primary host after which a hedge is sent
+    "hedge_min_samples": 20,  # Samples required before the learned delay is used
+    "hedge_min_delay": 0.05,  # Lower bound for the hedge delay in seconds
+    "hedge_max_delay": 2.0,  # Upper bound (and default before enough samples) in seconds
+    "host_content_type": os.getenv("HOST_CONTENT_TYPE", "application/json"),  # Host payload encoding: application/json or application/msgpack
+}
+
+# ISO 8583 host link settings (persistent TCP connections to the acquirer)
+ISO_HOST_SETTINGS = {
+    "host_url": os.getenv("ISO_HOST_URL", ""),  # tcp://host:port; empty sends transactions to the HTTP host
+    "connections": 4,  # Persistent sockets per host, shared by all terminals of a runtime
+    "max_in_flight": 256,  # Outstanding requests per socket; further requests wait for a slot
+    "request_timeout": 30,  # Seconds to wait for the response to a request
+    "connect_timeout": 5,  # Seconds to establish a connection
+    "reconnect_delay": 0.5,  # Base delay of the jittered exponential backoff between reconnect attempts
+    "reconnect_max_delay": 10,  # Upper bound for the reconnect backoff
+    "terminal_nii": "000",  # Source NII in the TPDU header of outgoing messages
+}
+
+# Scheduler settings (timer wheel shared by all terminal processors)
+SCHEDULER_SETTINGS = {
+    "tick_interval": 0.05,  # Timer resolution in seconds
+    "wheel_size": 1024,  # Wheel slots; timers further out than one revolution wait extra rounds
+}
+
+# Admission control settings for payment requests
+ADMISSION_SETTINGS = {
+    "workers": 32,  # Transactions processed concurrently across all terminals
+    "max_queue_depth": 256,  # Admitted transactions waiting for a worker; beyond this requests get 503
+    "per_terminal_max_inflight": 8,  # Queued plus running transactions per terminal; beyond this requests get 429
+    "min_retry_after": 1,  # Seconds; bounds of the Retry-After estimate
+    "max_retry_after": 30,
+}
+
+# Idempotency key settings for payment requests
+IDEMPOTENCY_SETTINGS = {
+    "ttl": 86400,  # Seconds an Idempotency-Key and its stored response are remembered
+    "max_entries": 100000,  # Keys kept; the oldest are evicted beyond this
+    "coalesce_wait": 10,  # Seconds a duplicate waits for the in-flight original before getting its current state
+    "poll_interval": 0.05,  # Seconds between shared state checks when the original runs in another worker
+}
+
+# Bulk validation settings (/api/validate/batch)
+BULK_VALIDATION_SETTINGS = {
+    "max_rows": 10000,  # Values per column in one request; longer columns are rejected with 422
+}
+
+# Multi-process worker settings
+WORKER_SETTINGS = {
+    "workers": int(os.getenv("WEB_CONCURRENCY", "1")),  # Worker processes serving the API on this host
+    "lock_dir": os.getenv("WORKER_LOCK_DIR", "./run"),  # Slot lock files that assign terminals to workers
+    "shared_state_path": os.getenv("SHARED_STATE_PATH", "./shared_state.db"),  # Idempotency keys and transaction index
+}
+
+# Circuit breaker settings (one breaker per host)
+CIRCUIT_BREAKER_SETTINGS = {
+    "window_size": 20,  # Number of recent calls used to compute the failure rate
+    "min_requests": 5,  # Calls required in the window before the circuit can open
+    "failure_rate_threshold": 0.5,  # Failure rate that opens the circuit
+    "slow_call_threshold": 10.0,  # Seconds; slower calls count as failures
+    "open_timeout": 30,  # Seconds the circuit stays open before a half-open probe
+    "half_open_max_calls": 1,  # Probe calls allowed while half-open
+}
+
+# Offline queue settings
+OFFLINE_QUEUE_SETTINGS = {
+    "path": os.getenv("OFFLINE_QUEUE_PATH", "./offline_queue.db"),  # Durable store-and-forward log
+    "flush_interval": 0.05,  # Maximum seconds an enqueue waits for its group commit
+    "flush_batch": 256,  # Buffered operations that trigger an immediate commit
+    "compact_threshold": 5000,  # Acknowledged entries before the file is compacted
+}
+
+# Trace number (STAN) and batch number allocation
+STAN_SETTINGS = {
+    "path": os.getenv("STAN_STATE_PATH", "./stan_state.db"),  # Per-terminal sequences, shared by worker processes
+    "block_size": 1000,  # STANs reserved per database write; unused ones are skipped after a restart
+    "batch_refresh_interval": 1.0,  # Seconds a worker trusts its cached batch number
+}
+
+# Batch settlement settings
+SETTLEMENT_SETTINGS = {
+    "path": os.getenv("SETTLEMENT_STATE_PATH", "./settlement.db"),  # Running per-batch totals
+    "flush_interval": 1.0,  # Seconds between commits of buffered totals; the most a crash can lose
+    "drain_timeout": 10.0,  # Seconds a batch close waits for in-flight transactions and other workers' fences
+    "fence_stale_after": 10.0,  # Seconds without a fence update after which a worker is considered gone
+}
+
+# Offline synchronization settings
+OFFLINE_SYNC_SETTINGS = {
+    "batch_size": 50,  # Initial number of transactions per /sync_offline request
+    "min_batch_size": 1,
+    "max_batch_size": 500,
+    "batch_size_step": 10,  # Additive batch size increase while latency is under target
+    "target_batch_latency": 2.0,  # Seconds; slower batches halve the batch size
+    "max_parallel_batches": 4,  # Concurrent /sync_offline requests per terminal
+    "retry_base_delay": 1.0,  # Seconds before the first retry of a rejected item
+    "retry_max_delay": 300.0,  # Upper bound for the exponential retry backoff
+    "poll_interval": 30,  # Fallback wakeup when no enqueue or reconnection event arrives
+}
+
+# Timeout reversal settings (0500 for transactions the host may have approved without answering)
+REVERSAL_SETTINGS = {
+    "path": os.getenv("REVERSAL_QUEUE_PATH", "./reversal_queue.db"),  # Durable queue of pending reversals
+    "batch_size": 20,  # Initial number of reversals per /reversals request (or concurrent 0500s on an ISO link)
+    "min_batch_size": 1,
+    "max_batch_size": 200,
+    "batch_size_step": 10,  # Additive batch size increase while latency is under target
+    "target_batch_latency": 2.0,  # Seconds; slower batches halve the batch size
+    "max_parallel_batches": 2,  # Concurrent reversal batches per terminal
+    "retry_base_delay": 1.0,  # Seconds before the first retry of a failed reversal
+    "retry_max_delay": 60.0,  # Upper bound for the exponential retry backoff
+    "poll_interval": 5,  # Fallback wakeup when no enqueue or reconnection event arrives
+}
+
+# Transaction history settings
+HISTORY_SETTINGS = {
+    "max_entries": 10000,  # Transactions kept in memory per terminal; older ones are read from the database
+}
+
+# Database engine settings (sync and async SQLAlchemy engines)
+DATABASE_SETTINGS = {
+    "url": os.getenv("DATABASE_URL", "sqlite:///./payment_terminal.db"),
+    "async_url": os.getenv("ASYNC_DATABASE_URL", ""),  # Empty derives it from url (sqlite+aiosqlite, postgresql+asyncpg)
+    "pool_size": 10,  # Connections kept open per engine
+    "max_overflow": 20,  # Extra connections opened under load beyond pool_size
+    "pool_timeout": 5,  # Seconds to wait for a pooled connection
+    "pool_recycle": 1800,  # Seconds after which a pooled connection is replaced
+    "pool_pre_ping": True,  # Test connections on checkout and replace dead ones
+    "sqlite_pragmas": {  # Applied to every new SQLite connection
+        "journal_mode": "WAL",  # Readers and the writer do not block each other
+        "synchronous": "NORMAL",  # fsync at WAL checkpoints only; no corruption on crash with WAL
+        "mmap_size": 268435456,  # Bytes of the file read through a memory map
+        "cache_size": -65536,  # Page cache per connection; negative values are KiB
+        "busy_timeout": 5000,  # Milliseconds to wait for a lock before failing
+        "temp_store": "MEMORY",  # Temporary tables and indices in memory
+    },
+}
+
+# Transaction persistence settings (write-behind buffer in front of the transactions table)
+PERSISTENCE_SETTINGS = {
+    "enabled": os.getenv("PERSIST_TRANSACTIONS", "true").lower() == "true",  # Store every processed transaction
+    "durable": os.getenv("PERSIST_DURABLE", "false").lower() == "true",  # Answer a payment only once its row is committed
+    "flush_interval": 0.05,  # Maximum seconds a row waits for its group commit
+    "flush_batch": 1000,  # Buffered rows that trigger an immediate commit
+    "max_buffered": 50000,  # Rows buffered or being committed before writers block (backpressure)
+    "put_timeout": 5.0,  # Seconds a writer waits for room before the write is refused
+    "retry_delay": 1.0,  # Seconds the flusher waits after a failed commit
+    "max_row_attempts": 3,  # Commits a row that fails on its own gets before it is quarantined
+}
+
+# Logging settings
+LOGGING_SETTINGS = {
+    "level": os.getenv("LOG_LEVEL", "INFO"),
+    "json": True,  # One JSON object per line; False for the plain text format
+    "queue_size": 10000,  # Records buffered for the writer thread; further records are dropped and counted
+    "sample_rates": {},  # Fraction of records kept, keyed by unformatted message or logger name
+    "rate_limit_per_second": 100,  # Sustained records per second per event below WARNING (0 disables)
+    "rate_limit_burst": 200,
 }
 
 # Security settings
@@ -0,0 +1,66 @@
+"""
+Black Rock Payment Terminal - Per-Terminal Configuration
+"""
+
+from typing import Dict, Any, Optional
+
+from .settings import TERMINAL_SETTINGS, NETWORK_SETTINGS, ISO_HOST_SETTINGS
+
+
+class TerminalConfig:
+    """
+    Configuration of a single terminal
+
+    Values not given explicitly default to TERMINAL_SETTINGS and
+    NETWORK_SETTINGS, which are treated as read-only defaults so that many
+    terminals with different ids and hosts can share one process.
+    """
+
+    def __init__(
+        self,
+        merchant_id: str,
+        terminal_id: str,
+        server_url: str,
+        backup_server_url: Optional[str] = None,
+        heartbeat_interval: Optional[float] = None,
+        offline_transaction_limit: Optional[float] = None,
+        iso_host_url: Optional[str] = None
+    ):
+        """
+        Initialize the terminal configuration
+
+        Args:
+            merchant_id: The merchant ID
+            terminal_id: The terminal ID
+            server_url: The primary payment server base URL
+            backup_server_url: The backup payment server base URL
+            heartbeat_interval: Seconds of host silence before a heartbeat is sent
+            offline_transaction_limit: Maximum amount approved offline
+            iso_host_url: ISO 8583 host (tcp://host:port) for payment messages; when
+                empty they are sent to the HTTP host
+        """
+        self.merchant_id = merchant_id
+        self.terminal_id = terminal_id
+        self.server_url = server_url
+        self.backup_server_url = backup_server_url or NETWORK_SETTINGS["backup_server_url"]
+        self.heartbeat_interval = heartbeat_interval or NETWORK_SETTINGS["heartbeat_interval"]
+        self.offline_transaction_limit = (
+            offline_transaction_limit if offline_transaction_limit is not None
+            else TERMINAL_SETTINGS["offline_transaction_limit"]
+        )
+        self.iso_host_url = iso_host_url or ISO_HOST_SETTINGS["host_url"]
+        if self.iso_host_url:
+            from ..protocols.iso8583 import validate_card_acceptor_ids
+            validate_card_acceptor_ids(terminal_id, merchant_id)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Convert the configuration to a dictionary"""
+        return {
+            "merchant_id": self.merchant_id,
+            "terminal_id": self.terminal_id,
+            "server_url": self.server_url,
+            "backup_server_url": self.backup_server_url,
+            "heartbeat_interval": self.heartbeat_interval,
+            "offline_transaction_limit": self.offline_transaction_limit,
+            "iso_host_url": self.iso_host_url
+        }
@@ -0,0 +1,195 @@
+"""
+Black Rock Payment Terminal - Admission Control
+"""
+
+import math
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable
+
+from app.core.runtime import ProcessorRuntime
+from app.core.transaction import Transaction
+from app.config.settings import ADMISSION_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class AdmissionRejected(Exception):
+    """Raised when a transaction is refused because the processors are saturated"""
+
+    def __init__(self, status_code: int, reason: str, retry_after: int):
+        """
+        Initialize the rejection
+
+        Args:
+            status_code: 429 for a terminal over its cap, 503 when the shared queue is full
+            reason: Human readable reason
+            retry_after: Seconds the client should wait before retrying
+        """
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """
+    Bounded work queue and fixed worker pool in front of the processors
+
+    Transactions are admitted into a queue of at most max_queue_depth
+    entries and processed by a fixed number of worker tasks on the shared
+    runtime event loop. Admission is decided synchronously, so an
+    overloaded server answers immediately: 429 when a terminal already has
+    per_terminal_max_inflight transactions queued or running, 503 when the
+    shared queue is full. Both carry a Retry-After estimated from the queue
+    depth and the observed service time.
+    """
+
+    def __init__(self, runtime: ProcessorRuntime, settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the controller and start its workers
+
+        Args:
+            runtime: The runtime whose event loop runs the workers
+            settings: Overrides for ADMISSION_SETTINGS
+        """
+        config = dict(ADMISSION_SETTINGS)
+        if settings:
+            config.update(settings)
+
+        self.runtime = runtime
+        self.workers = config["workers"]
+        self.max_queue_depth = config["max_queue_depth"]
+        self.per_terminal_max_inflight = config["per_terminal_max_inflight"]
+        self.min_retry_after = config["min_retry_after"]
+        self.max_retry_after = config["max_retry_after"]
+
+        # Counters are updated from the API threads and the event loop
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+        self._per_terminal: Dict[str, int] = {}
+        self.admitted = 0
+        self.completed = 0
+        self.rejected_terminal = 0
+        self.rejected_saturated = 0
+        self.service_time_ewma: Optional[float] = None
+
+        self._queue = None
+        self._tasks = []
+        self.runtime.call_soon(self._start_workers)
+
+    def _start_workers(self) -> None:
+        """Create the queue and worker tasks (event loop only)"""
+        self._queue = asyncio.Queue()
+        self._tasks = [self.runtime.loop.create_task(self._worker()) for _ in range(self.workers)]
+        logger.info(f"Admission control started with {self.workers} workers")
+
+    def retry_after(self) -> int:
+        """
+        Estimate when queued work will have drained enough to accept more
+
+        Returns:
+            int: Seconds to put in the Retry-After header
+        """
+        service_time = self.service_time_ewma or 1.0
+        estimate = math.ceil((self._queued + self._running) * service_time / self.workers)
+        return min(max(estimate, self.min_retry_after), self.max_retry_after)
+
+    def submit(self, processor, transaction: Transaction,
+               on_complete: Optional[Callable[[Transaction], None]] = None) -> None:
+        """
+        Admit a transaction for processing or reject it immediately
+
+        Safe to call from any thread; never blocks.
+
+        Args:
+            processor: The TransactionProcessor of the transaction's terminal
+            transaction: The transaction to process
+            on_complete: Called on the event loop with the transaction once it has been processed
+
+        Raises:
+            AdmissionRejected: If the terminal is over its cap or the queue is full
+        """
+        terminal_id = processor.terminal_id
+        with self._lock:
+            if self._per_terminal.get(terminal_id, 0) >= self.per_terminal_max_inflight:
+                self.rejected_terminal += 1
+                raise AdmissionRejected(
+                    429, f"Too many transactions in flight for terminal {terminal_id}", self.retry_after()
+                )
+            if self._queued >= self.max_queue_depth:
+                self.rejected_saturated += 1
+                raise AdmissionRejected(503, "Payment processing is saturated", self.retry_after())
+
+            self._queued += 1
+            self._per_terminal[terminal_id] = self._per_terminal.get(terminal_id, 0) + 1
+            self.admitted += 1
+
+        self.runtime.call_soon(self._enqueue, processor, transaction, on_complete)
+
+    def _enqueue(self, processor, transaction: Transaction,
+                 on_complete: Optional[Callable[[Transaction], None]]) -> None:
+        """Put an admitted transaction on the queue (event loop only)"""
+        self._queue.put_nowait((processor, transaction, on_complete))
+
+    async def _worker(self) -> None:
+        """Process admitted transactions one at a time"""
+        while True:
+            processor, transaction, on_complete = await self._queue.get()
+            with self._lock:
+                self._queued -= 1
+                self._running += 1
+
+            started = time.monotonic()
+            try:
+                await processor.process_transaction_async(transaction)
+            except Exception as e:
+                logger.error("Error processing admitted transaction %s: %s", transaction.transaction_id, e)
+            finally:
+                if on_complete is not None:
+                    try:
+                        on_complete(transaction)
+                    except Exception as e:
+                        logger.error(f"Completion callback error for {transaction.transaction_id}: {str(e)}")
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    self._running -= 1
+                    self.completed += 1
+                    remaining = self._per_terminal[processor.terminal_id] - 1
+                    if remaining:
+                        self._per_terminal[processor.terminal_id] = remaining
+                    else:
+                        del self._per_terminal[processor.terminal_id]
+                    self.service_time_ewma = (
+                        elapsed if self.service_time_ewma is None
+                        else 0.8 * self.service_time_ewma + 0.2 * elapsed
+                    )
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth, worker utilization and admission counters"""
+        with self._lock:
+            return {
+                "queue_depth": self._queued,
+                "max_queue_depth": self.max_queue_depth,
+                "workers": self.workers,
+                "workers_busy": self._running,
+                "terminals_active": len(self._per_terminal),
+                "admitted": self.admitted,
+                "completed": self.completed,
+                "rejected_terminal_limit": self.rejected_terminal,
+                "rejected_saturated": self.rejected_saturated,
+                "service_time_ewma": self.service_time_ewma,
+                "retry_after": self.retry_after()
+            }
+
+    def shutdown(self) -> None:
+        """Cancel the workers; queued transactions that have not started are dropped"""
+        def cancel():
+            for task in self._tasks:
+                task.cancel()
+        self.runtime.call_soon(cancel)
+        if self._queued:
+            logger.warning(f"Admission control stopped with {self._queued} queued transactions")
@@ -0,0 +1,161 @@
+"""
+Black Rock Payment Terminal - Circuit Breaker
+"""
+
+import time
+import random
+import logging
+import threading
+from collections import deque
+from enum import Enum
+from typing import Dict, Any, Optional
+
+from app.config.settings import CIRCUIT_BREAKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitState(Enum):
+    """States of a circuit breaker"""
+    CLOSED = "CLOSED"
+    OPEN = "OPEN"
+    HALF_OPEN = "HALF_OPEN"
+
+
+def backoff_delay(attempt: int, base_delay: float, max_delay: float) -> float:
+    """
+    Get a jittered exponential backoff delay
+
+    Args:
+        attempt: The attempt number (1 for the first retry)
+        base_delay: Delay of the first retry in seconds
+        max_delay: Upper bound for the delay in seconds
+
+    Returns:
+        float: Seconds to wait, uniformly drawn from the upper half of the window
+    """
+    delay = min(base_delay * (2 ** max(attempt - 1, 0)), max_delay)
+    return random.uniform(delay / 2, delay)
+
+
+class CircuitBreaker:
+    """
+    Per-host circuit breaker with error-rate and latency tracking
+
+    The breaker keeps a rolling window of call outcomes. It opens when the
+    failure rate (errors and calls slower than slow_call_threshold) over at
+    least min_requests calls reaches failure_rate_threshold. After
+    open_timeout it lets a limited number of probe calls through (half-open)
+    and closes again on a successful probe.
+    """
+
+    def __init__(self, name: str, settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the circuit breaker
+
+        Args:
+            name: The host this breaker protects (used in logs and stats)
+            settings: Overrides for CIRCUIT_BREAKER_SETTINGS
+        """
+        config = dict(CIRCUIT_BREAKER_SETTINGS)
+        if settings:
+            config.update(settings)
+
+        self.name = name
+        self.min_requests = config["min_requests"]
+        self.failure_rate_threshold = config["failure_rate_threshold"]
+        self.slow_call_threshold = config["slow_call_threshold"]
+        self.open_timeout = config["open_timeout"]
+        self.half_open_max_calls = config["half_open_max_calls"]
+
+        self.state = CircuitState.CLOSED
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=config["window_size"])
+        self._opened_at = 0.0
+        self._half_open_calls = 0
+        self.latency_ewma: Optional[float] = None
+        self.times_opened = 0
+
+    def allow_request(self) -> bool:
+        """Check if a call may be sent to the host now (reserves a probe slot when half-open)"""
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                if time.monotonic() - self._opened_at < self.open_timeout:
+                    return False
+                self.state = CircuitState.HALF_OPEN
+                self._half_open_calls = 0
+                logger.info(f"Circuit for {self.name} is HALF_OPEN, probing host")
+
+            if self.state == CircuitState.HALF_OPEN:
+                if self._half_open_calls >= self.half_open_max_calls:
+                    if time.monotonic() - self._opened_at < 2 * self.open_timeout:
+                        return False
+                    # The outstanding probe never reported back; allow a new one
+                    self._opened_at = time.monotonic() - self.open_timeout
+                    self._half_open_calls = 0
+                self._half_open_calls += 1
+
+            return True
+
+    def is_available(self) -> bool:
+        """Check if the breaker would let a call through, without reserving a probe slot"""
+        with self._lock:
+            if self.state == CircuitState.OPEN:
+                return time.monotonic() - self._opened_at >= self.open_timeout
+            if self.state == CircuitState.HALF_OPEN:
+                return self._half_open_calls < self.half_open_max_calls
+            return True
+
+    def record_success(self, latency: float) -> None:
+        """Record a completed call"""
+        self._record(latency > self.slow_call_threshold, latency)
+
+    def record_failure(self, latency: float) -> None:
+        """Record a failed call"""
+        self._record(True, latency)
+
+    def _record(self, failed: bool, latency: float) -> None:
+        """Update the rolling window and transition state"""
+        with self._lock:
+            self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+
+            if self.state == CircuitState.OPEN:
+                # Late result of a call sent before the circuit opened
+                return
+
+            if self.state == CircuitState.HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self.state = CircuitState.CLOSED
+                    self._outcomes.clear()
+                    logger.info(f"Circuit for {self.name} is CLOSED again")
+                return
+
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_requests and self.failure_rate() >= self.failure_rate_threshold:
+                self._open()
+
+    def _open(self) -> None:
+        """Open the circuit (lock must be held)"""
+        self.state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self.times_opened += 1
+        logger.warning(f"Circuit for {self.name} is OPEN for {self.open_timeout}s")
+
+    def failure_rate(self) -> float:
+        """Get the failure rate over the rolling window"""
+        if not self._outcomes:
+            return 0.0
+        return sum(self._outcomes) / len(self._outcomes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the breaker state, failure rate and latency"""
+        with self._lock:
+            return {
+                "host": self.name,
+                "state": self.state.value,
+                "failure_rate": self.failure_rate(),
+                "latency_ewma": self.latency_ewma,
+                "times_opened": self.times_opened
+            }
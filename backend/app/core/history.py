@@ -0,0 +1,211 @@
+"""
+Black Rock Payment Terminal - Transaction History Store
+"""
+
+import logging
+import threading
+import itertools
+from collections import OrderedDict
+from typing import Dict, Any, Optional, List, Callable
+
+from app.core.transaction import Transaction
+from app.database import crud
+from app.config.settings import HISTORY_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class TransactionHistory:
+    """
+    Bounded, indexed transaction history for a terminal
+
+    Recent transactions are kept in an LRU tier indexed by transaction ID,
+    trace number and batch number. When the tier is full the least recently
+    used transaction is evicted; lookups that miss fall through to the
+    database, so memory stays flat however long the terminal runs.
+    """
+
+    def __init__(self, terminal_id: str, max_entries: int = None,
+                 session_factory: Optional[Callable] = None,
+                 async_session_factory: Optional[Callable] = None):
+        """
+        Initialize the history store
+
+        Args:
+            terminal_id: The terminal whose transactions are stored
+            max_entries: Maximum number of transactions kept in memory
+            session_factory: Callable returning a database session for fall-through lookups
+            async_session_factory: Callable returning an async session for lookups from the event loop
+        """
+        self.terminal_id = terminal_id
+        self.max_entries = max_entries or HISTORY_SETTINGS["max_entries"]
+        self.session_factory = session_factory
+        self.async_session_factory = async_session_factory
+        self._lock = threading.Lock()
+        self._by_id: "OrderedDict[str, Transaction]" = OrderedDict()
+        self._by_trace: Dict[str, str] = {}
+        self._by_batch: Dict[int, Dict[str, None]] = {}
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._by_id)
+
+    def add(self, transaction: Transaction) -> None:
+        """Add or refresh a transaction, evicting the least recently used ones if full"""
+        with self._lock:
+            transaction_id = transaction.transaction_id
+            if transaction_id in self._by_id:
+                self._by_id.move_to_end(transaction_id)
+            else:
+                self._by_id[transaction_id] = transaction
+            self._index(transaction)
+
+            while len(self._by_id) > self.max_entries:
+                _, evicted = self._by_id.popitem(last=False)
+                self._unindex(evicted)
+                self.evictions += 1
+
+    def _index(self, transaction: Transaction) -> None:
+        """Add a transaction to the secondary indexes"""
+        if transaction.trace_number:
+            self._by_trace[transaction.trace_number] = transaction.transaction_id
+        if transaction.batch_number is not None:
+            self._by_batch.setdefault(transaction.batch_number, {})[transaction.transaction_id] = None
+
+    def _unindex(self, transaction: Transaction) -> None:
+        """Remove a transaction from the secondary indexes"""
+        if self._by_trace.get(transaction.trace_number) == transaction.transaction_id:
+            del self._by_trace[transaction.trace_number]
+        batch = self._by_batch.get(transaction.batch_number)
+        if batch is not None:
+            batch.pop(transaction.transaction_id, None)
+            if not batch:
+                del self._by_batch[transaction.batch_number]
+
+    def get(self, transaction_id: str) -> Optional[Transaction]:
+        """
+        Get a transaction by ID
+
+        Args:
+            transaction_id: The transaction ID
+
+        Returns:
+            Optional[Transaction]: The transaction, or None if unknown
+        """
+        with self._lock:
+            transaction = self._by_id.get(transaction_id)
+            if transaction is not None:
+                self._by_id.move_to_end(transaction_id)
+                return transaction
+
+        return self._load_one(lambda db: crud.get_transaction(db, transaction_id))
+
+    async def get_async(self, transaction_id: str) -> Optional[Transaction]:
+        """
+        Get a transaction by ID without blocking the event loop on a database fall-through
+
+        Args:
+            transaction_id: The transaction ID
+
+        Returns:
+            Optional[Transaction]: The transaction, or None if unknown
+        """
+        with self._lock:
+            transaction = self._by_id.get(transaction_id)
+            if transaction is not None:
+                self._by_id.move_to_end(transaction_id)
+                return transaction
+
+        if self.async_session_factory is None:
+            return None
+        try:
+            async with self.async_session_factory() as db:
+                record = await crud.get_transaction_async(db, transaction_id)
+        except Exception as e:
+            logger.warning(f"History database lookup failed: {str(e)}")
+            return None
+        return _from_model(record) if record is not None else None
+
+    def find_by_trace(self, trace_number: str) -> Optional[Transaction]:
+        """
+        Get a transaction by trace number
+
+        Args:
+            trace_number: The trace number (STAN)
+
+        Returns:
+            Optional[Transaction]: The transaction, or None if unknown
+        """
+        with self._lock:
+            transaction_id = self._by_trace.get(trace_number)
+            if transaction_id is not None:
+                return self._by_id[transaction_id]
+
+        return self._load_one(lambda db: crud.get_transaction_by_trace(db, self.terminal_id, trace_number))
+
+    def find_by_batch(self, batch_number: int) -> List[Transaction]:
+        """
+        Get all transactions of a batch, from memory and the database
+
+        Args:
+            batch_number: The batch number
+
+        Returns:
+            List[Transaction]: The batch transactions
+        """
+        with self._lock:
+            transactions = {
+                transaction_id: self._by_id[transaction_id]
+                for transaction_id in self._by_batch.get(batch_number, {})
+            }
+
+        for transaction in self._load_many(lambda db: crud.get_transactions_by_batch(db, self.terminal_id, batch_number)):
+            transactions.setdefault(transaction.transaction_id, transaction)
+        return list(transactions.values())
+
+    def recent(self, limit: Optional[int] = None) -> List[Transaction]:
+        """
+        Get the most recently used in-memory transactions, newest first
+
+        Args:
+            limit: Maximum number of transactions to return
+
+        Returns:
+            List[Transaction]: The transactions
+        """
+        with self._lock:
+            return list(itertools.islice(reversed(self._by_id.values()), limit))
+
+    def _load_one(self, query: Callable) -> Optional[Transaction]:
+        """Run a single-row fall-through query and convert the result"""
+        records = self._load_many(lambda db: [record for record in [query(db)] if record is not None])
+        return records[0] if records else None
+
+    def _load_many(self, query: Callable) -> List[Transaction]:
+        """Run a fall-through query and convert the resulting rows"""
+        if self.session_factory is None:
+            return []
+
+        try:
+            db = self.session_factory()
+            try:
+                return [_from_model(record) for record in query(db)]
+            finally:
+                db.close()
+        except Exception as e:
+            logger.warning(f"History database lookup failed: {str(e)}")
+            return []
+
+
+def _from_model(record) -> Transaction:
+    """Convert a TransactionModel row into a Transaction"""
+    data: Dict[str, Any] = {
+        column: getattr(record, column)
+        for column in (
+            "transaction_id", "amount", "currency", "transaction_type", "payment_method",
+            "protocol", "merchant_id", "terminal_id", "is_online", "status", "approval_code",
+            "response_code", "response_message", "mti", "trace_number", "batch_number"
+        )
+    }
+    data["timestamp"] = record.timestamp.isoformat()
+    return Transaction.from_dict(data)
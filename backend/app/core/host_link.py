@@ -0,0 +1,399 @@
+"""
+Black Rock Payment Terminal - ISO 8583 Host Link
+"""
+
+import time
+import asyncio
+import logging
+from urllib.parse import urlsplit
+from typing import Dict, Any, Optional, List, Tuple
+
+import httpx
+
+from app.core.breaker import backoff_delay
+from app.protocols.iso8583 import MAX_MESSAGE_SIZE, FieldValue, get_message_spec
+from app.config.settings import PROTOCOLS, ISO_HOST_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# Frames are a 2-byte big-endian length, a 5-byte TPDU header and the ISO 8583 message
+LENGTH_HEADER_SIZE = 2
+TPDU_SIZE = 5
+TPDU_ID = 0x60
+
+# (terminal ID, STAN) of an outstanding request
+PendingKey = Tuple[str, str]
+
+_PROTOCOLS_BY_NII = {config["nii"]: name for name, config in PROTOCOLS.items()}
+
+
+def encode_tpdu(destination_nii: str, source_nii: str) -> bytes:
+    """
+    Build a TPDU header
+
+    Args:
+        destination_nii: The 3-digit NII the message is routed to
+        source_nii: The 3-digit NII of the sender
+
+    Returns:
+        bytes: The ID byte followed by both NIIs as 2-byte BCD
+    """
+    return bytes([TPDU_ID]) + bytes.fromhex(destination_nii.zfill(4)) + bytes.fromhex(source_nii.zfill(4))
+
+
+def decode_tpdu(header: bytes) -> Tuple[str, str]:
+    """
+    Read the destination and source NII of a TPDU header
+
+    Raises:
+        ValueError: If the header is not a TPDU
+    """
+    if len(header) != TPDU_SIZE or header[0] != TPDU_ID:
+        raise ValueError("Invalid TPDU header")
+    return header[1:3].hex()[1:], header[3:5].hex()[1:]
+
+
+def protocol_for_nii(nii: str) -> str:
+    """
+    Get the protocol routed by an NII
+
+    Raises:
+        ValueError: If no protocol uses the NII
+    """
+    protocol = _PROTOCOLS_BY_NII.get(nii)
+    if protocol is None:
+        raise ValueError(f"Unknown NII: {nii}")
+    return protocol
+
+
+async def read_frame(reader: asyncio.StreamReader) -> Tuple[bytes, bytes]:
+    """
+    Read one length-prefixed frame
+
+    Returns:
+        Tuple[bytes, bytes]: The TPDU header and the ISO 8583 message
+
+    Raises:
+        asyncio.IncompleteReadError: If the connection closes mid-frame
+        ValueError: If the frame is too short to hold a TPDU
+    """
+    size = int.from_bytes(await reader.readexactly(LENGTH_HEADER_SIZE), "big")
+    if size < TPDU_SIZE:
+        raise ValueError(f"Frame of {size} bytes is too short")
+    frame = await reader.readexactly(size)
+    return frame[:TPDU_SIZE], frame[TPDU_SIZE:]
+
+
+def encode_frame(buffer: bytearray, tpdu: bytes, protocol: str, mti: str,
+                 values: Dict[int, FieldValue]) -> bytes:
+    """
+    Encode a complete frame into a reusable buffer
+
+    Args:
+        buffer: Scratch buffer of at least MAX_MESSAGE_SIZE plus the frame headers
+        tpdu: The TPDU header
+        protocol: The protocol whose message layout is used
+        mti: The message type indicator
+        values: Field values by field number
+
+    Returns:
+        bytes: The frame, copied out of the buffer
+    """
+    offset = LENGTH_HEADER_SIZE + TPDU_SIZE
+    size = get_message_spec(protocol).encode_into(buffer, mti, values, offset)
+    buffer[0:LENGTH_HEADER_SIZE] = (TPDU_SIZE + size).to_bytes(LENGTH_HEADER_SIZE, "big")
+    buffer[LENGTH_HEADER_SIZE:offset] = tpdu
+    return bytes(buffer[:offset + size])
+
+
+class _HostConnection:
+    """
+    One persistent socket of a host link
+
+    Requests are written as soon as they are made and any number of them
+    can be outstanding; a reader task decodes every incoming frame and
+    completes the waiting request with the same terminal ID and STAN, so
+    responses may arrive in any order.
+    """
+
+    def __init__(self, link: "IsoHostLink", index: int):
+        self.link = link
+        self.index = index
+        self.pending: Dict[PendingKey, asyncio.Future] = {}
+        self.slots = asyncio.Semaphore(link.max_in_flight)
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader_task: Optional[asyncio.Task] = None
+        self._reconnect_task: Optional[asyncio.Task] = None
+        self._connect_lock = asyncio.Lock()
+        self._buffer = bytearray(LENGTH_HEADER_SIZE + TPDU_SIZE + MAX_MESSAGE_SIZE)
+        self.failures = 0
+        self.retry_at = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None
+
+    async def connect(self) -> None:
+        """
+        Open the socket unless it is open already
+
+        Raises:
+            httpx.ConnectError: If the host cannot be reached or is in reconnect backoff
+        """
+        if self._writer is not None:
+            return
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
+            if time.monotonic() < self.retry_at:
+                raise httpx.ConnectError(f"Connection {self.index} to {self.link.address} is backing off")
+            try:
+                reader, writer = await asyncio.wait_for(
+                    asyncio.open_connection(self.link.host, self.link.port), self.link.connect_timeout
+                )
+            except (OSError, asyncio.TimeoutError) as e:
+                self.failures += 1
+                self.retry_at = time.monotonic() + backoff_delay(
+                    self.failures, ISO_HOST_SETTINGS["reconnect_delay"], ISO_HOST_SETTINGS["reconnect_max_delay"]
+                )
+                raise httpx.ConnectError(f"Cannot connect to {self.link.address}: {e!r}") from e
+            self.failures = 0
+            self._writer = writer
+            self._reader_task = asyncio.ensure_future(self._read(reader, writer))
+            self.link.stats["connections_opened"] += 1
+            logger.info(f"ISO host link connection {self.index} to {self.link.address} established")
+
+    async def _read(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Complete outstanding requests with the responses read from the socket"""
+        error: Exception = httpx.ReadError(f"Connection to {self.link.address} closed")
+        try:
+            while True:
+                tpdu, message = await read_frame(reader)
+                try:
+                    protocol = protocol_for_nii(decode_tpdu(tpdu)[1])
+                    mti, values = get_message_spec(protocol).decode(message)
+                    key = (values.get(41), values.get(11))
+                except (ValueError, UnicodeDecodeError) as e:
+                    self.link.stats["malformed_responses"] += 1
+                    logger.warning(f"Dropping malformed frame from {self.link.address}: {str(e)}")
+                    continue
+                future = self.pending.pop(key, None)
+                if future is None or future.done():
+                    # Late answer to a request that already timed out
+                    self.link.stats["unmatched_responses"] += 1
+                    continue
+                future.set_result((mti, values))
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError) as e:
+            error = httpx.ReadError(f"Connection to {self.link.address} lost: {e!r}")
+        except asyncio.CancelledError:
+            error = httpx.ReadError(f"Connection to {self.link.address} closed")
+            raise
+        finally:
+            self._disconnect(writer, error)
+
+    def _disconnect(self, writer: asyncio.StreamWriter, error: Exception) -> None:
+        """Fail the outstanding requests of a lost socket and start reconnecting"""
+        if self._writer is writer:
+            self._writer = None
+            self._reader_task = None
+        writer.close()
+        pending, self.pending = self.pending, {}
+        for future in pending.values():
+            if not future.done():
+                future.set_exception(error)
+        if not self.link.closed:
+            self.link.stats["disconnects"] += 1
+            logger.warning(f"ISO host link connection {self.index} to {self.link.address} lost; reconnecting")
+            self.start_reconnect()
+
+    def start_reconnect(self) -> None:
+        """Start reopening the socket in the background unless that is already under way"""
+        if self._reconnect_task is None or self._reconnect_task.done():
+            self._reconnect_task = asyncio.ensure_future(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        """Reopen the socket, with backoff, so requests find it ready"""
+        while not self.link.closed and self._writer is None:
+            try:
+                await self.connect()
+            except httpx.ConnectError:
+                await asyncio.sleep(max(self.retry_at - time.monotonic(), 0))
+
+    async def request(self, key: PendingKey, tpdu: bytes, protocol: str, mti: str,
+                      values: Dict[int, FieldValue], timeout: float) -> Tuple[str, Dict[int, FieldValue]]:
+        """Send a request on this socket and wait for its response"""
+        async with self.slots:
+            await self.connect()
+            frame = encode_frame(self._buffer, tpdu, protocol, mti, values)
+
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+            self.pending[key] = future
+
+            def expire():
+                if not future.done():
+                    future.set_exception(httpx.ReadTimeout(
+                        f"No response from {self.link.address} within {timeout}s"
+                    ))
+
+            if self.link.wheel is not None:
+                timer = self.link.wheel.schedule(timeout, expire)
+            else:
+                timer = loop.call_later(timeout, expire)
+            try:
+                # Not drained: the in-flight limit bounds what can sit in the send buffer
+                self._writer.write(frame)
+                return await future
+            except httpx.ReadTimeout:
+                self.link.stats["timeouts"] += 1
+                raise
+            finally:
+                timer.cancel()
+                if self.pending.get(key) is future:
+                    del self.pending[key]
+
+    async def close(self) -> None:
+        """Stop reconnecting and close the socket"""
+        for task in (self._reconnect_task, self._reader_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+
+
+class IsoHostLink:
+    """
+    Persistent, multiplexed ISO 8583 connections to one host
+
+    The link keeps a fixed number of TCP sockets open to the host and
+    shares them between all terminals of a runtime. Each request goes to
+    the connected socket with the fewest outstanding requests and is
+    matched to its response by terminal ID (field 41) and STAN (field 11),
+    so one socket carries many requests at once. Lost sockets fail their
+    outstanding requests with httpx.ReadError and reconnect in the
+    background with jittered exponential backoff; timeouts come from the
+    runtime's timer wheel. Must only be used from the runtime event loop.
+    """
+
+    def __init__(self, url: str, wheel=None, settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the link (connections are opened on first use)
+
+        Args:
+            url: The host address, tcp://host:port
+            wheel: TimerWheel used for request timeouts (event loop timers when omitted)
+            settings: Overrides for ISO_HOST_SETTINGS
+        """
+        config = dict(ISO_HOST_SETTINGS)
+        if settings:
+            config.update(settings)
+        parts = urlsplit(url if "://" in url else f"tcp://{url}")
+        if not parts.hostname or not parts.port:
+            raise ValueError(f"ISO host URL must be tcp://host:port: {url}")
+
+        self.address = f"{parts.hostname}:{parts.port}"
+        self.host = parts.hostname
+        self.port = parts.port
+        self.wheel = wheel
+        self.request_timeout = config["request_timeout"]
+        self.connect_timeout = config["connect_timeout"]
+        self.max_in_flight = config["max_in_flight"]
+        self.source_nii = config["terminal_nii"]
+        self.closed = False
+        self._tpdus = {name: encode_tpdu(protocol["nii"], self.source_nii) for name, protocol in PROTOCOLS.items()}
+        self._connections: Optional[List[_HostConnection]] = None
+        self._connection_count = config["connections"]
+        self.stats = {
+            "requests": 0,
+            "responses": 0,
+            "timeouts": 0,
+            "connection_errors": 0,
+            "connections_opened": 0,
+            "disconnects": 0,
+            "unmatched_responses": 0,
+            "malformed_responses": 0,
+        }
+
+    def _get_connections(self) -> List[_HostConnection]:
+        """Create the connection slots on first use (they need the running event loop)"""
+        if self._connections is None:
+            self._connections = [_HostConnection(self, index) for index in range(self._connection_count)]
+            for connection in self._connections:
+                connection.start_reconnect()
+        return self._connections
+
+    def _pick(self) -> _HostConnection:
+        """Pick the connected socket with the fewest outstanding requests, else the next one to retry"""
+        connections = self._get_connections()
+        connected = [connection for connection in connections if connection.connected]
+        if connected:
+            return min(connected, key=lambda connection: len(connection.pending))
+        return min(connections, key=lambda connection: connection.retry_at)
+
+    async def request(self, protocol: str, mti: str, values: Dict[int, FieldValue],
+                      timeout: Optional[float] = None) -> Tuple[str, Dict[int, FieldValue]]:
+        """
+        Send a request and wait for its response
+
+        Args:
+            protocol: The protocol whose message layout and NII are used
+            mti: The request MTI
+            values: The request fields; 11 (STAN) and 41 (terminal ID) are required
+            timeout: Seconds to wait for the response (defaults to request_timeout)
+
+        Returns:
+            Tuple[str, Dict[int, FieldValue]]: The response MTI and fields
+
+        Raises:
+            httpx.ConnectError: If no connection to the host can be opened
+            httpx.ReadError: If the connection is lost before the response arrives
+            httpx.ReadTimeout: If no response arrives in time
+            ValueError: If the request cannot be encoded or its STAN is already outstanding
+        """
+        if self.closed:
+            raise httpx.ConnectError(f"ISO host link to {self.address} is closed")
+        if 11 not in values or 41 not in values:
+            raise ValueError("ISO host requests need a STAN (field 11) and terminal ID (field 41)")
+        tpdu = self._tpdus.get(protocol)
+        if tpdu is None:
+            raise ValueError(f"Invalid protocol: {protocol}")
+
+        key = (values[41], values[11])
+        connection = self._pick()
+        if any(key in other.pending for other in self._connections):
+            raise ValueError(f"Request with STAN {key[1]} of terminal {key[0]} is already outstanding")
+
+        self.stats["requests"] += 1
+        try:
+            response = await connection.request(
+                key, tpdu, protocol, mti, values, timeout or self.request_timeout
+            )
+        except (httpx.ConnectError, httpx.ReadError):
+            self.stats["connection_errors"] += 1
+            raise
+        self.stats["responses"] += 1
+        return response
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get link counters
+
+        Returns:
+            Dict[str, Any]: Request outcomes, connection counts and outstanding requests
+        """
+        connections = self._connections or []
+        return dict(
+            self.stats,
+            host=self.address,
+            connections=len(connections),
+            connected=sum(1 for connection in connections if connection.connected),
+            in_flight=sum(len(connection.pending) for connection in connections)
+        )
+
+    async def aclose(self) -> None:
+        """Close all connections (must run on the runtime event loop)"""
+        self.closed = True
+        for connection in self._connections or []:
+            await connection.close()
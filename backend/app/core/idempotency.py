@@ -0,0 +1,222 @@
+"""
+Black Rock Payment Terminal - Idempotency Keys
+"""
+
+import json
+import time
+import asyncio
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, Tuple
+
+from app.core.shared_state import SharedStateStore
+from app.config.settings import IDEMPOTENCY_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+def request_fingerprint(payload: Dict[str, Any]) -> str:
+    """
+    Get a stable hash of a request payload
+
+    Args:
+        payload: The request fields
+
+    Returns:
+        str: Hex SHA-256 of the canonical JSON encoding
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"), default=str)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class IdempotencyEntry:
+    """A request seen under an idempotency key"""
+
+    __slots__ = ("terminal_id", "key", "fingerprint", "transaction", "created_at", "result", "remote", "reserved")
+
+    def __init__(self, terminal_id: str, key: str, fingerprint: str, remote: bool = False):
+        self.terminal_id = terminal_id
+        self.key = key
+        self.fingerprint = fingerprint
+        self.transaction = None
+        self.created_at = time.monotonic()
+        # True when the original request is being processed by another worker
+        self.remote = remote
+        # Resolved with the stored response once the transaction has been processed
+        self.result: Future = Future()
+        # Resolved once the shared store has said which worker owns the key
+        self.reserved: Future = Future()
+
+    @property
+    def completed(self) -> bool:
+        return self.result.done()
+
+
+class IdempotencyCache:
+    """
+    TTL cache of payment requests by (terminal ID, idempotency key)
+
+    The first request under a key reserves an entry and is processed; any
+    request with the same key while it is in flight attaches to that entry
+    and waits for its result, and any request after it completed gets the
+    stored response without reaching the acquirer. Entries expire after
+    ttl seconds and the oldest are evicted beyond max_entries.
+
+    With a SharedStateStore the keys are also reserved in the store, so a
+    duplicate that lands on a different worker process attaches to the
+    original too; it polls the store for the response. Store calls run on
+    the store's I/O thread, outside the cache lock: a new entry is visible
+    to local duplicates at once, and they wait for its store reservation
+    before using it.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, max_entries: Optional[int] = None,
+                 store: Optional[SharedStateStore] = None):
+        """
+        Initialize the cache
+
+        Args:
+            ttl: Seconds a key is remembered
+            max_entries: Maximum number of keys kept in memory
+            store: Shared store used when several worker processes serve requests
+        """
+        self.ttl = ttl or IDEMPOTENCY_SETTINGS["ttl"]
+        self.max_entries = max_entries or IDEMPOTENCY_SETTINGS["max_entries"]
+        self.poll_interval = IDEMPOTENCY_SETTINGS["poll_interval"]
+        self.store = store
+        self._entries: "OrderedDict[Tuple[str, str], IdempotencyEntry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._reserves = 0
+        self.hits = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _purge(self, now: float) -> None:
+        """Drop expired and excess entries, oldest first (lock must be held)"""
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if now - entry.created_at < self.ttl and len(self._entries) <= self.max_entries:
+                break
+            del self._entries[key]
+            self.evictions += 1
+
+    async def reserve_async(self, terminal_id: str, key: str, fingerprint: str) -> Tuple[IdempotencyEntry, bool]:
+        """
+        Get the entry for a key, creating it if the key is new
+
+        Args:
+            terminal_id: The terminal the key belongs to
+            key: The client supplied idempotency key
+            fingerprint: Fingerprint of the request body
+
+        Returns:
+            Tuple[IdempotencyEntry, bool]: The entry and whether it was created by this call
+
+        Raises:
+            sqlite3.Error: If the shared store could not reserve the key (the key stays free)
+        """
+        now = time.monotonic()
+        with self._lock:
+            self._purge(now)
+            self._reserves += 1
+            if self.store is not None and self._reserves % 1024 == 0:
+                self.store.submit(self.store.purge_expired, self.ttl)
+            entry = self._entries.get((terminal_id, key))
+            created = entry is None
+            if created:
+                entry = IdempotencyEntry(terminal_id, key, fingerprint)
+                self._entries[(terminal_id, key)] = entry
+
+        if created:
+            existing = None
+            if self.store is not None:
+                try:
+                    existing = await self.store.reserve_key_async(terminal_id, key, fingerprint, self.ttl)
+                except Exception as e:
+                    with self._lock:
+                        if self._entries.get((terminal_id, key)) is entry:
+                            del self._entries[(terminal_id, key)]
+                    entry.reserved.set_exception(e)
+                    raise
+            if existing is not None:
+                # Reserved by another worker
+                entry.fingerprint, response = existing
+                entry.remote = True
+                if response is not None:
+                    entry.result.set_result(response)
+            entry.reserved.set_result(None)
+            if existing is None:
+                return entry, True
+        else:
+            await asyncio.wrap_future(entry.reserved)
+
+        with self._lock:
+            if entry.completed:
+                self.hits += 1
+            else:
+                self.coalesced += 1
+        return entry, False
+
+    async def refresh_async(self, entry: IdempotencyEntry) -> None:
+        """Pick up the response of a request processed by another worker"""
+        if not entry.remote or entry.completed:
+            return
+        reservation = await self.store.get_key_async(entry.terminal_id, entry.key)
+        if reservation is None:
+            # The other worker released the key without processing the request
+            self.release(entry.terminal_id, entry.key, entry)
+        elif reservation[1] is not None and not entry.completed:
+            entry.result.set_result(reservation[1])
+
+    async def wait(self, entry: IdempotencyEntry, timeout: float) -> None:
+        """
+        Wait until the original request of an entry completes or timeout elapses
+
+        Args:
+            entry: The entry returned by reserve_async
+            timeout: Maximum seconds to wait
+        """
+        waiter = asyncio.wrap_future(entry.result)
+        deadline = time.monotonic() + timeout
+        while not entry.completed:
+            await self.refresh_async(entry)
+            remaining = deadline - time.monotonic()
+            if entry.completed or remaining <= 0:
+                break
+            await asyncio.wait({waiter}, timeout=min(remaining, self.poll_interval) if entry.remote else remaining)
+
+    def complete(self, entry: IdempotencyEntry, response: Dict[str, Any]) -> None:
+        """
+        Store the response of a processed request and release waiting duplicates
+
+        Never blocks: the shared store is updated on its I/O thread.
+        """
+        if not entry.result.done():
+            entry.result.set_result(response)
+        if self.store is not None and not entry.remote:
+            self.store.submit(self.store.complete_key, entry.terminal_id, entry.key, response)
+
+    def release(self, terminal_id: str, key: str, entry: IdempotencyEntry) -> None:
+        """Forget a key whose request was never processed (e.g. rejected), so it can be retried"""
+        with self._lock:
+            if self._entries.get((terminal_id, key)) is entry:
+                del self._entries[(terminal_id, key)]
+        if self.store is not None and not entry.remote:
+            self.store.submit(self.store.release_key, terminal_id, key)
+        if not entry.result.done():
+            entry.result.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get cache size and hit counters"""
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions
+        }
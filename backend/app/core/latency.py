@@ -0,0 +1,88 @@
+"""
+Black Rock Payment Terminal - Rolling Latency Histogram
+"""
+
+import bisect
+import threading
+from collections import deque
+from typing import Dict, Any, Optional, List
+
+
+def _default_bounds() -> List[float]:
+    """Exponential bucket upper bounds from 1ms to ~65s (factor 1.25)"""
+    bounds = []
+    bound = 0.001
+    while bound < 65.0:
+        bounds.append(round(bound, 6))
+        bound *= 1.25
+    return bounds
+
+
+DEFAULT_BOUNDS = _default_bounds()
+
+
+class LatencyHistogram:
+    """
+    Bucketed histogram over the most recent latency samples of one host
+
+    Each sample increments a bucket and is remembered in a ring; when the
+    ring is full the oldest sample's bucket is decremented. Quantiles are
+    read by walking the bucket counts, so recording and querying cost
+    O(buckets) at most with no sorting.
+    """
+
+    def __init__(self, window_size: int = 512, bounds: Optional[List[float]] = None):
+        """
+        Initialize the histogram
+
+        Args:
+            window_size: Number of most recent samples kept
+            bounds: Bucket upper bounds in seconds (ascending)
+        """
+        self.bounds = bounds or DEFAULT_BOUNDS
+        self._counts = [0] * (len(self.bounds) + 1)
+        self._window = deque(maxlen=window_size)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._window)
+
+    def record(self, latency: float) -> None:
+        """Record a latency sample in seconds"""
+        index = bisect.bisect_left(self.bounds, latency)
+        with self._lock:
+            if len(self._window) == self._window.maxlen:
+                self._counts[self._window[0]] -= 1
+            self._window.append(index)
+            self._counts[index] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """
+        Estimate a latency quantile
+
+        Args:
+            q: The quantile, e.g. 0.95
+
+        Returns:
+            Optional[float]: Upper bound of the bucket holding the quantile, or None without samples
+        """
+        with self._lock:
+            total = len(self._window)
+            if not total:
+                return None
+            rank = q * total
+            seen = 0
+            for index, count in enumerate(self._counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.bounds[index] if index < len(self.bounds) else self.bounds[-1]
+        return self.bounds[-1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the sample count and common quantiles"""
+        return {
+            "samples": len(self),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "p99": self.quantile(0.99)
+        }
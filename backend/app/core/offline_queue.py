@@ -0,0 +1,403 @@
+"""
+Black Rock Payment Terminal - Durable Offline Queue
+"""
+
+import json
+import time
+import queue
+import asyncio
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, List, Tuple
+
+from app.core.transaction import Transaction
+from app.config.settings import OFFLINE_QUEUE_SETTINGS, WORKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineQueueStore:
+    """
+    Write-ahead store-and-forward log for offline approved transactions
+
+    Entries live in a WAL-mode SQLite table. Enqueues and acknowledgements are
+    buffered in memory and written by a flusher thread in a single commit, so
+    many transactions share one fsync (group commit). An enqueue wakes the
+    flusher at once and returns a future resolved when its row is committed;
+    enqueues arriving during a commit share the next one. Unacknowledged rows
+    are recovered on startup; acknowledged rows are deleted and the file is
+    compacted once enough of them have accumulated.
+    """
+
+    def __init__(self, path: str, flush_interval: float = None, flush_batch: int = None,
+                 compact_threshold: int = None, shared: bool = False):
+        """
+        Initialize the store
+
+        Args:
+            path: SQLite database file path
+            flush_interval: Maximum seconds an enqueue waits before being committed
+            flush_batch: Number of buffered operations that triggers an immediate commit
+            compact_threshold: Deleted rows after which the WAL is checkpointed and vacuumed
+            shared: Whether other worker processes write to the same file; counts are
+                then read from the database instead of being tracked in memory
+        """
+        self.path = path
+        self.shared = shared
+        self.flush_interval = flush_interval or OFFLINE_QUEUE_SETTINGS["flush_interval"]
+        self.flush_batch = flush_batch or OFFLINE_QUEUE_SETTINGS["flush_batch"]
+        self.compact_threshold = compact_threshold or OFFLINE_QUEUE_SETTINGS["compact_threshold"]
+
+        self._lock = threading.Lock()
+        self._write_lock = threading.RLock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._pending_inserts: List[Tuple[str, str, str, float]] = []
+        self._insert_waiters: List[Future] = []
+        self._pending_acks: List[str] = []
+        self._pending_retries: List[Tuple[int, float, str]] = []
+        self._deleted_since_compaction = 0
+        self._counts: Dict[str, int] = {}
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS offline_queue ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " transaction_id TEXT NOT NULL UNIQUE,"
+            " terminal_id TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " enqueued_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0,"
+            " not_before REAL NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_offline_queue_terminal ON offline_queue (terminal_id, seq)"
+        )
+
+        # Crash recovery: everything not acknowledged is still owed to the host
+        for terminal_id, count in self._conn.execute(
+            "SELECT terminal_id, COUNT(*) FROM offline_queue GROUP BY terminal_id"
+        ):
+            self._counts[terminal_id] = count
+        recovered = sum(self._counts.values())
+        if recovered:
+            logger.info(f"Recovered {recovered} unsynced offline transactions from {path}")
+
+        self._flusher = threading.Thread(target=self._flush_worker, daemon=True)
+        self._flusher.start()
+
+    def _flush_worker(self) -> None:
+        """Commit buffered operations every flush_interval or when a batch fills up"""
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Offline queue flush error: {str(e)}")
+
+    def _maybe_wake(self) -> None:
+        """Wake the flusher early once enough operations are buffered"""
+        if len(self._pending_inserts) + len(self._pending_acks) + len(self._pending_retries) >= self.flush_batch:
+            self._wakeup.set()
+
+    def append(self, terminal_id: str, transaction: Transaction) -> Future:
+        """
+        Buffer a transaction for the next group commit
+
+        Args:
+            terminal_id: The terminal that owns the entry
+            transaction: The transaction; its current state is stored
+
+        Returns:
+            Future: Resolved once the entry is committed, or failed with the
+            database error if its commit failed (the entry is then not stored)
+        """
+        payload = json.dumps(transaction.to_dict())
+        waiter = Future()
+        with self._lock:
+            self._pending_inserts.append((transaction.transaction_id, terminal_id, payload, time.time()))
+            self._insert_waiters.append(waiter)
+            if len(self._insert_waiters) == 1:
+                # The caller waits for this commit; do not hold it for the full interval
+                self._wakeup.set()
+        return waiter
+
+    def ack(self, terminal_id: str, transaction_id: str) -> None:
+        """Buffer the deletion of an acknowledged transaction"""
+        with self._lock:
+            self._pending_acks.append(transaction_id)
+            self._counts[terminal_id] = max(self._counts.get(terminal_id, 0) - 1, 0)
+            self._maybe_wake()
+
+    def retry(self, transaction_id: str, attempts: int, not_before: float) -> None:
+        """Buffer a failed sync attempt so the entry is skipped until not_before"""
+        with self._lock:
+            self._pending_retries.append((attempts, not_before, transaction_id))
+            self._maybe_wake()
+
+    def flush(self) -> None:
+        """Write all buffered enqueues, retries and acknowledgements in one transaction"""
+        with self._write_lock:
+            with self._lock:
+                if not self._pending_inserts and not self._pending_acks and not self._pending_retries:
+                    return
+                inserts, self._pending_inserts = self._pending_inserts, []
+                waiters, self._insert_waiters = self._insert_waiters, []
+                acks, self._pending_acks = self._pending_acks, []
+                retries, self._pending_retries = self._pending_retries, []
+
+            # Enqueues keep going into the fresh buffers while this commit fsyncs
+            inserted: Dict[str, int] = {}
+            self._conn.execute("BEGIN")
+            try:
+                for insert in inserts:
+                    # Re-enqueues of a stored transaction are ignored and must not be counted
+                    if self._conn.execute(
+                        "INSERT OR IGNORE INTO offline_queue (transaction_id, terminal_id, payload, enqueued_at)"
+                        " VALUES (?, ?, ?, ?)",
+                        insert
+                    ).rowcount:
+                        inserted[insert[1]] = inserted.get(insert[1], 0) + 1
+                if retries:
+                    self._conn.executemany(
+                        "UPDATE offline_queue SET attempts = ?, not_before = ? WHERE transaction_id = ?",
+                        retries
+                    )
+                if acks:
+                    self._conn.executemany(
+                        "DELETE FROM offline_queue WHERE transaction_id = ?",
+                        [(transaction_id,) for transaction_id in acks]
+                    )
+                self._conn.execute("COMMIT")
+            except Exception as e:
+                self._conn.execute("ROLLBACK")
+                with self._lock:
+                    self._pending_acks = acks + self._pending_acks
+                    self._pending_retries = retries + self._pending_retries
+                # The enqueuers still own their transactions and are told the entries were not stored
+                for waiter in waiters:
+                    waiter.set_exception(e)
+                raise
+
+            with self._lock:
+                for terminal_id, count in inserted.items():
+                    self._counts[terminal_id] = self._counts.get(terminal_id, 0) + count
+            for waiter in waiters:
+                waiter.set_result(None)
+
+            self._deleted_since_compaction += len(acks)
+            if self._deleted_since_compaction >= self.compact_threshold:
+                self.compact()
+
+    def compact(self) -> None:
+        """Checkpoint the WAL and release pages freed by acknowledged entries"""
+        with self._write_lock:
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.execute("PRAGMA incremental_vacuum")
+            logger.info(f"Offline queue compacted after {self._deleted_since_compaction} acknowledgements")
+            self._deleted_since_compaction = 0
+
+    def lease(self, terminal_id: str, limit: int, exclude: set) -> List[Tuple[Transaction, int]]:
+        """
+        Read the oldest due entries for a terminal, skipping ones already leased
+
+        Args:
+            terminal_id: The terminal ID
+            limit: Maximum number of entries to return
+            exclude: Transaction IDs currently leased by the caller
+
+        Returns:
+            List[Tuple[Transaction, int]]: Entries and their failed attempt counts, in enqueue order
+        """
+        with self._write_lock:
+            self.flush()
+            rows = self._conn.execute(
+                "SELECT transaction_id, payload, attempts FROM offline_queue"
+                " WHERE terminal_id = ? AND not_before <= ? ORDER BY seq LIMIT ?",
+                (terminal_id, time.time(), limit + len(exclude))
+            ).fetchall()
+
+        entries = []
+        for transaction_id, payload, attempts in rows:
+            if transaction_id in exclude:
+                continue
+            entries.append((Transaction.from_dict(json.loads(payload)), attempts))
+            if len(entries) >= limit:
+                break
+        return entries
+
+    def next_due(self, terminal_id: str) -> Optional[float]:
+        """Get the earliest not_before of a terminal's entries, or None if it has none"""
+        with self._write_lock:
+            self.flush()
+            row = self._conn.execute(
+                "SELECT MIN(not_before) FROM offline_queue WHERE terminal_id = ?",
+                (terminal_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def count(self, terminal_id: str) -> int:
+        """Get the number of unacknowledged entries for a terminal"""
+        if self.shared:
+            # Committed rows from every worker plus this worker's not yet committed inserts
+            with self._lock:
+                pending = sum(1 for insert in self._pending_inserts if insert[1] == terminal_id)
+            with self._write_lock:
+                committed = self._conn.execute(
+                    "SELECT COUNT(*) FROM offline_queue WHERE terminal_id = ?", (terminal_id,)
+                ).fetchone()[0]
+            return committed + pending
+        with self._lock:
+            return self._counts.get(terminal_id, 0)
+
+    def close(self) -> None:
+        """Flush outstanding operations and close the database"""
+        self._stop.set()
+        self._wakeup.set()
+        self._flusher.join(timeout=2.0)
+        with self._write_lock:
+            self.flush()
+            self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self._conn.close()
+
+
+class OfflineQueue:
+    """
+    Per-terminal view of the durable offline store with a queue.Queue-like API
+
+    Entries handed out by get() or get_batch() are leased until ack() (synced),
+    release() (entry keeps its place in the queue) or retry() (entry keeps its
+    place but is skipped until its backoff delay has elapsed).
+    """
+
+    def __init__(self, terminal_id: str, store: Optional[OfflineQueueStore] = None):
+        """
+        Initialize the queue
+
+        Args:
+            terminal_id: The terminal that owns the entries
+            store: Shared store; defaults to the process-wide store
+        """
+        self.terminal_id = terminal_id
+        self.store = store or get_default_store()
+        self._leased: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def put(self, transaction: Transaction) -> None:
+        """
+        Enqueue a transaction for later synchronization, returning once it is committed
+
+        Raises:
+            Exception: The database error if the entry could not be stored
+        """
+        self.store.append(self.terminal_id, transaction).result()
+
+    async def put_async(self, transaction: Transaction) -> None:
+        """
+        Enqueue a transaction without blocking the event loop, returning once it is committed
+
+        Raises:
+            Exception: The database error if the entry could not be stored
+        """
+        await asyncio.wrap_future(self.store.append(self.terminal_id, transaction))
+
+    def get(self, block: bool = False) -> Transaction:
+        """
+        Lease the oldest unsynced transaction
+
+        Raises:
+            queue.Empty: If no entry is available
+        """
+        transactions = self.get_batch(1)
+        if not transactions:
+            raise queue.Empty
+        return transactions[0]
+
+    def get_batch(self, max_items: int) -> List[Transaction]:
+        """
+        Lease up to max_items of the oldest due transactions
+
+        Args:
+            max_items: Maximum number of transactions to lease
+
+        Returns:
+            List[Transaction]: Leased transactions in enqueue order (may be empty)
+        """
+        with self._lock:
+            entries = self.store.lease(self.terminal_id, max_items, self._leased)
+            for transaction, attempts in entries:
+                self._leased[transaction.transaction_id] = attempts
+        return [transaction for transaction, _ in entries]
+
+    def get_attempts(self, transaction_id: str) -> int:
+        """Get the number of failed sync attempts of a leased transaction"""
+        with self._lock:
+            return self._leased.get(transaction_id, 0)
+
+    def ack(self, transaction_id: str) -> None:
+        """Mark a leased transaction as synced"""
+        with self._lock:
+            self._leased.pop(transaction_id, None)
+        self.store.ack(self.terminal_id, transaction_id)
+
+    def release(self, transaction_id: str) -> None:
+        """Return a leased transaction to the queue in its original position"""
+        with self._lock:
+            self._leased.pop(transaction_id, None)
+
+    def retry(self, transaction_id: str, delay: float) -> None:
+        """
+        Return a leased transaction after a failed sync, keeping its position
+
+        Args:
+            transaction_id: The transaction ID
+            delay: Seconds before the transaction becomes due again
+        """
+        with self._lock:
+            attempts = self._leased.pop(transaction_id, 0) + 1
+            self.store.retry(transaction_id, attempts, time.time() + delay)
+
+    def next_due(self) -> Optional[float]:
+        """Get the epoch time the next unsynced transaction becomes due, or None if empty"""
+        return self.store.next_due(self.terminal_id)
+
+    def qsize(self) -> int:
+        """Get the number of unsynced transactions"""
+        return self.store.count(self.terminal_id)
+
+    def empty(self) -> bool:
+        """Check if there are no unsynced transactions"""
+        return self.qsize() == 0
+
+    async def empty_async(self) -> bool:
+        """Check if there are no unsynced transactions, counting a shared store off the event loop"""
+        if self.store.shared:
+            return await asyncio.to_thread(self.empty)
+        return self.empty()
+
+    def flush(self) -> None:
+        """Force buffered entries to disk"""
+        self.store.flush()
+
+
+_default_store = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> OfflineQueueStore:
+    """Get the process-wide offline queue store, opening it on first use"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = OfflineQueueStore(
+                OFFLINE_QUEUE_SETTINGS["path"],
+                shared=WORKER_SETTINGS["workers"] > 1
+            )
+        return _default_store
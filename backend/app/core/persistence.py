@@ -0,0 +1,340 @@
+"""
+Black Rock Payment Terminal - Write-Behind Transaction Persistence
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Dict, Any, Optional, List, Callable, Tuple
+
+from sqlalchemy.exc import OperationalError
+
+from app.core.transaction import Transaction
+from app.database import crud
+from app.database.models import SessionLocal, init_db
+from app.config.settings import PERSISTENCE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBufferFull(Exception):
+    """Raised when a transaction cannot be buffered because the database is not keeping up"""
+
+
+class TransactionWriter:
+    """
+    Write-behind persistence of processed transactions
+
+    put() snapshots a transaction's columns into an in-memory buffer and
+    returns; a flusher thread upserts everything buffered in one database
+    transaction every flush_interval, or as soon as flush_batch rows are
+    waiting, so thousands of rows share one commit. Writes of the same
+    transaction ID between two commits collapse into the latest one.
+
+    Callers that must not answer before the row is on disk ask for a
+    durability acknowledgement: a future resolved when the commit holding
+    the row completes, or failed if it could not be committed (the row
+    stays buffered and is retried).
+
+    A commit failing on a database-wide error (locked, disk full, lost
+    connection) puts the whole batch back. Any other error is taken to
+    come from a row: the batch is bisected so the other rows still commit,
+    and a row that fails on its own max_row_attempts times is quarantined
+    (logged and dropped from the buffer) instead of blocking every later
+    commit. The buffer is bounded: once
+    max_buffered rows are buffered or being committed, writers block until
+    a commit makes room and give up with WriteBufferFull after put_timeout.
+    """
+
+    def __init__(self, session_factory: Callable = SessionLocal, settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the writer and start its flusher
+
+        Args:
+            session_factory: Callable returning a database session
+            settings: Overrides for PERSISTENCE_SETTINGS
+        """
+        config = dict(PERSISTENCE_SETTINGS)
+        if settings:
+            config.update(settings)
+        self.session_factory = session_factory
+        self.flush_interval = config["flush_interval"]
+        self.flush_batch = config["flush_batch"]
+        self.max_buffered = config["max_buffered"]
+        self.put_timeout = config["put_timeout"]
+        self.retry_delay = config["retry_delay"]
+        self.max_row_attempts = config["max_row_attempts"]
+
+        self._lock = threading.Lock()
+        self._room = threading.Condition(self._lock)
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop = threading.Event()
+        self._pending: Dict[str, Dict[str, Any]] = {}
+        self._waiters: Dict[str, List[Future]] = {}
+        self._attempts: Dict[str, int] = {}
+        self._quarantine: Dict[str, Dict[str, Any]] = {}
+        self._committing = 0
+
+        self.rows_written = 0
+        self.commits = 0
+        self.failed_commits = 0
+        self.quarantined_rows = 0
+        self.blocked_puts = 0
+        self.rejected_puts = 0
+        self.last_commit_rows = 0
+        self.last_commit_seconds = 0.0
+
+        self._flusher = threading.Thread(target=self._flush_worker, daemon=True)
+        self._flusher.start()
+
+    def _flush_worker(self) -> None:
+        """Commit buffered rows every flush_interval or when a batch fills up; back off after failures"""
+        while not self._stop.is_set():
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Transaction persistence flush error: {str(e)}")
+                self._stop.wait(self.retry_delay)
+
+    def _has_room(self, transaction_id: str) -> bool:
+        """Check if a row fits in the buffer (replacing a buffered row always fits); lock held"""
+        return (
+            len(self._pending) + self._committing < self.max_buffered
+            or transaction_id in self._pending
+        )
+
+    def _buffer(self, row: Dict[str, Any], durable: bool) -> Optional[Future]:
+        """Add a row to the buffer; lock held"""
+        self._pending[row["transaction_id"]] = row
+        waiter = None
+        first_waiter = not self._waiters
+        if durable:
+            waiter = Future()
+            self._waiters.setdefault(row["transaction_id"], []).append(waiter)
+        if len(self._pending) >= self.flush_batch or (durable and first_waiter):
+            # Durable writers are waiting on this commit; do not hold them for the full interval
+            self._wakeup.set()
+        return waiter
+
+    def _put_row(self, row: Dict[str, Any], durable: bool, timeout: Optional[float]) -> Optional[Future]:
+        """Buffer a row, blocking while the buffer is full"""
+        timeout = self.put_timeout if timeout is None else timeout
+        with self._room:
+            if not self._has_room(row["transaction_id"]):
+                self.blocked_puts += 1
+                self._wakeup.set()
+                if not self._room.wait_for(lambda: self._has_room(row["transaction_id"]), timeout):
+                    self.rejected_puts += 1
+                    raise WriteBufferFull(
+                        f"Transaction write buffer full ({self.max_buffered} rows) for {timeout}s"
+                    )
+            return self._buffer(row, durable)
+
+    def put(self, transaction: Transaction, durable: bool = False,
+            timeout: Optional[float] = None) -> Optional[Future]:
+        """
+        Buffer a transaction for the next group commit
+
+        Args:
+            transaction: The transaction; its current column values are written
+            durable: Whether to return a durability acknowledgement
+            timeout: Seconds to wait for room in a full buffer (defaults to put_timeout)
+
+        Returns:
+            Optional[Future]: With durable, a future resolved once the row is committed
+
+        Raises:
+            WriteBufferFull: If the buffer stayed full for the whole timeout
+        """
+        return self._put_row(crud.transaction_row(transaction), durable, timeout)
+
+    async def put_async(self, transaction: Transaction, durable: bool = False,
+                        timeout: Optional[float] = None) -> None:
+        """
+        Buffer a transaction from an event loop without blocking it on a full buffer
+
+        Args:
+            transaction: The transaction; its current column values are written
+            durable: Whether to return only once the row is committed
+            timeout: Seconds to wait for room in a full buffer (defaults to put_timeout)
+
+        Raises:
+            WriteBufferFull: If the buffer stayed full for the whole timeout
+            Exception: With durable, the error of a failed commit
+        """
+        row = crud.transaction_row(transaction)
+        with self._lock:
+            full = not self._has_room(row["transaction_id"])
+            if not full:
+                waiter = self._buffer(row, durable)
+        if full:
+            # Wait for room on an executor thread, never on the event loop
+            waiter = await asyncio.get_running_loop().run_in_executor(None, self._put_row, row, durable, timeout)
+        if waiter is not None:
+            await asyncio.wrap_future(waiter)
+
+    def _commit(self, rows: List[Dict[str, Any]]) -> None:
+        """Upsert rows in one database transaction"""
+        db = self.session_factory()
+        try:
+            crud.upsert_transactions(db, rows)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def _commit_isolating(self, rows: List[Dict[str, Any]], committed: List[Dict[str, Any]],
+                          failed: List[Tuple[Dict[str, Any], Exception, bool]]) -> Tuple[int, int]:
+        """
+        Commit rows, bisecting a batch that fails on a row error so the other rows still commit
+
+        Args:
+            rows: The rows
+            committed: Collects the committed rows
+            failed: Collects (row, error, isolated) for rows not committed; isolated
+                when the row failed in a commit of its own
+
+        Returns:
+            Tuple[int, int]: Successful and failed commits
+        """
+        try:
+            self._commit(rows)
+        except OperationalError as e:
+            # The database itself is failing; splitting the batch would not help
+            failed.extend((row, e, False) for row in rows)
+            return 0, 1
+        except Exception as e:
+            if len(rows) == 1:
+                failed.append((rows[0], e, True))
+                return 0, 1
+            middle = len(rows) // 2
+            first = self._commit_isolating(rows[:middle], committed, failed)
+            second = self._commit_isolating(rows[middle:], committed, failed)
+            return first[0] + second[0], 1 + first[1] + second[1]
+        committed.extend(rows)
+        return 1, 0
+
+    def flush(self) -> None:
+        """
+        Upsert all buffered rows in one transaction and acknowledge their writers
+
+        Raises:
+            Exception: The database error when rows were put back in the buffer
+        """
+        with self._write_lock:
+            with self._lock:
+                if not self._pending:
+                    return
+                rows, self._pending = self._pending, {}
+                waiters, self._waiters = self._waiters, {}
+                self._committing = len(rows)
+
+            # Writers keep filling the fresh buffer while this commit runs
+            started = time.perf_counter()
+            committed: List[Dict[str, Any]] = []
+            failed: List[Tuple[Dict[str, Any], Exception, bool]] = []
+            commits, failed_commits = self._commit_isolating(list(rows.values()), committed, failed)
+
+            retry_error = None
+            with self._room:
+                self._committing = 0
+                self.rows_written += len(committed)
+                self.commits += commits
+                self.failed_commits += failed_commits
+                if commits:
+                    self.last_commit_rows = len(committed)
+                    self.last_commit_seconds = time.perf_counter() - started
+                for row in committed:
+                    self._attempts.pop(row["transaction_id"], None)
+                for row, error, isolated in failed:
+                    transaction_id = row["transaction_id"]
+                    if transaction_id in self._pending:
+                        # Written again since the swap; the newer row gets its own attempts
+                        self._attempts.pop(transaction_id, None)
+                        continue
+                    attempts = self._attempts.get(transaction_id, 0) + isolated
+                    if attempts >= self.max_row_attempts:
+                        self._attempts.pop(transaction_id, None)
+                        self._quarantine[transaction_id] = row
+                        self.quarantined_rows += 1
+                        logger.error(
+                            f"Quarantined transaction {transaction_id} after {attempts} failed commits: {str(error)}"
+                        )
+                        continue
+                    self._attempts[transaction_id] = attempts
+                    self._pending[transaction_id] = row
+                    retry_error = retry_error or error
+                self._room.notify_all()
+
+            for row in committed:
+                for waiter in waiters.get(row["transaction_id"], ()):
+                    waiter.set_result(None)
+            for row, error, _ in failed:
+                for waiter in waiters.get(row["transaction_id"], ()):
+                    waiter.set_exception(error)
+            if retry_error is not None:
+                raise retry_error
+
+    def quarantined(self) -> List[Dict[str, Any]]:
+        """
+        Get the rows quarantined after failing to commit on their own
+
+        Returns:
+            List[Dict[str, Any]]: The column values of each quarantined row
+        """
+        with self._lock:
+            return list(self._quarantine.values())
+
+    def buffered(self) -> int:
+        """Get the number of rows buffered or being committed"""
+        with self._lock:
+            return len(self._pending) + self._committing
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get write-behind statistics
+
+        Returns:
+            Dict[str, Any]: Buffer depth, rows written, commits and backpressure counters
+        """
+        with self._lock:
+            return {
+                "buffered": len(self._pending) + self._committing,
+                "max_buffered": self.max_buffered,
+                "rows_written": self.rows_written,
+                "commits": self.commits,
+                "failed_commits": self.failed_commits,
+                "quarantined_rows": self.quarantined_rows,
+                "blocked_puts": self.blocked_puts,
+                "rejected_puts": self.rejected_puts,
+                "last_commit_rows": self.last_commit_rows,
+                "last_commit_seconds": round(self.last_commit_seconds, 6),
+            }
+
+    def close(self) -> None:
+        """Stop the flusher and commit the remaining rows"""
+        self._stop.set()
+        self._wakeup.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+
+
+_default_writer: Optional[TransactionWriter] = None
+_default_writer_lock = threading.Lock()
+
+
+def get_default_writer() -> TransactionWriter:
+    """Get the process-wide transaction writer, creating the tables and starting it on first use"""
+    global _default_writer
+    with _default_writer_lock:
+        if _default_writer is None:
+            init_db()
+            _default_writer = TransactionWriter()
+        return _default_writer
@@ -2,25 +2,33 @@
 Black Rock Payment Terminal - Transaction Processor
 """
 
-import json
 import time
+import asyncio
+import random
 import logging
 import datetime
 import threading
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, Callable, Awaitable
 from enum import Enum
-import queue
-import requests
-from requests.exceptions import RequestException
+import httpx
 
 from app.core.transaction import Transaction, TransactionStatus, TransactionType
-from app.config.settings import PROTOCOLS, MTI_TYPES, SUPPORTED_CURRENCIES, TERMINAL_SETTINGS, NETWORK_SETTINGS
+from app.core.transport import HostUnavailableError
+from app.protocols.iso8583 import transaction_to_fields
+from app.core.runtime import ProcessorRuntime
+from app.core.breaker import backoff_delay
+from app.core.offline_queue import OfflineQueue
+from app.core.sync import OfflineSyncEngine
+from app.core.reversal import ReversalQueue, ReversalEngine, is_ambiguous, needs_reversal
+from app.core.history import TransactionHistory
+from app.core.settlement import SettlementLedger
+from app.core.persistence import get_default_writer
+from app.database.models import SessionLocal, AsyncSessionLocal
+from app.config.settings import PROTOCOLS, NETWORK_SETTINGS, PERSISTENCE_SETTINGS
+from app.config.terminal import TerminalConfig
+from app.utils.metrics import StageTimer, STAGE_SECONDS, TRANSACTIONS, HOST_RETRIES
+from app.utils.codec import decode_response
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
@@ -32,76 +40,198 @@ class ProcessorStatus(Enum):
     OFFLINE = "OFFLINE"
 
 
+class ProcessorScheduler:
+    """
+    Event-driven wakeups for a processor's background jobs
+
+    The offline sync and reversal engines each sleep on their own event, set
+    when a transaction is queued for them or the terminal comes back online,
+    instead of polling. Any
+    successful host exchange counts as liveness and pushes the next heartbeat
+    out, so heartbeats are only sent when the link is otherwise idle. All
+    timers live on the runtime's shared TimerWheel.
+    """
+    
+    def __init__(self, runtime: ProcessorRuntime, heartbeat_interval: float):
+        """
+        Initialize the scheduler
+        
+        Args:
+            runtime: The runtime whose event loop and timer wheel drive the jobs
+            heartbeat_interval: Seconds of host silence before a heartbeat is due
+        """
+        self.runtime = runtime
+        self.loop = runtime.loop
+        self.heartbeat_interval = heartbeat_interval
+        self.last_liveness = time.monotonic() - heartbeat_interval  # First heartbeat is due immediately
+        self.heartbeats_suppressed = 0
+        self._heartbeat = None
+        self._heartbeat_timer = None
+        self._heartbeat_task = None
+        self._stopped = False
+    
+    def wake(self, event: asyncio.Event) -> None:
+        """Set a background job's wakeup event (safe to call from any thread)"""
+        self.runtime.call_soon(event.set)
+    
+    async def wait_for_work(self, event: asyncio.Event, timeout: float) -> None:
+        """Sleep until a background job's wakeup event is set or until timeout elapses"""
+        timer = self.runtime.wheel.schedule(timeout, event.set)
+        try:
+            await event.wait()
+        finally:
+            timer.cancel()
+        event.clear()
+    
+    def record_liveness(self) -> None:
+        """Record a successful exchange with the host"""
+        self.last_liveness = time.monotonic()
+    
+    def heartbeat_delay(self) -> float:
+        """Get the seconds until the next heartbeat is due (0 if due now)"""
+        return max(self.last_liveness + self.heartbeat_interval - time.monotonic(), 0.0)
+    
+    def start_heartbeats(self, heartbeat: Callable[[], Awaitable[None]]) -> None:
+        """
+        Start calling heartbeat whenever the host has been silent for heartbeat_interval
+        
+        Args:
+            heartbeat: Coroutine function that sends one heartbeat
+        """
+        self._heartbeat = heartbeat
+        # Spread the first heartbeat over the interval so that terminals started
+        # together on a shared runtime do not all hit the host in the same tick
+        self.runtime.call_soon(self._schedule_heartbeat, random.uniform(0, self.heartbeat_interval))
+    
+    def stop(self) -> None:
+        """Stop the heartbeat timer (safe to call from any thread)"""
+        self._stopped = True
+        
+        def cancel():
+            if self._heartbeat_timer is not None:
+                self._heartbeat_timer.cancel()
+            if self._heartbeat_task is not None:
+                self._heartbeat_task.cancel()
+        
+        self.runtime.call_soon(cancel)
+    
+    def _schedule_heartbeat(self, delay: float) -> None:
+        """Arm the heartbeat timer (event loop only)"""
+        if not self._stopped:
+            scheduled_from = self.last_liveness
+            self._heartbeat_timer = self.runtime.wheel.schedule(
+                delay, lambda: self._on_heartbeat_timer(scheduled_from)
+            )
+    
+    def _on_heartbeat_timer(self, scheduled_from: float) -> None:
+        """Send a heartbeat if one is due, otherwise re-arm for the remaining silence"""
+        delay = self.heartbeat_delay()
+        if delay > 0:
+            if self.last_liveness != scheduled_from:
+                self.heartbeats_suppressed += 1
+            self._schedule_heartbeat(delay)
+            return
+        self._heartbeat_task = self.loop.create_task(self._run_heartbeat())
+    
+    async def _run_heartbeat(self) -> None:
+        """Send one heartbeat and re-arm the timer"""
+        try:
+            await self._heartbeat()
+        except Exception as e:
+            logger.error(f"Heartbeat error: {str(e)}")
+        self._schedule_heartbeat(self.heartbeat_delay() or self.heartbeat_interval)
+
+
 class TransactionProcessor:
     """
     Handles transaction processing including online/offline modes,
     protocol handling, and server communication
     """
     
-    def __init__(self, merchant_id: str, terminal_id: str, server_url: str):
-        """Initialize the transaction processor"""
-        self.merchant_id = merchant_id
-        self.terminal_id = terminal_id
-        self.server_url = server_url
+    def __init__(self, merchant_id: str, terminal_id: str, server_url: str,
+                 runtime: Optional[ProcessorRuntime] = None,
+                 backup_server_url: Optional[str] = None,
+                 config: Optional[TerminalConfig] = None,
+                 owner: bool = True):
+        """
+        Initialize the transaction processor
+
+        Args:
+            merchant_id: The merchant ID
+            terminal_id: The terminal ID
+            server_url: The payment server base URL
+            runtime: Shared event loop, timer wheel and host transports. When
+                omitted the processor starts and owns a private runtime.
+            backup_server_url: Backup payment server used while the primary's
+                circuit is open (defaults to NETWORK_SETTINGS["backup_server_url"])
+            config: Full terminal configuration; overrides the individual arguments
+            owner: Whether this worker process owns the terminal's background jobs.
+                Non-owners process payments but leave keep-alive heartbeats and
+                draining the shared offline queue to the owning worker.
+        """
+        self.config = config or TerminalConfig(
+            merchant_id, terminal_id, server_url, backup_server_url=backup_server_url
+        )
+        self.merchant_id = self.config.merchant_id
+        self.terminal_id = self.config.terminal_id
+        self.server_url = self.config.server_url
+        self.backup_server_url = self.config.backup_server_url
+        self.owner = owner
         self.status = ProcessorStatus.IDLE
-        self.offline_queue = queue.Queue()
-        self.transaction_history = []
+        self.offline_queue = OfflineQueue(self.terminal_id)
+        self.sync_engine = OfflineSyncEngine(self)
+        self.reversal_queue = ReversalQueue(self.terminal_id)
+        self.reversal_engine = ReversalEngine(self, self.reversal_queue)
+        self.transaction_history = TransactionHistory(
+            self.terminal_id, session_factory=SessionLocal, async_session_factory=AsyncSessionLocal
+        )
+        self.settlement = SettlementLedger(self.terminal_id, self.merchant_id)
+        self.writer = get_default_writer() if PERSISTENCE_SETTINGS["enabled"] else None
         self.is_online = True
         self.last_heartbeat = datetime.datetime.now()
-        self.heartbeat_thread = None
-        self.offline_sync_thread = None
         self.stop_threads = threading.Event()
         
-        # Update terminal settings
-        TERMINAL_SETTINGS["merchant_id"] = merchant_id
-        TERMINAL_SETTINGS["terminal_id"] = terminal_id
-        NETWORK_SETTINGS["server_url"] = server_url
-        
-        logger.info(f"Transaction processor initialized for merchant {merchant_id}, terminal {terminal_id}")
-        
-        # Start heartbeat thread
-        self._start_heartbeat_thread()
-    
-    def _start_heartbeat_thread(self) -> None:
-        """Start the heartbeat thread to monitor server connectivity"""
-        def heartbeat_worker():
-            while not self.stop_threads.is_set():
-                try:
-                    self._send_heartbeat()
-                    time.sleep(NETWORK_SETTINGS["heartbeat_interval"])
-                except Exception as e:
-                    logger.error(f"Heartbeat error: {str(e)}")
-                    time.sleep(10)  # Shorter interval for retry
-        
-        self.heartbeat_thread = threading.Thread(target=heartbeat_worker, daemon=True)
-        self.heartbeat_thread.start()
-        logger.info("Heartbeat monitoring thread started")
-    
-    def _start_offline_sync_thread(self) -> None:
-        """Start the offline transaction synchronization thread"""
-        def offline_sync_worker():
-            while not self.stop_threads.is_set():
-                if self.is_online and not self.offline_queue.empty():
-                    try:
-                        transaction = self.offline_queue.get(block=False)
-                        logger.info(f"Attempting to sync offline transaction {transaction.transaction_id}")
-                        success = self._sync_offline_transaction(transaction)
-                        if success:
-                            logger.info(f"Successfully synced offline transaction {transaction.transaction_id}")
-                        else:
-                            logger.warning(f"Failed to sync offline transaction {transaction.transaction_id}, requeuing")
-                            self.offline_queue.put(transaction)
-                    except queue.Empty:
-                        pass
-                    except Exception as e:
-                        logger.error(f"Error in offline sync: {str(e)}")
-                time.sleep(30)  # Check every 30 seconds
-        
-        self.offline_sync_thread = threading.Thread(target=offline_sync_worker, daemon=True)
-        self.offline_sync_thread.start()
-        logger.info("Offline transaction sync thread started")
-    
-    def _send_heartbeat(self) -> None:
+        # Event loop, timer wheel and host connections, shared when hosted by a registry
+        self._owns_runtime = runtime is None
+        self.runtime = runtime or ProcessorRuntime()
+        self.loop = self.runtime.loop
+        self.transport = self.runtime.get_transport(self.server_url, self.backup_server_url)
+        self.host_link = self.runtime.get_host_link(self.config.iso_host_url) if self.config.iso_host_url else None
+        self.scheduler = ProcessorScheduler(self.runtime, self.config.heartbeat_interval)
+        
+        logger.info(f"Transaction processor initialized for merchant {self.merchant_id}, terminal {self.terminal_id}")
+        
+        # Start heartbeat monitoring
+        self.scheduler.start_heartbeats(self._heartbeat)
+        
+        # Drain transactions recovered from a previous run; with a shared store
+        # other workers enqueue for this terminal too, so the owner always drains
+        if self.offline_queue.store.shared or not self.offline_queue.empty():
+            self._start_offline_sync()
+        if self.reversal_queue.store.shared or not self.reversal_queue.empty():
+            self._start_reversals()
+    
+    async def _heartbeat(self) -> None:
+        """Send a heartbeat; while offline, treat the probe itself as the next interval's start"""
+        if not self.owner and self.is_online:
+            # The owning worker keeps the link alive; non-owners only probe to recover from offline
+            self.scheduler.record_liveness()
+            return
+        await self._send_heartbeat()
+        if not self.is_online:
+            self.scheduler.record_liveness()
+    
+    def _start_offline_sync(self) -> None:
+        """Start the offline synchronization engine if it is not already running (owner only)"""
+        if self.owner:
+            self.sync_engine.start()
+    
+    def _start_reversals(self) -> None:
+        """Start the reversal engine if it is not already running (owner only)"""
+        if self.owner:
+            self.reversal_engine.start()
+    
+    async def _send_heartbeat(self) -> None:
         """Send a heartbeat message to the server to check connectivity"""
         try:
             payload = {
@@ -111,36 +241,37 @@ class TransactionProcessor:
                 "message_type": "heartbeat"
             }
             
-            response = requests.post(
-                f"{self.server_url}/heartbeat",
-                json=payload,
-                timeout=TERMINAL_SETTINGS["timeout_seconds"]
-            )
+            response = await self.transport.apost("/heartbeat", payload)
             
             if response.status_code == 200:
-                self.is_online = True
                 self.last_heartbeat = datetime.datetime.now()
                 logger.debug("Heartbeat successful")
-                
-                # If we were offline before, log the reconnection
-                if self.status == ProcessorStatus.OFFLINE:
-                    logger.info("Terminal is back online")
-                    self.status = ProcessorStatus.IDLE
-                    
-                    # Start offline sync if not already running
-                    if not self.offline_sync_thread or not self.offline_sync_thread.is_alive():
-                        self._start_offline_sync_thread()
+                self._handle_online_mode()
             else:
                 logger.warning(f"Heartbeat failed with status code {response.status_code}")
                 self._handle_offline_mode()
                 
-        except RequestException as e:
+        except httpx.HTTPError as e:
             logger.warning(f"Heartbeat connection error: {str(e)}")
             self._handle_offline_mode()
         except Exception as e:
             logger.error(f"Unexpected error in heartbeat: {str(e)}")
             self._handle_offline_mode()
     
+    def _handle_online_mode(self) -> None:
+        """Record host liveness and handle the transition back to online mode"""
+        self.scheduler.record_liveness()
+        if not self.is_online:
+            self.is_online = True
+            self.status = ProcessorStatus.IDLE
+            logger.info("Terminal is back online")
+            
+            # Drain the offline and reversal queues right away instead of waiting for the next poll
+            self._start_offline_sync()
+            self._start_reversals()
+            self.sync_engine.wake()
+            self.reversal_engine.wake()
+    
     def _handle_offline_mode(self) -> None:
         """Handle transition to offline mode"""
         if self.is_online:
@@ -148,53 +279,45 @@ class TransactionProcessor:
             self.status = ProcessorStatus.OFFLINE
             logger.warning("Terminal is now in OFFLINE mode")
     
-    def _sync_offline_transaction(self, transaction: Transaction) -> bool:
-        """
-        Attempt to synchronize an offline transaction with the server
-        Returns True if successful, False otherwise
-        """
-        try:
-            # Prepare the transaction data for transmission
-            payload = {
-                "transaction": transaction.to_dict(),
-                "terminal_id": self.terminal_id,
-                "merchant_id": self.merchant_id,
-                "sync_timestamp": datetime.datetime.now().isoformat()
-            }
-            
-            response = requests.post(
-                f"{self.server_url}/sync_offline",
-                json=payload,
-                timeout=TERMINAL_SETTINGS["timeout_seconds"]
-            )
-            
-            if response.status_code == 200:
-                response_data = response.json()
-                if response_data.get("status") == "success":
-                    # Update the transaction with server response if needed
-                    if "server_approval_code" in response_data:
-                        transaction.approval_code = response_data["server_approval_code"]
-                    
-                    logger.info(f"Offline transaction {transaction.transaction_id} successfully synced")
-                    return True
-                else:
-                    logger.warning(f"Server rejected offline transaction: {response_data.get('message', 'Unknown error')}")
-                    return False
-            else:
-                logger.warning(f"Offline sync failed with status code {response.status_code}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Error syncing offline transaction: {str(e)}")
-            return False
-    
     def process_transaction(self, transaction: Transaction) -> Transaction:
         """
         Process a transaction either online or offline based on current connectivity
         and transaction requirements
+
+        Synchronous wrapper around process_transaction_async for existing callers.
+        Must not be called from the processor event loop itself.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._process_transaction(transaction), self.loop)
+        return future.result()
+    
+    async def process_transaction_async(self, transaction: Transaction) -> Transaction:
         """
+        Process a transaction without blocking the caller's event loop
+
+        The work always runs on the processor event loop so the shared async HTTP
+        client is only ever used from one loop; awaiting from another loop (e.g.
+        the FastAPI loop) simply waits for the result.
+        """
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        
+        if running_loop is self.loop:
+            return await self._process_transaction(transaction)
+        
+        future = asyncio.run_coroutine_threadsafe(self._process_transaction(transaction), self.loop)
+        return await asyncio.wrap_future(future)
+    
+    async def _process_transaction(self, transaction: Transaction) -> Transaction:
+        """Process a transaction on the processor event loop"""
         self.status = ProcessorStatus.PROCESSING
-        logger.info(f"Processing transaction {transaction.transaction_id}")
+        started = time.perf_counter()
+        
+        # Assign the open batch before any message is sent, then make the
+        # transaction visible to lookups while it is in flight
+        self.settlement.begin(transaction)
+        self.transaction_history.add(transaction)
         
         # Check if this transaction type can be processed offline
         protocol_info = PROTOCOLS[transaction.protocol]
@@ -207,21 +330,21 @@ class TransactionProcessor:
         
         try:
             if should_process_online:
-                logger.info(f"Processing transaction {transaction.transaction_id} ONLINE")
-                self._process_online(transaction)
+                logger.debug("Processing transaction %s ONLINE", transaction.transaction_id)
+                await self._process_online_async(transaction)
             else:
                 if can_process_offline:
-                    logger.info(f"Processing transaction {transaction.transaction_id} OFFLINE")
-                    self._process_offline(transaction)
+                    logger.debug("Processing transaction %s OFFLINE", transaction.transaction_id)
+                    await self._process_offline_async(transaction)
                 else:
-                    logger.warning(f"Transaction {transaction.transaction_id} requires online processing but terminal is offline")
+                    logger.warning("Transaction %s requires online processing but terminal is offline", transaction.transaction_id)
                     transaction.update_status(
                         TransactionStatus.ERROR,
                         response_code="E1001",
                         response_message="Transaction requires online processing but terminal is offline"
                     )
         except Exception as e:
-            logger.error(f"Error processing transaction: {str(e)}")
+            logger.error("Error processing transaction %s: %s", transaction.transaction_id, e)
             transaction.update_status(
                 TransactionStatus.ERROR,
                 response_code="E9999",
@@ -230,53 +353,71 @@ class TransactionProcessor:
         finally:
             self.status = ProcessorStatus.IDLE if self.is_online else ProcessorStatus.OFFLINE
             
-            # Add to transaction history
-            self.transaction_history.append(transaction)
+            outcome = transaction.status.value
+            STAGE_SECONDS.labels("process", transaction.protocol, transaction.mti or "", outcome).observe(
+                time.perf_counter() - started
+            )
+            TRANSACTIONS.labels(transaction.protocol, transaction.mti or "", outcome).inc()
+            self.settlement.record(transaction)
+            await self._persist(transaction)
+            logger.info(
+                "Transaction %s processed: %s", transaction.transaction_id, outcome,
+                extra={"terminal_id": self.terminal_id, "mti": transaction.mti, "amount": transaction.amount}
+            )
             
             return transaction
     
-    def _process_online(self, transaction: Transaction) -> None:
+    async def _persist(self, transaction: Transaction) -> None:
+        """Hand a processed transaction to the write-behind buffer; the outcome stands even if this fails"""
+        if self.writer is None:
+            return
+        try:
+            await self.writer.put_async(transaction, durable=PERSISTENCE_SETTINGS["durable"])
+        except Exception as e:
+            logger.error("Transaction %s not persisted: %s", transaction.transaction_id, e)
+    
+    async def _process_online_async(self, transaction: Transaction) -> None:
         """Process a transaction online by communicating with the payment server"""
-        # Set appropriate MTI based on transaction type
-        if transaction.transaction_type == TransactionType.SALE:
-            transaction.set_mti("0200")  # Financial Transaction Request
-        elif transaction.transaction_type == TransactionType.REFUND:
-            transaction.set_mti("0200")  # Financial Transaction Request (with refund indicator)
-        elif transaction.transaction_type == TransactionType.VOID:
-            transaction.set_mti("0200")  # Financial Transaction Request (with void indicator)
-        elif transaction.transaction_type == TransactionType.PRE_AUTH:
-            transaction.set_mti("0100")  # Authorization Request
-        elif transaction.transaction_type == TransactionType.PRE_AUTH_COMPLETION:
-            transaction.set_mti("0220")  # Financial Transaction Advice
-        elif transaction.transaction_type == TransactionType.BALANCE_INQUIRY:
-            transaction.set_mti("0100")  # Authorization Request (with balance inquiry indicator)
-        
-        # Update transaction status
-        transaction.update_status(TransactionStatus.PROCESSING)
-        
-        # Prepare the request payload
-        payload = {
-            "mti": transaction.mti,
-            "transaction": transaction.to_dict(),
-            "terminal_id": self.terminal_id,
-            "merchant_id": self.merchant_id,
-            "timestamp": datetime.datetime.now().isoformat()
-        }
+        with StageTimer("protocol_prep", transaction.protocol) as prep_timer:
+            # Set appropriate MTI based on transaction type
+            if transaction.transaction_type == TransactionType.SALE:
+                transaction.set_mti("0200")  # Financial Transaction Request
+            elif transaction.transaction_type == TransactionType.REFUND:
+                transaction.set_mti("0200")  # Financial Transaction Request (with refund indicator)
+            elif transaction.transaction_type == TransactionType.VOID:
+                transaction.set_mti("0200")  # Financial Transaction Request (with void indicator)
+            elif transaction.transaction_type == TransactionType.PRE_AUTH:
+                transaction.set_mti("0100")  # Authorization Request
+            elif transaction.transaction_type == TransactionType.PRE_AUTH_COMPLETION:
+                transaction.set_mti("0220")  # Financial Transaction Advice
+            elif transaction.transaction_type == TransactionType.BALANCE_INQUIRY:
+                transaction.set_mti("0100")  # Authorization Request (with balance inquiry indicator)
+            
+            # Update transaction status
+            transaction.update_status(TransactionStatus.PROCESSING)
+            
+            # Prepare the request payload
+            payload = {
+                "mti": transaction.mti,
+                "transaction": transaction.to_dict(),
+                "terminal_id": self.terminal_id,
+                "merchant_id": self.merchant_id,
+                "timestamp": datetime.datetime.now().isoformat()
+            }
+            prep_timer.mti = transaction.mti
         
         # Send the request to the server
         retry_count = 0
         max_retries = NETWORK_SETTINGS["retry_attempts"]
+        # Set once an attempt fails after the host may have received it
+        ambiguous = False
         
         while retry_count <= max_retries:
             try:
-                response = requests.post(
-                    f"{self.server_url}/process",
-                    json=payload,
-                    timeout=TERMINAL_SETTINGS["timeout_seconds"]
-                )
+                status_code, response_data = await self._send_online(transaction, payload)
                 
-                if response.status_code == 200:
-                    response_data = response.json()
+                if status_code == 200:
+                    self._handle_online_mode()
                     
                     # Process the response
                     if response_data.get("approved", False):
@@ -300,32 +441,50 @@ class TransactionProcessor:
                     break
                     
                 else:
-                    logger.warning(f"Server returned status code {response.status_code}")
+                    logger.warning("Server returned status code %s", status_code)
                     retry_count += 1
                     
                     if retry_count <= max_retries:
-                        logger.info(f"Retrying transaction {transaction.transaction_id} (attempt {retry_count}/{max_retries})")
-                        time.sleep(NETWORK_SETTINGS["retry_delay"])
+                        HOST_RETRIES.labels(transaction.protocol, transaction.mti or "", f"http_{status_code}").inc()
+                        logger.info("Retrying transaction %s (attempt %s/%s)", transaction.transaction_id, retry_count, max_retries)
+                        await asyncio.sleep(self._retry_delay(retry_count))
                     else:
                         transaction.update_status(
                             TransactionStatus.ERROR,
                             response_code="E2002",
-                            response_message=f"Server error: HTTP {response.status_code}"
+                            response_message=f"Server error: HTTP {status_code}"
                         )
                         
-            except RequestException as e:
-                logger.warning(f"Connection error: {str(e)}")
+            except httpx.HTTPError as e:
+                logger.warning("Connection error: %s", e)
                 retry_count += 1
+                ambiguous = ambiguous or is_ambiguous(e)
+                
+                if isinstance(e, HostUnavailableError):
+                    # Every host's circuit is open: fail fast instead of retrying a dead acquirer
+                    retry_count = max_retries + 1
                 
                 if retry_count <= max_retries:
-                    logger.info(f"Retrying transaction {transaction.transaction_id} (attempt {retry_count}/{max_retries})")
-                    time.sleep(NETWORK_SETTINGS["retry_delay"])
+                    HOST_RETRIES.labels(transaction.protocol, transaction.mti or "", type(e).__name__).inc()
+                    logger.info("Retrying transaction %s (attempt %s/%s)", transaction.transaction_id, retry_count, max_retries)
+                    await asyncio.sleep(self._retry_delay(retry_count))
                 else:
                     # If we've exhausted retries, check if we can process offline
                     protocol_info = PROTOCOLS[transaction.protocol]
-                    if not protocol_info["is_onledger"]:
-                        logger.info(f"Falling back to offline processing for transaction {transaction.transaction_id}")
-                        self._process_offline(transaction)
+                    if ambiguous and needs_reversal(transaction):
+                        # The host may have approved an attempt it never answered: reverse it.
+                        # No offline stand-in, or the host could get the advice of a sale
+                        # before the reversal of the same sale.
+                        await self._queue_reversal_async(transaction)
+                        transaction.update_status(
+                            TransactionStatus.TIMEOUT,
+                            response_code="E2004",
+                            response_message=f"No response from host, reversal queued: {str(e)}"
+                        )
+                        self._handle_offline_mode()
+                    elif not protocol_info["is_onledger"]:
+                        logger.info("Falling back to offline processing for transaction %s", transaction.transaction_id)
+                        await self._process_offline_async(transaction)
                     else:
                         transaction.update_status(
                             TransactionStatus.ERROR,
@@ -335,7 +494,7 @@ class TransactionProcessor:
                         self._handle_offline_mode()
                         
             except Exception as e:
-                logger.error(f"Unexpected error in online processing: {str(e)}")
+                logger.error("Unexpected error in online processing: %s", e)
                 transaction.update_status(
                     TransactionStatus.ERROR,
                     response_code="E9999",
@@ -343,14 +502,59 @@ class TransactionProcessor:
                 )
                 break
     
-    def _process_offline(self, transaction: Transaction) -> None:
-        """Process a transaction offline"""
+    async def _queue_reversal_async(self, transaction: Transaction) -> None:
+        """Queue a 0500 reversal of an unanswered transaction; sent in the background"""
+        logger.warning("Queueing reversal of unanswered transaction %s", transaction.transaction_id)
+        try:
+            await self.reversal_queue.put_async(transaction)
+        except Exception as e:
+            logger.error("Reversal of transaction %s could not be queued: %s", transaction.transaction_id, e)
+            return
+        self._start_reversals()
+        self.reversal_engine.wake()
+    
+    async def _send_online(self, transaction: Transaction, payload: Dict[str, Any]) -> Tuple[int, Dict[str, Any]]:
+        """
+        Send a payment message to the ISO 8583 host link, or to the HTTP host when none is configured
+        
+        Returns:
+            Tuple[int, Dict[str, Any]]: The HTTP status (200 for any ISO 8583 response)
+            and the decoded response (empty unless the status is 200)
+        """
+        if self.host_link is not None:
+            mti, values = transaction_to_fields(transaction)
+            _, response = await self.host_link.request(transaction.protocol, mti, values)
+            response_data = {"approved": response.get(39) == "00"}
+            for number, key in ((38, "approval_code"), (39, "response_code"), (44, "response_message")):
+                if number in response:
+                    response_data[key] = response[number]
+            return 200, response_data
+        
+        if NETWORK_SETTINGS["hedging_enabled"] and self._is_idempotent(transaction):
+            response = await self.transport.apost_hedged("/process", payload)
+        else:
+            response = await self.transport.apost("/process", payload)
+        if response.status_code != 200:
+            return response.status_code, {}
+        return 200, decode_response(response)
+    
+    @staticmethod
+    def _is_idempotent(transaction: Transaction) -> bool:
+        """Check if a message is safe to send twice (balance inquiries and 0220 advices)"""
+        return transaction.transaction_type == TransactionType.BALANCE_INQUIRY or transaction.mti == "0220"
+    
+    def _retry_delay(self, retry_count: int) -> float:
+        """Get the jittered exponential backoff delay before a retry"""
+        return backoff_delay(retry_count, NETWORK_SETTINGS["retry_delay"], NETWORK_SETTINGS["retry_max_delay"])
+    
+    async def _process_offline_async(self, transaction: Transaction) -> None:
+        """Process a transaction offline; the approval only stands once it is in the durable queue"""
         # Check if transaction amount exceeds offline limit
-        if transaction.amount > TERMINAL_SETTINGS["offline_transaction_limit"]:
+        if transaction.amount > self.config.offline_transaction_limit:
             transaction.update_status(
                 TransactionStatus.DECLINED,
                 response_code="D2001",
-                response_message=f"Transaction amount exceeds offline limit of {TERMINAL_SETTINGS['offline_transaction_limit']} {transaction.currency}"
+                response_message=f"Transaction amount exceeds offline limit of {self.config.offline_transaction_limit} {transaction.currency}"
             )
             return
         
@@ -365,13 +569,22 @@ class TransactionProcessor:
         transaction.set_approval_code(offline_code)
         transaction.update_status(TransactionStatus.OFFLINE_APPROVED)
         
-        # Queue for later synchronization
-        self.offline_queue.put(transaction)
-        logger.info(f"Transaction {transaction.transaction_id} approved offline with code {offline_code}")
+        # Queue for later synchronization; the caller is answered after the commit
+        try:
+            await self.offline_queue.put_async(transaction)
+        except Exception as e:
+            logger.error("Offline approval of transaction %s could not be stored: %s", transaction.transaction_id, e)
+            transaction.update_status(
+                TransactionStatus.ERROR,
+                response_code="E1002",
+                response_message=f"Offline approval could not be stored: {str(e)}"
+            )
+            return
+        logger.debug("Transaction %s approved offline with code %s", transaction.transaction_id, offline_code)
         
-        # Make sure offline sync thread is running
-        if not self.offline_sync_thread or not self.offline_sync_thread.is_alive():
-            self._start_offline_sync_thread()
+        # Make sure the offline sync engine is running and knows there is work
+        self._start_offline_sync()
+        self.sync_engine.wake()
     
     def void_transaction(self, original_transaction_id: str) -> Optional[Transaction]:
         """
@@ -379,11 +592,7 @@ class TransactionProcessor:
         Returns the void transaction if successful, None otherwise
         """
         # Find the original transaction
-        original_transaction = None
-        for transaction in self.transaction_history:
-            if transaction.transaction_id == original_transaction_id:
-                original_transaction = transaction
-                break
+        original_transaction = self.get_transaction(original_transaction_id)
         
         if not original_transaction:
             logger.warning(f"Cannot void: transaction {original_transaction_id} not found")
@@ -412,9 +621,69 @@ class TransactionProcessor:
         # Process the void
         return self.process_transaction(void_transaction)
     
-    def get_transaction_history(self) -> List[Dict[str, Any]]:
-        """Get transaction history as a list of dictionaries"""
-        return [transaction.to_dict() for transaction in self.transaction_history]
+    def close_batch(self) -> Dict[str, Any]:
+        """
+        Close the open batch and send its reconciliation totals to the host
+
+        Synchronous wrapper around close_batch_async. Must not be called from
+        the processor event loop itself.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._close_batch(), self.loop)
+        return future.result()
+    
+    async def close_batch_async(self) -> Dict[str, Any]:
+        """Close the open batch from any event loop (see process_transaction_async)"""
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+        
+        if running_loop is self.loop:
+            return await self._close_batch()
+        
+        future = asyncio.run_coroutine_threadsafe(self._close_batch(), self.loop)
+        return await asyncio.wrap_future(future)
+    
+    async def _close_batch(self) -> Dict[str, Any]:
+        """
+        Close the open batch on the processor event loop
+        
+        The batch is closed locally even if the host cannot be reached; the
+        advice can be resent from the stored totals of the closed batch.
+        
+        Returns:
+            Dict[str, Any]: The reconciliation advice, the host response and the
+            settlement status (BALANCED, OUT_OF_BALANCE or NOT_SENT)
+        """
+        # Waits for the batch's in-flight transactions, which run on this loop
+        advice = await asyncio.to_thread(self.settlement.close_batch)
+        result = {"reconciliation": advice, "host_response": None, "status": "NOT_SENT"}
+        
+        try:
+            response = await self.transport.apost("/reconciliation", advice)
+            if response.status_code == 200:
+                response_data = decode_response(response)
+                result["host_response"] = response_data
+                result["status"] = "BALANCED" if response_data.get("response_code") == "00" else "OUT_OF_BALANCE"
+            else:
+                logger.warning("Reconciliation of batch %s rejected: HTTP %s", advice["batch_number"], response.status_code)
+        except httpx.HTTPError as e:
+            logger.warning("Reconciliation of batch %s not sent: %s", advice["batch_number"], e)
+        
+        logger.info(f"Batch {advice['batch_number']} of terminal {self.terminal_id} closed: {result['status']}")
+        return result
+    
+    def get_transaction(self, transaction_id: str) -> Optional[Transaction]:
+        """Get a transaction by ID from the history store"""
+        return self.transaction_history.get(transaction_id)
+    
+    async def get_transaction_async(self, transaction_id: str) -> Optional[Transaction]:
+        """Get a transaction by ID from the history store without blocking the caller's event loop"""
+        return await self.transaction_history.get_async(transaction_id)
+    
+    def get_transaction_history(self, limit: Optional[int] = 50) -> List[Dict[str, Any]]:
+        """Get the most recent transactions as a list of dictionaries, newest first"""
+        return [transaction.to_dict() for transaction in self.transaction_history.recent(limit)]
     
     def get_offline_queue_size(self) -> int:
         """Get the number of transactions in the offline queue"""
@@ -425,11 +694,18 @@ class TransactionProcessor:
         logger.info("Shutting down transaction processor")
         self.stop_threads.set()
         
-        if self.heartbeat_thread:
-            self.heartbeat_thread.join(timeout=2.0)
+        self.scheduler.stop()
+        self.sync_engine.stop()
+        self.reversal_engine.stop()
+        self.offline_queue.flush()
+        self.reversal_queue.flush()
+        self.settlement.store.flush()
+        if self.writer is not None:
+            self.writer.flush()
         
-        if self.offline_sync_thread:
-            self.offline_sync_thread.join(timeout=2.0)
+        # Shared runtimes are stopped by their registry
+        if self._owns_runtime:
+            self.runtime.shutdown()
         
         logger.info("Transaction processor shutdown complete")
     
@@ -446,5 +722,12 @@ class TransactionProcessor:
             "online_status": "ONLINE" if self.is_online else "OFFLINE",
             "processor_status": self.status.value,
             "offline_queue_size": self.get_offline_queue_size(),
+            "offline_sync": self.sync_engine.get_stats(),
+            "reversals": dict(self.reversal_engine.get_stats(), queue_size=self.reversal_queue.qsize()),
+            "heartbeats_suppressed": self.scheduler.heartbeats_suppressed,
+            "settlement": self.settlement.get_stats(),
+            "persistence": self.writer.get_stats() if self.writer is not None else None,
+            "transport": self.transport.get_stats(),
+            "host_link": self.host_link.get_stats() if self.host_link is not None else None,
             "timestamp": datetime.datetime.now().isoformat()
         }
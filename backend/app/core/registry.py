@@ -0,0 +1,119 @@
+"""
+Black Rock Payment Terminal - Processor Registry
+"""
+
+import logging
+import threading
+from typing import Dict, Any, Optional, List
+
+from app.core.processor import TransactionProcessor
+from app.core.runtime import ProcessorRuntime
+from app.core.workers import WorkerIdentity
+from app.config.terminal import TerminalConfig
+
+logger = logging.getLogger(__name__)
+
+
+class ProcessorRegistry:
+    """
+    Hosts the transaction processors of many terminals in one process
+
+    All processors share one ProcessorRuntime: a single event loop thread,
+    one timer wheel driving every heartbeat and sync wakeup, and one pooled
+    transport per host. Processors are looked up by terminal ID.
+
+    When several worker processes serve the same terminals, the worker
+    identity decides which of them owns each terminal's background jobs.
+    """
+
+    def __init__(self, runtime: Optional[ProcessorRuntime] = None,
+                 worker: Optional[WorkerIdentity] = None):
+        """
+        Initialize the registry
+
+        Args:
+            runtime: Shared runtime; a new one is started when omitted
+            worker: This process's worker slot; a single worker owns every terminal
+        """
+        self.runtime = runtime or ProcessorRuntime()
+        self.worker = worker or WorkerIdentity()
+        self._processors: Dict[str, TransactionProcessor] = {}
+        self._lock = threading.Lock()
+        self.default_terminal_id: Optional[str] = None
+
+    def __len__(self) -> int:
+        return len(self._processors)
+
+    def __contains__(self, terminal_id: str) -> bool:
+        return terminal_id in self._processors
+
+    def register(self, config: TerminalConfig) -> TransactionProcessor:
+        """
+        Create and register the processor for a terminal
+
+        Args:
+            config: The terminal configuration
+
+        Returns:
+            TransactionProcessor: The new processor, or the existing one for this terminal
+        """
+        with self._lock:
+            processor = self._processors.get(config.terminal_id)
+            if processor is None:
+                processor = TransactionProcessor(
+                    config.merchant_id,
+                    config.terminal_id,
+                    config.server_url,
+                    runtime=self.runtime,
+                    config=config,
+                    owner=self.worker.owns(config.terminal_id)
+                )
+                self._processors[config.terminal_id] = processor
+                if self.default_terminal_id is None:
+                    self.default_terminal_id = config.terminal_id
+            return processor
+
+    def unregister(self, terminal_id: str) -> None:
+        """Stop and remove the processor of a terminal"""
+        with self._lock:
+            processor = self._processors.pop(terminal_id, None)
+            if terminal_id == self.default_terminal_id:
+                self.default_terminal_id = next(iter(self._processors), None)
+        if processor is not None:
+            processor.shutdown()
+
+    def get(self, terminal_id: Optional[str] = None) -> Optional[TransactionProcessor]:
+        """
+        Get the processor of a terminal
+
+        Args:
+            terminal_id: The terminal ID; the default terminal when omitted
+
+        Returns:
+            Optional[TransactionProcessor]: The processor, or None if the terminal is unknown
+        """
+        return self._processors.get(terminal_id or self.default_terminal_id)
+
+    def terminal_ids(self) -> List[str]:
+        """Get the IDs of all registered terminals"""
+        return list(self._processors)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get registry and shared runtime statistics"""
+        return dict(
+            self.runtime.get_stats(),
+            terminals=len(self._processors),
+            terminals_owned=sum(1 for processor in self._processors.values() if processor.owner),
+            worker_slot=self.worker.slot,
+            worker_count=self.worker.worker_count
+        )
+
+    def shutdown(self) -> None:
+        """Stop all processors and the shared runtime"""
+        with self._lock:
+            processors, self._processors = list(self._processors.values()), {}
+        for processor in processors:
+            processor.shutdown()
+        self.runtime.shutdown()
+        self.worker.release()
+        logger.info(f"Processor registry shut down ({len(processors)} terminals)")
@@ -0,0 +1,162 @@
+"""
+Black Rock Payment Terminal - Timeout Reversals
+"""
+
+import asyncio
+import logging
+import datetime
+import threading
+from typing import Dict, Any, List, Optional
+
+import httpx
+
+from app.core.transaction import Transaction, TransactionType
+from app.core.offline_queue import OfflineQueue, OfflineQueueStore
+from app.core.sync import OfflineSyncEngine
+from app.core.stan import get_default_allocator
+from app.protocols.iso8583 import transaction_to_fields, original_data_elements
+from app.config.settings import REVERSAL_SETTINGS, WORKER_SETTINGS
+from app.utils.codec import decode_response
+
+logger = logging.getLogger(__name__)
+
+REVERSAL_MTI = "0500"
+
+# Response codes (field 39) that settle a reversal: reversed, or the host never saw the original
+REVERSAL_ACCEPTED_CODES = ("00", "25")
+
+# Errors raised after the request may already have reached the host
+AMBIGUOUS_ERRORS = (
+    httpx.ReadTimeout, httpx.WriteTimeout, httpx.ReadError, httpx.WriteError, httpx.RemoteProtocolError
+)
+
+
+def is_ambiguous(error: Exception) -> bool:
+    """
+    Check if a failed host call leaves the outcome unknown
+
+    Connect and pool errors mean the request never left the terminal; read
+    timeouts and connections lost mid-exchange mean the host may have
+    processed it.
+
+    Args:
+        error: The exception raised by the host call
+
+    Returns:
+        bool: True if the host may have approved the request
+    """
+    return isinstance(error, AMBIGUOUS_ERRORS)
+
+
+def needs_reversal(transaction: Transaction) -> bool:
+    """Check if an unanswered transaction can have moved funds (everything but balance inquiries)"""
+    return transaction.transaction_type != TransactionType.BALANCE_INQUIRY
+
+
+class ReversalQueue(OfflineQueue):
+    """Per-terminal durable queue of transactions awaiting a 0500 reversal"""
+
+    def __init__(self, terminal_id: str, store: Optional[OfflineQueueStore] = None):
+        """
+        Initialize the queue
+
+        Args:
+            terminal_id: The terminal that owns the entries
+            store: Shared store; defaults to the process-wide reversal store
+        """
+        super().__init__(terminal_id, store or get_default_store())
+
+
+class ReversalEngine(OfflineSyncEngine):
+    """
+    Sends queued 0500 reversals while the host is reachable
+
+    Uses the offline sync engine's batching, adaptive batch size and
+    per-item backoff. Over HTTP a batch is one /reversals request; over an
+    ISO 8583 host link every reversal of a batch is its own 0500 message,
+    all in flight at once. Each 0500 carries a fresh STAN so it cannot be
+    matched to a late response to the original request; the original is
+    identified by its original data elements (field 90: MTI, STAN and
+    transmission date and time) and its transaction ID (field 48).
+    """
+
+    name = "Reversal"
+
+    def __init__(self, processor, queue: ReversalQueue):
+        """
+        Initialize the reversal engine
+
+        Args:
+            processor: The TransactionProcessor whose reversals are sent
+            queue: The terminal's reversal queue
+        """
+        super().__init__(processor, queue, REVERSAL_SETTINGS)
+
+    async def _send(self, batch: List[Transaction]) -> Dict[str, Dict[str, Any]]:
+        """Send a batch of reversals and get the host's result per transaction ID"""
+        if self.processor.host_link is not None:
+            return await self._send_iso(batch)
+
+        payload = {
+            "reversals": [
+                {
+                    "mti": REVERSAL_MTI,
+                    "transaction_id": transaction.transaction_id,
+                    "original_mti": transaction.mti,
+                    "original_trace_number": transaction.trace_number,
+                    "original_data_elements": original_data_elements(transaction),
+                    "transaction": transaction.to_dict()
+                }
+                for transaction in batch
+            ],
+            "terminal_id": self.processor.terminal_id,
+            "merchant_id": self.processor.merchant_id,
+            "timestamp": datetime.datetime.now().isoformat()
+        }
+        response = await self.processor.transport.apost("/reversals", payload)
+        if response.status_code != 200:
+            raise httpx.HTTPError(f"HTTP {response.status_code}")
+        return {
+            result.get("transaction_id"): result
+            for result in decode_response(response).get("results", [])
+        }
+
+    async def _send_iso(self, batch: List[Transaction]) -> Dict[str, Dict[str, Any]]:
+        """Send each reversal of a batch as a 0500 over the host link, concurrently"""
+        link = self.processor.host_link
+        allocator = get_default_allocator()
+
+        async def reverse(transaction: Transaction) -> Dict[str, Any]:
+            _, values = transaction_to_fields(transaction)
+            values[11] = allocator.next_trace_number(transaction.terminal_id)
+            values[90] = original_data_elements(transaction)
+            _, response = await link.request(transaction.protocol, REVERSAL_MTI, values)
+            response_code = response.get(39)
+            return {
+                "transaction_id": transaction.transaction_id,
+                "status": "success" if response_code in REVERSAL_ACCEPTED_CODES else "failed",
+                "message": f"Response code {response_code}"
+            }
+
+        outcomes = await asyncio.gather(*(reverse(transaction) for transaction in batch), return_exceptions=True)
+        results = {outcome["transaction_id"]: outcome for outcome in outcomes if not isinstance(outcome, Exception)}
+        if not results:
+            # Nothing got through; fail the whole batch with the first error
+            raise outcomes[0]
+        return results
+
+
+_default_store: Optional[OfflineQueueStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> OfflineQueueStore:
+    """Get the process-wide reversal store, opening it on first use"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = OfflineQueueStore(
+                REVERSAL_SETTINGS["path"],
+                shared=WORKER_SETTINGS["workers"] > 1
+            )
+        return _default_store
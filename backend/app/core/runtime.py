@@ -0,0 +1,228 @@
+"""
+Black Rock Payment Terminal - Shared Processor Runtime
+"""
+
+import math
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, Callable, List, Tuple
+
+from app.core.transport import FailoverTransport
+from app.core.host_link import IsoHostLink
+from app.config.settings import SCHEDULER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class TimerHandle:
+    """A timer scheduled on a TimerWheel"""
+
+    __slots__ = ("deadline", "callback", "cancelled")
+
+    def __init__(self, deadline: int, callback: Callable[[], None]):
+        self.deadline = deadline
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self) -> None:
+        """Cancel the timer (it is dropped lazily when its slot comes round)"""
+        self.cancelled = True
+
+
+class TimerWheel:
+    """
+    Hashed timing wheel driving the timers of many processors from one task
+
+    Timers are hashed into wheel_size slots by their deadline tick. A single
+    task on the event loop advances the wheel every tick_interval and fires
+    the timers that are due, so thousands of terminals cost one periodic
+    wakeup instead of one event loop timer each. Must only be used from the
+    event loop thread.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, tick_interval: float = None,
+                 wheel_size: int = None):
+        """
+        Initialize the timer wheel
+
+        Args:
+            loop: The event loop that runs the wheel
+            tick_interval: Seconds per tick (timer resolution)
+            wheel_size: Number of slots
+        """
+        self.loop = loop
+        self.tick_interval = tick_interval or SCHEDULER_SETTINGS["tick_interval"]
+        self.wheel_size = wheel_size or SCHEDULER_SETTINGS["wheel_size"]
+        self._slots: List[List[TimerHandle]] = [[] for _ in range(self.wheel_size)]
+        self._tick = 0
+        self._started_at = time.monotonic()
+        self._task = None
+        self.scheduled = 0
+
+    def start(self) -> None:
+        """Start advancing the wheel (must run on the event loop)"""
+        if self._task is None:
+            self._started_at = time.monotonic()
+            self._task = self.loop.create_task(self._run())
+
+    def stop(self) -> None:
+        """Stop advancing the wheel (must run on the event loop)"""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def schedule(self, delay: float, callback: Callable[[], None]) -> TimerHandle:
+        """
+        Schedule a callback
+
+        Args:
+            delay: Seconds from now (rounded up to the next tick)
+            callback: Called on the event loop when the timer fires
+
+        Returns:
+            TimerHandle: Handle that can be used to cancel the timer
+        """
+        ticks = max(1, math.ceil(delay / self.tick_interval))
+        handle = TimerHandle(self._tick + ticks, callback)
+        self._slots[handle.deadline % self.wheel_size].append(handle)
+        self.scheduled += 1
+        return handle
+
+    async def _run(self) -> None:
+        """Advance the wheel to the current time once per tick"""
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            target = int((time.monotonic() - self._started_at) / self.tick_interval)
+            while self._tick < target:
+                self._tick += 1
+                self._fire(self._tick)
+
+    def _fire(self, tick: int) -> None:
+        """Fire the due timers of a tick's slot and keep the ones for later rounds"""
+        index = tick % self.wheel_size
+        slot = self._slots[index]
+        if not slot:
+            return
+        # Swap the slot out so callbacks can schedule into it while it is processed
+        self._slots[index] = []
+
+        remaining = []
+        for handle in slot:
+            if handle.cancelled:
+                self.scheduled -= 1
+            elif handle.deadline <= tick:
+                self.scheduled -= 1
+                try:
+                    handle.callback()
+                except Exception as e:
+                    logger.error(f"Timer callback error: {str(e)}")
+            else:
+                remaining.append(handle)
+        self._slots[index].extend(remaining)
+
+
+class ProcessorRuntime:
+    """
+    Event loop thread, timer wheel and host transports shared by processors
+
+    A standalone TransactionProcessor creates its own runtime; a
+    ProcessorRegistry shares one runtime between all of its terminals so
+    that they use one loop thread, one timer wheel and one connection pool
+    (and circuit breaker) per host, and one set of multiplexed sockets per
+    ISO 8583 host.
+    """
+
+    def __init__(self):
+        """Start the runtime event loop thread and its timer wheel"""
+        self.loop = asyncio.new_event_loop()
+        self.wheel = TimerWheel(self.loop)
+        self._transports: Dict[Tuple[str, str], FailoverTransport] = {}
+        self._transports_lock = threading.Lock()
+        self._host_links: Dict[str, IsoHostLink] = {}
+
+        def loop_worker():
+            asyncio.set_event_loop(self.loop)
+            self.loop.run_forever()
+
+        self.loop_thread = threading.Thread(target=loop_worker, daemon=True)
+        self.loop_thread.start()
+        self.loop.call_soon_threadsafe(self.wheel.start)
+        logger.info("Processor runtime event loop thread started")
+
+    def in_loop(self) -> bool:
+        """Check if the caller is running on the runtime event loop"""
+        try:
+            return asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            return False
+
+    def call_soon(self, callback: Callable, *args) -> None:
+        """Run a callback on the event loop (safe to call from any thread)"""
+        if self.in_loop():
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def get_transport(self, server_url: str, backup_server_url: Optional[str] = None) -> FailoverTransport:
+        """
+        Get the shared transport for a primary/backup host pair
+
+        Args:
+            server_url: The primary host base URL
+            backup_server_url: The backup host base URL
+
+        Returns:
+            FailoverTransport: The transport, created on first use
+        """
+        key = (server_url, backup_server_url or "")
+        with self._transports_lock:
+            transport = self._transports.get(key)
+            if transport is None:
+                transport = FailoverTransport(server_url, backup_server_url)
+                self._transports[key] = transport
+            return transport
+
+    def get_host_link(self, url: str) -> IsoHostLink:
+        """
+        Get the shared ISO 8583 link to a host
+
+        Args:
+            url: The host address, tcp://host:port
+
+        Returns:
+            IsoHostLink: The link, created on first use
+        """
+        with self._transports_lock:
+            link = self._host_links.get(url)
+            if link is None:
+                link = IsoHostLink(url, wheel=self.wheel)
+                self._host_links[url] = link
+            return link
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get timer wheel, transport and host link statistics"""
+        return {
+            "scheduled_timers": self.wheel.scheduled,
+            "transports": [transport.get_stats() for transport in self._transports.values()],
+            "host_links": [link.get_stats() for link in self._host_links.values()]
+        }
+
+    def shutdown(self) -> None:
+        """Close all transports and stop the event loop thread"""
+        async def close_transports():
+            self.wheel.stop()
+            for transport in self._transports.values():
+                await transport.aclose()
+            for link in self._host_links.values():
+                await link.aclose()
+
+        try:
+            asyncio.run_coroutine_threadsafe(close_transports(), self.loop).result(timeout=2.0)
+        except Exception as e:
+            logger.warning(f"Error closing host transports: {str(e)}")
+
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.loop_thread.join(timeout=2.0)
+        logger.info("Processor runtime stopped")
@@ -0,0 +1,453 @@
+"""
+Black Rock Payment Terminal - Batch Settlement
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import datetime
+import threading
+import weakref
+from typing import Dict, Any, Optional, List, Set, Tuple
+
+from app.core.transaction import Transaction, TransactionStatus, TransactionType
+from app.core.stan import TraceNumberAllocator, get_default_allocator
+from app.config.settings import SETTLEMENT_SETTINGS, SUPPORTED_CURRENCIES, WORKER_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# (transaction type, currency, status) -> [count, amount in minor units]
+TotalsKey = Tuple[str, str, str]
+Totals = Dict[TotalsKey, List[int]]
+
+# Statuses whose amounts move money at settlement
+SETTLED_STATUSES = (TransactionStatus.APPROVED.value, TransactionStatus.OFFLINE_APPROVED.value)
+
+# Reconciliation side of each settled transaction type; others (pre-auths, inquiries) carry no funds
+RECONCILIATION_SIDES = {
+    TransactionType.SALE.value: "debits",
+    TransactionType.PRE_AUTH_COMPLETION.value: "debits",
+    TransactionType.REFUND.value: "credits",
+    TransactionType.VOID.value: "debits_reversal",
+}
+
+
+def to_minor_units(amount: float, currency: str) -> int:
+    """
+    Convert an amount to integer minor units (e.g. cents) so totals add up exactly
+
+    Args:
+        amount: The amount in major units
+        currency: The ISO currency code
+
+    Returns:
+        int: The amount in minor units
+    """
+    decimal_places = SUPPORTED_CURRENCIES.get(currency, {}).get("decimal_places", 2)
+    return int(round(amount * 10 ** decimal_places))
+
+
+def _add(totals: Totals, key: TotalsKey, count: int, amount: int) -> None:
+    """Add to one counter of a totals table"""
+    counter = totals.get(key)
+    if counter is None:
+        totals[key] = [count, amount]
+    else:
+        counter[0] += count
+        counter[1] += amount
+
+
+class SettlementStore:
+    """
+    Durable per-batch totals, shared by all worker processes
+
+    Counter increments are buffered in memory and added to the batch_totals
+    table by a flusher thread once per flush_interval (one upsert per
+    counter, not per transaction), so recording a transaction never touches
+    the disk. A crash loses at most the last flush_interval of increments.
+
+    When shared by several worker processes, every flush also writes this
+    worker's batch fences: per terminal, the batches it may still add
+    increments to (its open batch and those of its in-flight transactions).
+    Fences are committed together with the increments, so once no live
+    worker's fence names a closed batch its totals in the table are final.
+    """
+
+    def __init__(self, path: str, flush_interval: Optional[float] = None, shared: bool = False):
+        """
+        Initialize the store
+
+        Args:
+            path: SQLite database file path (must be on a local filesystem)
+            flush_interval: Seconds between commits of buffered increments
+            shared: Whether other worker processes add to the same file; batch
+                fences are then written on every flush
+        """
+        self.path = path
+        self.flush_interval = flush_interval or SETTLEMENT_SETTINGS["flush_interval"]
+        self.shared = shared
+        self.worker_id = str(os.getpid())
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._pending: Dict[Tuple[str, int, str, str, str], List[int]] = {}
+        self._ledgers: "weakref.WeakSet[SettlementLedger]" = weakref.WeakSet()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_totals ("
+            " terminal_id TEXT NOT NULL,"
+            " batch_number INTEGER NOT NULL,"
+            " transaction_type TEXT NOT NULL,"
+            " currency TEXT NOT NULL,"
+            " status TEXT NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " amount INTEGER NOT NULL,"
+            " PRIMARY KEY (terminal_id, batch_number, transaction_type, currency, status))"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS batch_fences ("
+            " terminal_id TEXT NOT NULL,"
+            " worker_id TEXT NOT NULL,"
+            " open_batches TEXT NOT NULL,"
+            " updated_at REAL NOT NULL,"
+            " PRIMARY KEY (terminal_id, worker_id))"
+        )
+
+        self._flusher = threading.Thread(target=self._flush_worker, daemon=True)
+        self._flusher.start()
+
+    def _flush_worker(self) -> None:
+        """Commit buffered increments every flush_interval"""
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"Settlement totals flush error: {str(e)}")
+
+    def register(self, ledger: "SettlementLedger") -> None:
+        """Include a ledger's open batches in this worker's fences"""
+        self._ledgers.add(ledger)
+
+    def add(self, terminal_id: str, batch_number: int, key: TotalsKey, amount: int) -> None:
+        """Buffer one transaction's increment of a batch counter"""
+        with self._lock:
+            _add(self._pending, (terminal_id, batch_number) + key, 1, amount)
+
+    def flush(self) -> None:
+        """Add all buffered increments (and, when shared, this worker's fences) to the tables in one transaction"""
+        with self._write_lock:
+            # Fences are taken before the swap: an increment buffered after a fence
+            # dropped its batch is then part of this commit, never a later one
+            fences = [
+                (ledger.terminal_id, self.worker_id, ",".join(map(str, sorted(ledger.open_batches()))), time.time())
+                for ledger in list(self._ledgers)
+            ] if self.shared else []
+            with self._lock:
+                if not self._pending and not fences:
+                    return
+                pending, self._pending = self._pending, {}
+
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO batch_totals"
+                    " (terminal_id, batch_number, transaction_type, currency, status, count, amount)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (terminal_id, batch_number, transaction_type, currency, status)"
+                    " DO UPDATE SET count = count + excluded.count, amount = amount + excluded.amount",
+                    [key + tuple(counter) for key, counter in pending.items()]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO batch_fences (terminal_id, worker_id, open_batches, updated_at)"
+                    " VALUES (?, ?, ?, ?)",
+                    fences
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                with self._lock:
+                    for key, (count, amount) in pending.items():
+                        _add(self._pending, key, count, amount)
+                raise
+
+    def load(self, terminal_id: str, batch_number: int) -> Totals:
+        """
+        Read the committed totals of a batch
+
+        Args:
+            terminal_id: The terminal ID
+            batch_number: The batch number
+
+        Returns:
+            Totals: Counters by (transaction type, currency, status)
+        """
+        with self._write_lock:
+            rows = self._conn.execute(
+                "SELECT transaction_type, currency, status, count, amount FROM batch_totals"
+                " WHERE terminal_id = ? AND batch_number = ?",
+                (terminal_id, batch_number)
+            ).fetchall()
+        return {(row[0], row[1], row[2]): [row[3], row[4]] for row in rows}
+
+    def open_elsewhere(self, terminal_id: str, batch_number: int, stale_after: float) -> List[str]:
+        """
+        Find the other live workers that may still add to a batch
+
+        Args:
+            terminal_id: The terminal ID
+            batch_number: The batch number
+            stale_after: Seconds without a flush after which a worker is considered gone
+
+        Returns:
+            List[str]: IDs of the workers whose last committed fence names the batch
+        """
+        with self._write_lock:
+            rows = self._conn.execute(
+                "SELECT worker_id, open_batches FROM batch_fences"
+                " WHERE terminal_id = ? AND worker_id != ? AND updated_at >= ?",
+                (terminal_id, self.worker_id, time.time() - stale_after)
+            ).fetchall()
+        batch = str(batch_number)
+        return [worker_id for worker_id, open_batches in rows if batch in open_batches.split(",")]
+
+    def close(self) -> None:
+        """Flush and close the database"""
+        self._stop.set()
+        self._flusher.join(timeout=5)
+        self.flush()
+        with self._write_lock:
+            self._conn.close()
+
+
+def build_reconciliation_message(terminal_id: str, merchant_id: str, batch_number: int,
+                                 totals: Totals) -> Dict[str, Any]:
+    """
+    Build the 0520 reconciliation advice sent to the host when a batch closes
+
+    Per currency it carries the ISO 8583 reconciliation totals: number and
+    amount of credits (fields 74/86), debits (76/88) and debit reversals
+    (77/89), and the net settlement amount (97). Only approved transactions
+    are counted; amounts are in minor units.
+
+    Args:
+        terminal_id: The terminal ID
+        merchant_id: The merchant ID
+        batch_number: The closed batch number
+        totals: The batch's counters
+
+    Returns:
+        Dict[str, Any]: The reconciliation message
+    """
+    currencies: Dict[str, Dict[str, int]] = {}
+    transaction_count = 0
+    for (transaction_type, currency, status), (count, amount) in totals.items():
+        transaction_count += count
+        side = RECONCILIATION_SIDES.get(transaction_type)
+        if side is None or status not in SETTLED_STATUSES:
+            continue
+        summary = currencies.setdefault(currency, {
+            "credits_number": 0, "credits_amount": 0,
+            "debits_number": 0, "debits_amount": 0,
+            "debits_reversal_number": 0, "debits_reversal_amount": 0,
+            "net_settlement_amount": 0
+        })
+        summary[f"{side}_number"] += count
+        summary[f"{side}_amount"] += amount
+        summary["net_settlement_amount"] += -amount if side != "debits" else amount
+
+    return {
+        "mti": "0520",
+        "terminal_id": terminal_id,
+        "merchant_id": merchant_id,
+        "batch_number": batch_number,
+        "transaction_count": transaction_count,
+        "currencies": currencies,
+        "timestamp": datetime.datetime.now().isoformat()
+    }
+
+
+class SettlementLedger:
+    """
+    Running totals of a terminal's open batch
+
+    Every completed transaction increments the counter for its type,
+    currency and status in memory (and, buffered, in the SettlementStore),
+    so closing a batch swaps out the open batch's counters instead of
+    scanning the transaction history.
+
+    A transaction is assigned to the open batch when its processing begins,
+    before anything is sent to the host, and stays in flight until it is
+    recorded. Closing a batch first opens the next one, so new transactions
+    go there, then waits for the closed batch's in-flight transactions and
+    reads its totals from the store after they were flushed. With several
+    worker processes it also waits until no other live worker's fence names
+    the batch. Transactions that still complete after drain_timeout are
+    kept in the store only and counted as late.
+    """
+
+    def __init__(self, terminal_id: str, merchant_id: str,
+                 store: Optional[SettlementStore] = None,
+                 allocator: Optional[TraceNumberAllocator] = None,
+                 drain_timeout: Optional[float] = None):
+        """
+        Initialize the ledger
+
+        Args:
+            terminal_id: The terminal ID
+            merchant_id: The merchant ID
+            store: Durable totals store (defaults to the process-wide store)
+            allocator: Batch number allocator (defaults to the process-wide allocator)
+            drain_timeout: Seconds a batch close waits for in-flight transactions and other workers
+        """
+        self.terminal_id = terminal_id
+        self.merchant_id = merchant_id
+        self.store = store or get_default_store()
+        self.allocator = allocator or get_default_allocator()
+        self.shared = WORKER_SETTINGS["workers"] > 1
+        self.drain_timeout = drain_timeout or SETTLEMENT_SETTINGS["drain_timeout"]
+        self.late_transactions = 0
+        self._lock = threading.Lock()
+        self._drained = threading.Condition(self._lock)
+        self._in_flight: Dict[int, Set[str]] = {}
+        self._closing: Set[int] = set()
+
+        # Resume the open batch after a restart
+        self.store.flush()
+        self._batch_number = self.allocator.batch_number(terminal_id)
+        self._totals: Totals = self.store.load(terminal_id, self._batch_number)
+        self.store.register(self)
+
+    def _open_batch(self) -> int:
+        """Get the open batch number; lock held"""
+        if self.shared:
+            # Another worker may have closed the batch
+            return self.allocator.batch_number(self.terminal_id)
+        return self._batch_number
+
+    def begin(self, transaction: Transaction) -> None:
+        """
+        Assign a transaction to the open batch as its processing starts
+
+        Args:
+            transaction: The transaction, before any message is sent for it
+        """
+        with self._lock:
+            batch_number = self._open_batch()
+            transaction.batch_number = batch_number
+            self._in_flight.setdefault(batch_number, set()).add(transaction.transaction_id)
+
+    def open_batches(self) -> Set[int]:
+        """Get the batches this process may still add to: the open one and those with in-flight transactions"""
+        with self._lock:
+            return {self._open_batch()} | {batch for batch, pending in self._in_flight.items() if pending}
+
+    def record(self, transaction: Transaction) -> None:
+        """
+        Count a completed transaction in its batch
+
+        Args:
+            transaction: The transaction in its final status
+        """
+        key = (transaction.transaction_type.value, transaction.currency, transaction.status.value)
+        amount = to_minor_units(transaction.amount, transaction.currency)
+        batch_number = transaction.batch_number
+        with self._lock:
+            # Buffered before leaving the in-flight set, so a fence never drops a batch with an unbuffered increment
+            self.store.add(self.terminal_id, batch_number, key, amount)
+            if not self.shared and batch_number == self._batch_number:
+                _add(self._totals, key, 1, amount)
+            elif batch_number != self._open_batch() and batch_number not in self._closing:
+                self.late_transactions += 1
+            pending = self._in_flight.get(batch_number)
+            if pending is not None:
+                pending.discard(transaction.transaction_id)
+                if not pending:
+                    del self._in_flight[batch_number]
+                    self._drained.notify_all()
+
+    def totals(self, batch_number: Optional[int] = None) -> Totals:
+        """
+        Get the counters of a batch
+
+        Args:
+            batch_number: The batch number; the open batch when omitted
+
+        Returns:
+            Totals: Counters by (transaction type, currency, status)
+        """
+        with self._lock:
+            if (batch_number is None or batch_number == self._batch_number) and not self.shared:
+                return {key: list(counter) for key, counter in self._totals.items()}
+        if batch_number is None:
+            batch_number = self.allocator.batch_number(self.terminal_id)
+        self.store.flush()
+        return self.store.load(self.terminal_id, batch_number)
+
+    def close_batch(self) -> Dict[str, Any]:
+        """
+        Close the open batch, open the next one and wait until the closed one's totals are final
+
+        Blocks for up to drain_timeout; call it off the processor event loop,
+        which has to finish the in-flight transactions.
+
+        Returns:
+            Dict[str, Any]: The 0520 reconciliation message of the closed batch
+        """
+        deadline = time.monotonic() + self.drain_timeout
+        with self._lock:
+            closed_batch, new_batch = self.allocator.close_batch(self.terminal_id)
+            self._closing.add(closed_batch)
+            self._totals = {}
+            self._batch_number = new_batch
+            drained = self._drained.wait_for(
+                lambda: not self._in_flight.get(closed_batch), deadline - time.monotonic()
+            )
+
+        try:
+            if not drained:
+                logger.warning(f"Batch {closed_batch} of terminal {self.terminal_id} closed with transactions in flight")
+            self.store.flush()
+            while self.shared:
+                workers = self.store.open_elsewhere(
+                    self.terminal_id, closed_batch, SETTLEMENT_SETTINGS["fence_stale_after"]
+                )
+                if not workers:
+                    break
+                if time.monotonic() >= deadline:
+                    logger.warning(f"Batch {closed_batch} of terminal {self.terminal_id} closed before workers {workers} fenced it")
+                    break
+                time.sleep(min(self.store.flush_interval / 4, 0.1))
+                self.store.flush()
+            totals = self.store.load(self.terminal_id, closed_batch)
+        finally:
+            with self._lock:
+                self._closing.discard(closed_batch)
+
+        return build_reconciliation_message(self.terminal_id, self.merchant_id, closed_batch, totals)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the open batch number and its transaction count"""
+        totals = self.totals()
+        return {
+            "batch_number": self._batch_number,
+            "transactions": sum(counter[0] for counter in totals.values()),
+            "late_transactions": self.late_transactions
+        }
+
+
+_default_store: Optional[SettlementStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_default_store() -> SettlementStore:
+    """Get the process-wide settlement totals store, opening it on first use"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = SettlementStore(SETTLEMENT_SETTINGS["path"], shared=WORKER_SETTINGS["workers"] > 1)
+        return _default_store
@@ -0,0 +1,223 @@
+"""
+Black Rock Payment Terminal - Shared Worker State
+"""
+
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Any, Optional, Tuple, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class SharedStateStore:
+    """
+    SQLite (WAL) state shared by all worker processes on one host
+
+    Holds the idempotency keys and a transaction index (the last API
+    response of every processed transaction) so that a request can be
+    answered by any worker, whichever worker processed the original. WAL
+    mode lets every worker read while one writes; writes are single-row
+    autocommits and wait up to busy_timeout for the write lock.
+
+    Event loop code must not call the store directly, since a write can
+    block for busy_timeout while another worker holds the lock: it awaits
+    the _async variants or hands writes to submit. Both run on the store's
+    single I/O thread, so calls are applied in the order they were made.
+    """
+
+    def __init__(self, path: str, busy_timeout: int = 5000):
+        """
+        Initialize the store
+
+        Args:
+            path: SQLite database file path (must be on a local filesystem)
+            busy_timeout: Milliseconds to wait for another worker's write lock
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shared-state")
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency_keys ("
+            " terminal_id TEXT NOT NULL,"
+            " idempotency_key TEXT NOT NULL,"
+            " fingerprint TEXT NOT NULL,"
+            " response TEXT,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (terminal_id, idempotency_key))"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_idempotency_keys_created ON idempotency_keys (created_at)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS transaction_index ("
+            " transaction_id TEXT PRIMARY KEY,"
+            " terminal_id TEXT NOT NULL,"
+            " response TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS ix_transaction_index_updated ON transaction_index (updated_at)"
+        )
+        logger.info(f"Shared worker state opened at {path}")
+
+    def reserve_key(self, terminal_id: str, key: str, fingerprint: str,
+                    ttl: float) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Reserve an idempotency key for this worker
+
+        Args:
+            terminal_id: The terminal the key belongs to
+            key: The idempotency key
+            fingerprint: Fingerprint of the request body
+            ttl: Seconds after which an existing reservation has expired
+
+        Returns:
+            Optional[Tuple[str, Optional[Dict[str, Any]]]]: None if the key was reserved by
+            this call, otherwise the existing fingerprint and stored response (None while in flight)
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE terminal_id = ? AND idempotency_key = ? AND created_at < ?",
+                (terminal_id, key, now - ttl)
+            )
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO idempotency_keys (terminal_id, idempotency_key, fingerprint, created_at)"
+                " VALUES (?, ?, ?, ?)",
+                (terminal_id, key, fingerprint, now)
+            )
+            if cursor.rowcount == 1:
+                return None
+            row = self._conn.execute(
+                "SELECT fingerprint, response FROM idempotency_keys WHERE terminal_id = ? AND idempotency_key = ?",
+                (terminal_id, key)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def get_key(self, terminal_id: str, key: str) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+        """
+        Get an idempotency key reservation
+
+        Returns:
+            Optional[Tuple[str, Optional[Dict[str, Any]]]]: The fingerprint and stored response
+            (None while in flight), or None if the key is not reserved
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, response FROM idempotency_keys WHERE terminal_id = ? AND idempotency_key = ?",
+                (terminal_id, key)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] else None
+
+    def complete_key(self, terminal_id: str, key: str, response: Dict[str, Any]) -> None:
+        """Store the response of a reserved idempotency key"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE idempotency_keys SET response = ? WHERE terminal_id = ? AND idempotency_key = ?",
+                (json.dumps(response), terminal_id, key)
+            )
+
+    def release_key(self, terminal_id: str, key: str) -> None:
+        """Drop a reservation whose request was never processed"""
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE terminal_id = ? AND idempotency_key = ? AND response IS NULL",
+                (terminal_id, key)
+            )
+
+    def purge_expired(self, ttl: float) -> int:
+        """
+        Delete idempotency keys and indexed transactions older than ttl
+
+        Args:
+            ttl: Seconds entries are kept
+
+        Returns:
+            int: Number of rows deleted
+        """
+        cutoff = time.time() - ttl
+        with self._lock:
+            deleted = self._conn.execute(
+                "DELETE FROM idempotency_keys WHERE created_at < ?", (cutoff,)
+            ).rowcount
+            deleted += self._conn.execute(
+                "DELETE FROM transaction_index WHERE updated_at < ?", (cutoff,)
+            ).rowcount
+        return deleted
+
+    def index_transaction(self, terminal_id: str, response: Dict[str, Any]) -> None:
+        """Record the latest API response of a transaction"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO transaction_index (transaction_id, terminal_id, response, updated_at)"
+                " VALUES (?, ?, ?, ?)",
+                (response["transaction_id"], terminal_id, json.dumps(response), time.time())
+            )
+
+    def get_indexed_transaction(self, transaction_id: str) -> Optional[Dict[str, Any]]:
+        """Get the latest API response of a transaction processed by any worker"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response FROM transaction_index WHERE transaction_id = ?", (transaction_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def submit(self, method: Callable[..., Any], *args) -> Future:
+        """
+        Run a store method on the I/O thread without waiting for it
+
+        Failures are logged; callers that need the outcome can wait on the
+        returned future.
+
+        Args:
+            method: A method of this store, e.g. store.complete_key
+            *args: Its arguments
+
+        Returns:
+            Future: Resolved with the method's result
+        """
+        future = self._executor.submit(method, *args)
+        future.add_done_callback(self._log_failure)
+        return future
+
+    @staticmethod
+    def _log_failure(future: Future) -> None:
+        """Log the error of a submitted call"""
+        if not future.cancelled() and future.exception() is not None:
+            logger.error(f"Shared state write failed: {future.exception()!r}")
+
+    async def _run_async(self, method: Callable[..., Any], *args) -> Any:
+        """Await a store method run on the I/O thread"""
+        return await asyncio.wrap_future(self._executor.submit(method, *args))
+
+    async def reserve_key_async(self, terminal_id: str, key: str, fingerprint: str,
+                                ttl: float) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+        """Reserve an idempotency key without blocking the event loop (see reserve_key)"""
+        return await self._run_async(self.reserve_key, terminal_id, key, fingerprint, ttl)
+
+    async def get_key_async(self, terminal_id: str, key: str) -> Optional[Tuple[str, Optional[Dict[str, Any]]]]:
+        """Get an idempotency key reservation without blocking the event loop (see get_key)"""
+        return await self._run_async(self.get_key, terminal_id, key)
+
+    async def get_indexed_transaction_async(self, transaction_id: str) -> Optional[Dict[str, Any]]:
+        """Get an indexed transaction without blocking the event loop (see get_indexed_transaction)"""
+        return await self._run_async(self.get_indexed_transaction, transaction_id)
+
+    def close(self) -> None:
+        """Finish the submitted writes and close the database"""
+        self._executor.shutdown(wait=True)
+        with self._lock:
+            self._conn.close()
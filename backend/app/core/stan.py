@@ -0,0 +1,243 @@
+"""
+Black Rock Payment Terminal - Trace Number Allocation
+"""
+
+import time
+import sqlite3
+import logging
+import itertools
+import threading
+from typing import Dict, Any, Optional, Tuple
+
+from app.config.settings import STAN_SETTINGS, TERMINAL_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+# ISO 8583 STAN (field 11) and batch numbers are 6 digits and never 000000
+MAX_TRACE_NUMBER = 999999
+
+
+def format_trace_number(sequence: int) -> str:
+    """
+    Map a monotonic sequence value onto the 6-digit STAN range
+
+    Args:
+        sequence: The terminal's sequence value (0, 1, 2, ...)
+
+    Returns:
+        str: The zero-padded STAN, cycling 000001 to 999999
+    """
+    return str(sequence % MAX_TRACE_NUMBER + 1).zfill(6)
+
+
+class _TerminalSequence:
+    """In-memory state of one terminal: the current STAN block and batch number"""
+
+    __slots__ = ("block", "lock", "batch_number", "batch_checked_at", "blocks_reserved")
+
+    def __init__(self):
+        # (counter over the block, end of the block); replaced as a whole when exhausted
+        self.block: Tuple[Any, int] = (iter(()), 0)
+        self.lock = threading.Lock()
+        self.batch_number = 0
+        self.batch_checked_at = 0.0
+        self.blocks_reserved = 0
+
+
+class TraceNumberAllocator:
+    """
+    Per-terminal STAN and batch number allocator
+
+    Every terminal has a monotonic 64-bit sequence in a SQLite file shared
+    by all worker processes. A process reserves block_size values at a time
+    with one write transaction and then hands them out from an in-memory
+    counter; next() on itertools.count is atomic, so allocating a STAN takes
+    neither a lock nor a disk write. Values left in a block when a process
+    exits are skipped, never reused, so restarts and concurrent workers can
+    leave gaps but no duplicates within the 999999-value STAN cycle.
+
+    The batch number lives in the same row. It is cached per process and
+    re-read every batch_refresh_interval seconds, so a batch closed by one
+    worker is picked up by the others.
+    """
+
+    def __init__(self, path: str, block_size: Optional[int] = None,
+                 batch_refresh_interval: Optional[float] = None):
+        """
+        Initialize the allocator
+
+        Args:
+            path: SQLite database file path (must be on a local filesystem)
+            block_size: Sequence values reserved per database write
+            batch_refresh_interval: Seconds a cached batch number is trusted
+        """
+        self.path = path
+        self.block_size = block_size or STAN_SETTINGS["block_size"]
+        self.batch_refresh_interval = (
+            batch_refresh_interval if batch_refresh_interval is not None
+            else STAN_SETTINGS["batch_refresh_interval"]
+        )
+        self._terminals: Dict[str, _TerminalSequence] = {}
+        self._terminals_lock = threading.Lock()
+        self._db_lock = threading.Lock()
+
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS terminal_sequences ("
+            " terminal_id TEXT PRIMARY KEY,"
+            " next_sequence INTEGER NOT NULL,"
+            " batch_number INTEGER NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        logger.info(f"Trace number allocator opened at {path}")
+
+    def _get_terminal(self, terminal_id: str) -> _TerminalSequence:
+        """Get the in-memory state of a terminal, creating it on first use"""
+        state = self._terminals.get(terminal_id)
+        if state is None:
+            with self._terminals_lock:
+                state = self._terminals.setdefault(terminal_id, _TerminalSequence())
+        return state
+
+    def _update(self, terminal_id: str, sequence_increment: int, batch_increment: int) -> Tuple[int, int]:
+        """
+        Advance a terminal's row in one write transaction (a plain read when nothing advances)
+
+        Returns:
+            Tuple[int, int]: The sequence and batch number before the sequence increment
+            and after the batch increment
+        """
+        with self._db_lock:
+            if not sequence_increment and not batch_increment:
+                row = self._conn.execute(
+                    "SELECT next_sequence, batch_number FROM terminal_sequences WHERE terminal_id = ?",
+                    (terminal_id,)
+                ).fetchone()
+                if row is not None:
+                    return row[0], row[1]
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO terminal_sequences (terminal_id, next_sequence, batch_number, updated_at)"
+                    " VALUES (?, 0, ?, ?)",
+                    (terminal_id, TERMINAL_SETTINGS["batch_number"], time.time())
+                )
+                sequence, batch_number = self._conn.execute(
+                    "SELECT next_sequence, batch_number FROM terminal_sequences WHERE terminal_id = ?",
+                    (terminal_id,)
+                ).fetchone()
+                batch_number = (batch_number + batch_increment - 1) % MAX_TRACE_NUMBER + 1
+                if sequence_increment or batch_increment:
+                    self._conn.execute(
+                        "UPDATE terminal_sequences SET next_sequence = ?, batch_number = ?, updated_at = ?"
+                        " WHERE terminal_id = ?",
+                        (sequence + sequence_increment, batch_number, time.time(), terminal_id)
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return sequence, batch_number
+
+    def _reserve_block(self, terminal_id: str, state: _TerminalSequence) -> None:
+        """Reserve the next block of sequence values (state.lock must be held)"""
+        start, batch_number = self._update(terminal_id, self.block_size, 0)
+        state.block = (itertools.count(start), start + self.block_size)
+        state.batch_number = batch_number
+        state.batch_checked_at = time.monotonic()
+        state.blocks_reserved += 1
+        logger.debug("Reserved trace block %s-%s for terminal %s", start, start + self.block_size - 1, terminal_id)
+
+    def next_trace_number(self, terminal_id: str) -> str:
+        """
+        Allocate the next STAN of a terminal
+
+        Args:
+            terminal_id: The terminal ID
+
+        Returns:
+            str: The 6-digit trace number
+        """
+        state = self._get_terminal(terminal_id)
+        while True:
+            counter, end = state.block
+            sequence = next(counter, end)
+            if sequence < end:
+                return format_trace_number(sequence)
+            with state.lock:
+                # Another thread may have reserved a new block while we waited
+                if state.block[0] is counter:
+                    self._reserve_block(terminal_id, state)
+
+    def batch_number(self, terminal_id: str) -> int:
+        """
+        Get the open batch number of a terminal
+
+        Args:
+            terminal_id: The terminal ID
+
+        Returns:
+            int: The batch number, at most batch_refresh_interval seconds stale
+        """
+        state = self._get_terminal(terminal_id)
+        if time.monotonic() - state.batch_checked_at >= self.batch_refresh_interval:
+            with state.lock:
+                if time.monotonic() - state.batch_checked_at >= self.batch_refresh_interval:
+                    state.batch_number = self._update(terminal_id, 0, 0)[1]
+                    state.batch_checked_at = time.monotonic()
+        return state.batch_number
+
+    def close_batch(self, terminal_id: str) -> Tuple[int, int]:
+        """
+        Close the open batch of a terminal and open the next one
+
+        Args:
+            terminal_id: The terminal ID
+
+        Returns:
+            Tuple[int, int]: The closed and the newly opened batch number
+        """
+        state = self._get_terminal(terminal_id)
+        with state.lock:
+            new_batch = self._update(terminal_id, 0, 1)[1]
+            state.batch_number = new_batch
+            state.batch_checked_at = time.monotonic()
+        closed_batch = (new_batch - 2) % MAX_TRACE_NUMBER + 1
+        logger.info(f"Batch {closed_batch} closed for terminal {terminal_id}; batch {new_batch} opened")
+        return closed_batch, new_batch
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get allocation counters
+
+        Returns:
+            Dict[str, Any]: Terminals seen and blocks reserved by this process
+        """
+        terminals = list(self._terminals.values())
+        return {
+            "terminals": len(terminals),
+            "block_size": self.block_size,
+            "blocks_reserved": sum(state.blocks_reserved for state in terminals)
+        }
+
+    def close(self) -> None:
+        """Close the database"""
+        with self._db_lock:
+            self._conn.close()
+
+
+_default_allocator: Optional[TraceNumberAllocator] = None
+_default_allocator_lock = threading.Lock()
+
+
+def get_default_allocator() -> TraceNumberAllocator:
+    """Get the process-wide trace number allocator, opening it on first use"""
+    global _default_allocator
+    if _default_allocator is None:
+        with _default_allocator_lock:
+            if _default_allocator is None:
+                _default_allocator = TraceNumberAllocator(STAN_SETTINGS["path"])
+    return _default_allocator
@@ -0,0 +1,209 @@
+"""
+Black Rock Payment Terminal - Offline Synchronization Engine
+"""
+
+import time
+import asyncio
+import logging
+import datetime
+from typing import Dict, Any, List, Set, Optional
+
+import httpx
+
+from app.core.transaction import Transaction
+from app.core.breaker import backoff_delay
+from app.config.settings import OFFLINE_SYNC_SETTINGS
+from app.utils.codec import decode_response
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineSyncEngine:
+    """
+    Drains a terminal's offline queue to the bulk /sync_offline endpoint
+
+    Transactions are sent in batches with up to max_parallel_batches requests
+    in flight. The batch size adapts to observed latency (additive increase,
+    multiplicative decrease around target_batch_latency). Items the host does
+    not accept are retried with jittered exponential backoff while keeping
+    their place in the queue. Subclasses drain other durable queues to
+    other endpoints by overriding _send.
+    """
+
+    # Name used in log messages
+    name = "Offline sync"
+
+    def __init__(self, processor, queue=None, settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the sync engine
+
+        Args:
+            processor: The TransactionProcessor whose queue is drained
+            queue: The queue to drain (defaults to the processor's offline queue)
+            settings: Batching and retry settings (defaults to OFFLINE_SYNC_SETTINGS)
+        """
+        self.processor = processor
+        self.queue = queue if queue is not None else processor.offline_queue
+        self.settings = settings or OFFLINE_SYNC_SETTINGS
+        self.batch_size = self.settings["batch_size"]
+        self.min_batch_size = self.settings["min_batch_size"]
+        self.max_batch_size = self.settings["max_batch_size"]
+        self.batch_size_step = self.settings["batch_size_step"]
+        self.target_latency = self.settings["target_batch_latency"]
+        self.poll_interval = self.settings["poll_interval"]
+        self._slots = None
+        self._wakeup = asyncio.Event()
+        self._inflight: Set[asyncio.Task] = set()
+        self._task = None
+        self.stats = {
+            "batches_sent": 0,
+            "batches_failed": 0,
+            "items_synced": 0,
+            "items_retried": 0
+        }
+
+    def start(self) -> None:
+        """Start draining on the processor event loop (no-op if already running)"""
+        if self.is_running():
+            return
+        self.processor.runtime.call_soon(self._create_task)
+
+    def _create_task(self) -> None:
+        """Create the drain task (must run on the processor event loop)"""
+        if self._task is None or self._task.done():
+            self._slots = asyncio.Semaphore(self.settings["max_parallel_batches"])
+            self._task = self.processor.loop.create_task(self.run())
+            logger.info(f"{self.name} engine started")
+
+    def wake(self) -> None:
+        """Signal new work or a reconnection (safe to call from any thread)"""
+        self.processor.scheduler.wake(self._wakeup)
+
+    def is_running(self) -> bool:
+        """Check if the drain task is running"""
+        return self._task is not None and not self._task.done()
+
+    def stop(self) -> None:
+        """Cancel the drain task and any in-flight batches (leased items stay queued)"""
+        if self._task is not None:
+            self.processor.loop.call_soon_threadsafe(self._task.cancel)
+            for task in list(self._inflight):
+                self.processor.loop.call_soon_threadsafe(task.cancel)
+
+    async def _idle(self) -> None:
+        """Wait until in-flight batches finish, new work is signalled or the next retry becomes due"""
+        if self._inflight:
+            await asyncio.wait(self._inflight, return_when=asyncio.FIRST_COMPLETED)
+            return
+
+        delay = self.poll_interval
+        if not await self.queue.empty_async():
+            next_due = await asyncio.to_thread(self.queue.next_due)
+            if next_due is not None:
+                delay = min(delay, max(next_due - time.time(), 0.05))
+        await self.processor.scheduler.wait_for_work(self._wakeup, delay)
+
+    async def run(self) -> None:
+        """Lease batches and send them while the terminal is online"""
+        queue = self.queue
+        while True:
+            if not self.processor.is_online or await queue.empty_async():
+                await self._idle()
+                continue
+
+            await self._slots.acquire()
+            try:
+                batch = await asyncio.to_thread(queue.get_batch, self.batch_size)
+            except Exception as e:
+                self._slots.release()
+                logger.error(f"{self.name}: error leasing batch: {str(e)}")
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            if not batch:
+                self._slots.release()
+                await self._idle()
+                continue
+
+            task = asyncio.get_running_loop().create_task(self._send_batch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _send(self, batch: List[Transaction]) -> Dict[str, Dict[str, Any]]:
+        """
+        Upload a batch to the host
+
+        Returns:
+            Dict[str, Dict[str, Any]]: The host's result per transaction ID
+
+        Raises:
+            Exception: If the batch as a whole was not accepted
+        """
+        payload = {
+            "transactions": [transaction.to_dict() for transaction in batch],
+            "terminal_id": self.processor.terminal_id,
+            "merchant_id": self.processor.merchant_id,
+            "sync_timestamp": datetime.datetime.now().isoformat()
+        }
+        response = await self.processor.transport.apost("/sync_offline", payload)
+        if response.status_code != 200:
+            raise httpx.HTTPError(f"HTTP {response.status_code}")
+        return {
+            result.get("transaction_id"): result
+            for result in decode_response(response).get("results", [])
+        }
+
+    async def _send_batch(self, batch: List[Transaction]) -> None:
+        """Send one batch and apply the per-item results"""
+        queue = self.queue
+        started = time.monotonic()
+        try:
+            results = await self._send(batch)
+            self.processor.scheduler.record_liveness()
+        except Exception as e:
+            logger.warning(f"{self.name} batch of {len(batch)} failed: {str(e)}")
+            self.stats["batches_failed"] += 1
+            self._adapt(None)
+            for transaction in batch:
+                self._retry(transaction)
+            return
+        finally:
+            self._slots.release()
+
+        self.stats["batches_sent"] += 1
+        self._adapt(time.monotonic() - started)
+
+        for transaction in batch:
+            result = results.get(transaction.transaction_id)
+            if result and result.get("status") == "success":
+                queue.ack(transaction.transaction_id)
+                self.stats["items_synced"] += 1
+            else:
+                reason = result.get("message", "Unknown error") if result else "Missing result"
+                logger.warning(f"{self.name}: server rejected transaction {transaction.transaction_id}: {reason}")
+                self._retry(transaction)
+
+        logger.info(f"{self.name}: sent batch of {len(batch)} in {time.monotonic() - started:.3f}s "
+                    f"(next batch size {self.batch_size})")
+
+    def _retry(self, transaction: Transaction) -> None:
+        """Schedule a failed item for retry with jittered exponential backoff"""
+        queue = self.queue
+        delay = backoff_delay(
+            queue.get_attempts(transaction.transaction_id) + 1,
+            self.settings["retry_base_delay"],
+            self.settings["retry_max_delay"]
+        )
+        queue.retry(transaction.transaction_id, delay)
+        self.stats["items_retried"] += 1
+
+    def _adapt(self, latency: float) -> None:
+        """Grow the batch while latency is under target, halve it on failure or overshoot"""
+        if latency is not None and latency <= self.target_latency:
+            self.batch_size = min(self.batch_size + self.batch_size_step, self.max_batch_size)
+        else:
+            self.batch_size = max(self.batch_size // 2, self.min_batch_size)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get sync counters and the current batch size"""
+        return dict(self.stats, batch_size=self.batch_size, inflight_batches=len(self._inflight))
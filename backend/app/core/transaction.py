@@ -8,12 +8,8 @@ import logging
 from enum import Enum
 from typing import Dict, Any, Optional
 from ..config import settings
+from .stan import get_default_allocator
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
@@ -48,8 +44,25 @@ class PaymentMethod(Enum):
     MANUAL_ENTRY = "MANUAL_ENTRY"
 
 
+# Attributes serialized by Transaction.to_dict; assigning any of them drops the cached dict
+_SERIALIZED_FIELDS = frozenset((
+    "transaction_id", "timestamp", "amount", "currency", "transaction_type", "payment_method",
+    "protocol", "merchant_id", "terminal_id", "is_online", "status", "approval_code",
+    "response_code", "response_message", "mti", "trace_number", "batch_number"
+))
+
+
 class Transaction:
-    """Base transaction class for all payment transactions"""
+    """
+    Base transaction class for all payment transactions
+
+    Attributes live in slots rather than a per-instance __dict__, which
+    roughly halves the memory of a transaction held in history. to_dict()
+    builds its dict once and caches it until one of the serialized
+    attributes is assigned.
+    """
+
+    __slots__ = tuple(sorted(_SERIALIZED_FIELDS)) + ("card_data", "_dict_cache")
     
     def __init__(
         self,
@@ -63,6 +76,7 @@ class Transaction:
         is_online: bool = True
     ):
         """Initialize a new transaction"""
+        self._dict_cache = None
         self.transaction_id = str(uuid.uuid4())
         self.timestamp = datetime.datetime.now()
         self.amount = amount
@@ -90,30 +104,34 @@ class Transaction:
         if currency not in settings.SUPPORTED_CURRENCIES:
             raise ValueError(f"Unsupported currency: {currency}")
         
-        # Generate trace number (unique within a batch)
+        # Generate trace number (unique per terminal within the STAN cycle)
         self.trace_number = self._generate_trace_number()
-        self.batch_number = settings.TERMINAL_SETTINGS["batch_number"]
+        self.batch_number = get_default_allocator().batch_number(terminal_id)
         
-        logger.info(f"Transaction {self.transaction_id} initialized: {transaction_type.value} "
-                   f"for {amount} {currency} using {payment_method.value}")
+        logger.debug("Transaction %s initialized: %s for %s %s using %s",
+                     self.transaction_id, transaction_type.value, amount, currency, payment_method.value)
+    
+    def __setattr__(self, name: str, value: Any) -> None:
+        object.__setattr__(self, name, value)
+        if name in _SERIALIZED_FIELDS:
+            object.__setattr__(self, "_dict_cache", None)
     
     def _generate_trace_number(self) -> str:
         """Generate a unique trace number for the transaction"""
-        # Simple implementation - in production this would be more sophisticated
-        return str(int(datetime.datetime.now().timestamp() * 1000) % 1000000).zfill(6)
+        return get_default_allocator().next_trace_number(self.terminal_id)
     
     def set_card_data(self, card_data: Dict[str, Any]) -> None:
         """Set card data for the transaction"""
         # In a real implementation, this would include encryption/tokenization
         self.card_data = card_data
-        logger.info(f"Card data set for transaction {self.transaction_id}")
+        logger.debug("Card data set for transaction %s", self.transaction_id)
     
     def set_mti(self, mti: str) -> None:
         """Set the Message Type Indicator for the transaction"""
         if mti not in settings.MTI_TYPES:
             raise ValueError(f"Invalid MTI: {mti}")
         self.mti = mti
-        logger.info(f"MTI set to {mti} for transaction {self.transaction_id}")
+        logger.debug("MTI set to %s for transaction %s", mti, self.transaction_id)
     
     def update_status(self, status: TransactionStatus, response_code: str = None, 
                      response_message: str = None) -> None:
@@ -123,7 +141,7 @@ class Transaction:
             self.response_code = response_code
         if response_message:
             self.response_message = response_message
-        logger.info(f"Transaction {self.transaction_id} status updated to {status.value}")
+        logger.debug("Transaction %s status updated to %s", self.transaction_id, status.value)
     
     def set_approval_code(self, approval_code: str) -> None:
         """Set the approval code for the transaction"""
@@ -135,52 +153,77 @@ class Transaction:
         
         self.approval_code = approval_code
         self.update_status(TransactionStatus.APPROVED)
-        logger.info(f"Approval code {approval_code} set for transaction {self.transaction_id}")
+        logger.debug("Approval code %s set for transaction %s", approval_code, self.transaction_id)
     
     def to_dict(self) -> Dict[str, Any]:
-        """Convert transaction to dictionary for storage or transmission"""
-        return {
-            "transaction_id": self.transaction_id,
-            "timestamp": self.timestamp.isoformat(),
-            "amount": self.amount,
-            "currency": self.currency,
-            "transaction_type": self.transaction_type.value,
-            "payment_method": self.payment_method.value,
-            "protocol": self.protocol,
-            "merchant_id": self.merchant_id,
-            "terminal_id": self.terminal_id,
-            "is_online": self.is_online,
-            "status": self.status.value,
-            "approval_code": self.approval_code,
-            "response_code": self.response_code,
-            "response_message": self.response_message,
-            "mti": self.mti,
-            "trace_number": self.trace_number,
-            "batch_number": self.batch_number
-        }
+        """
+        Convert transaction to dictionary for storage or transmission
+
+        The dict is cached and shared between calls until the transaction
+        changes, so callers must not modify it (copy it first).
+
+        Returns:
+            Dict[str, Any]: The serialized transaction
+        """
+        cached = self._dict_cache
+        if cached is None:
+            cached = {
+                "transaction_id": self.transaction_id,
+                "timestamp": self.timestamp.isoformat(),
+                "amount": self.amount,
+                "currency": self.currency,
+                "transaction_type": self.transaction_type.value,
+                "payment_method": self.payment_method.value,
+                "protocol": self.protocol,
+                "merchant_id": self.merchant_id,
+                "terminal_id": self.terminal_id,
+                "is_online": self.is_online,
+                "status": self.status.value,
+                "approval_code": self.approval_code,
+                "response_code": self.response_code,
+                "response_message": self.response_message,
+                "mti": self.mti,
+                "trace_number": self.trace_number,
+                "batch_number": self.batch_number
+            }
+            object.__setattr__(self, "_dict_cache", cached)
+        return cached
     
     @classmethod
     def from_dict(cls, data: Dict[str, Any]) -> 'Transaction':
-        """Create a transaction object from a dictionary"""
-        transaction = cls(
-            amount=data["amount"],
-            currency=data["currency"],
-            transaction_type=TransactionType(data["transaction_type"]),
-            payment_method=PaymentMethod(data["payment_method"]),
-            protocol=data["protocol"],
-            merchant_id=data["merchant_id"],
-            terminal_id=data["terminal_id"],
-            is_online=data["is_online"]
-        )
-        
-        transaction.transaction_id = data["transaction_id"]
-        transaction.timestamp = datetime.datetime.fromisoformat(data["timestamp"])
-        transaction.status = TransactionStatus(data["status"])
-        transaction.approval_code = data["approval_code"]
-        transaction.response_code = data["response_code"]
-        transaction.response_message = data["response_message"]
-        transaction.mti = data["mti"]
-        transaction.trace_number = data["trace_number"]
-        transaction.batch_number = data["batch_number"]
+        """
+        Create a transaction object from a dictionary
+
+        The data comes from a transaction that was validated when it was
+        created (offline queue, history database), so __init__ is bypassed:
+        no protocol/currency validation, no new trace number and no log line.
+
+        Args:
+            data: A dict produced by to_dict
+
+        Returns:
+            Transaction: The restored transaction
+        """
+        transaction = cls.__new__(cls)
+        set_slot = object.__setattr__
+        set_slot(transaction, "transaction_id", data["transaction_id"])
+        set_slot(transaction, "timestamp", datetime.datetime.fromisoformat(data["timestamp"]))
+        set_slot(transaction, "amount", data["amount"])
+        set_slot(transaction, "currency", data["currency"])
+        set_slot(transaction, "transaction_type", TransactionType(data["transaction_type"]))
+        set_slot(transaction, "payment_method", PaymentMethod(data["payment_method"]))
+        set_slot(transaction, "protocol", data["protocol"])
+        set_slot(transaction, "merchant_id", data["merchant_id"])
+        set_slot(transaction, "terminal_id", data["terminal_id"])
+        set_slot(transaction, "is_online", data["is_online"])
+        set_slot(transaction, "status", TransactionStatus(data["status"]))
+        set_slot(transaction, "approval_code", data["approval_code"])
+        set_slot(transaction, "response_code", data["response_code"])
+        set_slot(transaction, "response_message", data["response_message"])
+        set_slot(transaction, "mti", data["mti"])
+        set_slot(transaction, "trace_number", data["trace_number"])
+        set_slot(transaction, "batch_number", data["batch_number"])
+        set_slot(transaction, "card_data", {})
+        set_slot(transaction, "_dict_cache", None)
         
-        return transaction
\ No newline at end of file
+        return transaction
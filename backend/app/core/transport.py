@@ -0,0 +1,313 @@
+"""
+Black Rock Payment Terminal - Host Transport
+"""
+
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, Any, Optional, List
+
+import httpx
+
+from app.core.breaker import CircuitBreaker
+from app.core.latency import LatencyHistogram
+from app.utils.metrics import HOST_REQUEST_SECONDS
+from app.utils.codec import get_codec, JSON_CONTENT_TYPE
+from app.config.settings import NETWORK_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+
+class HostUnavailableError(httpx.TransportError):
+    """Raised when the circuit of every configured host is open"""
+
+
+class HostTransport:
+    """
+    Pooled, keep-alive HTTP transport to a single payment host
+
+    One async client, used on the processor event loop, holds the pool
+    limits and timeouts. Each transport talks to exactly one host, so the
+    pool limits are per-host limits.
+    """
+
+    def __init__(self, base_url: str, network_settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the transport
+
+        Args:
+            base_url: The host base URL, e.g. http://acquirer:8001
+            network_settings: Overrides for NETWORK_SETTINGS (timeouts and pool limits)
+        """
+        config = dict(NETWORK_SETTINGS)
+        if network_settings:
+            config.update(network_settings)
+
+        self.base_url = base_url.rstrip("/")
+        self.limits = httpx.Limits(
+            max_connections=config["max_connections"],
+            max_keepalive_connections=config["max_keepalive_connections"],
+            keepalive_expiry=config["keepalive_expiry"]
+        )
+        self.timeout = httpx.Timeout(
+            connect=config["connect_timeout"],
+            read=config["read_timeout"],
+            write=config["read_timeout"],
+            pool=config["pool_timeout"]
+        )
+
+        # Payloads are encoded with the configured codec; the host may answer in it or in JSON
+        self.codec = get_codec(config["host_content_type"])
+        self.headers = {"Content-Type": self.codec.content_type}
+        if self.codec.content_type != JSON_CONTENT_TYPE:
+            self.headers["Accept"] = f"{self.codec.content_type}, {JSON_CONTENT_TYPE};q=0.5"
+
+        self._async_client = None
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "requests": 0,
+            "connections_opened": 0,
+            "tls_handshakes": 0,
+            "connection_errors": 0
+        }
+
+        logger.info(f"Host transport initialized for {self.base_url}")
+
+    def _record(self, key: str) -> None:
+        """Increment a transport counter"""
+        with self._stats_lock:
+            self._stats[key] += 1
+
+    def _trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        """httpcore trace hook used to count new connections and handshakes"""
+        if event_name == "connection.connect_tcp.complete":
+            self._record("connections_opened")
+        elif event_name == "connection.start_tls.complete":
+            self._record("tls_handshakes")
+
+    async def _async_trace(self, event_name: str, info: Dict[str, Any]) -> None:
+        """Async variant of the trace hook for the async client"""
+        self._trace(event_name, info)
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """Get the async client, creating it on first use (must run on the processor event loop)"""
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._async_client
+
+    async def apost(self, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        Send a POST over the pooled async client
+
+        Args:
+            path: The request path, e.g. /process
+            payload: The payload, encoded with the host codec
+
+        Returns:
+            httpx.Response: The host response
+        """
+        self._record("requests")
+        try:
+            return await self._get_async_client().post(
+                f"{self.base_url}{path}",
+                content=self.codec.encode(payload),
+                headers=self.headers,
+                extensions={"trace": self._async_trace}
+            )
+        except httpx.TransportError:
+            self._record("connection_errors")
+            raise
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get connection reuse counters
+
+        Returns:
+            Dict[str, Any]: Request, connection and reuse counts
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats["connections_reused"] = max(stats["requests"] - stats["connections_opened"] - stats["connection_errors"], 0)
+        stats["reuse_ratio"] = stats["connections_reused"] / stats["requests"] if stats["requests"] else 0.0
+        stats["host"] = self.base_url
+        return stats
+
+    async def aclose(self) -> None:
+        """Close the async client (must run on the processor event loop)"""
+        if self._async_client is not None:
+            await self._async_client.aclose()
+            self._async_client = None
+
+
+class FailoverTransport:
+    """
+    Routes host traffic to the primary host with automatic failover to the backup
+
+    Each host has its own pooled HostTransport and CircuitBreaker. Requests go
+    to the first host, primary first, whose circuit allows them, so traffic
+    moves to the backup while the primary's circuit is open and fails back
+    once a half-open probe to the primary succeeds. Connection failures, which
+    guarantee the request never reached the host, are retried on the next
+    host within the same call.
+    """
+
+    def __init__(self, primary_url: str, backup_url: Optional[str] = None,
+                 network_settings: Optional[Dict[str, Any]] = None):
+        """
+        Initialize the failover transport
+
+        Args:
+            primary_url: The primary host base URL
+            backup_url: The backup host base URL (optional)
+            network_settings: Overrides for NETWORK_SETTINGS passed to each host transport
+        """
+        self.hosts: List[HostTransport] = [HostTransport(primary_url, network_settings)]
+        if backup_url:
+            self.hosts.append(HostTransport(backup_url, network_settings))
+        self.breakers = {host.base_url: CircuitBreaker(host.base_url) for host in self.hosts}
+        self.latencies = {host.base_url: LatencyHistogram() for host in self.hosts}
+        self.active_host = self.hosts[0].base_url
+        self.hedges_sent = 0
+        self.hedges_won = 0
+
+    @property
+    def base_url(self) -> str:
+        """The base URL of the host currently receiving traffic"""
+        return self.active_host
+
+    def _candidates(self):
+        """Yield the hosts whose circuit allows a request, primary first"""
+        for host in self.hosts:
+            if self.breakers[host.base_url].allow_request():
+                yield host
+
+    def _activate(self, host: HostTransport) -> None:
+        """Log failover and failback when the serving host changes"""
+        if host.base_url != self.active_host:
+            direction = "Failing back" if host is self.hosts[0] else "Failing over"
+            logger.warning(f"{direction} from {self.active_host} to {host.base_url}")
+            self.active_host = host.base_url
+
+    def _record(self, host: HostTransport, path: str, response: httpx.Response, started: float) -> None:
+        """Record a completed call on the host's breaker and latency histogram (5xx counts as a failure)"""
+        breaker = self.breakers[host.base_url]
+        latency = time.monotonic() - started
+        HOST_REQUEST_SECONDS.labels(host.base_url, path, f"{response.status_code // 100}xx").observe(latency)
+        if response.status_code >= 500:
+            breaker.record_failure(latency)
+        else:
+            breaker.record_success(latency)
+            self.latencies[host.base_url].record(latency)
+
+    def _record_error(self, host: HostTransport, path: str, error: Exception, started: float) -> None:
+        """Record a call that failed without a response"""
+        latency = time.monotonic() - started
+        HOST_REQUEST_SECONDS.labels(host.base_url, path, type(error).__name__).observe(latency)
+        self.breakers[host.base_url].record_failure(latency)
+
+    async def _asend(self, host: HostTransport, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        """Send over one host's async client and record the outcome"""
+        started = time.monotonic()
+        try:
+            response = await host.apost(path, payload)
+        except httpx.TransportError as e:
+            self._record_error(host, path, e, started)
+            raise
+        self._record(host, path, response, started)
+        return response
+
+    async def apost(self, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        """Send a JSON POST over the async client of the first available host"""
+        for host in self._candidates():
+            self._activate(host)
+            try:
+                return await self._asend(host, path, payload)
+            except httpx.ConnectError:
+                continue
+        raise HostUnavailableError("No payment host available")
+
+    def hedge_delay(self, host: HostTransport) -> float:
+        """
+        Get how long to wait for a host before sending a hedged duplicate
+
+        The delay is the configured quantile (p95 by default) of the host's
+        rolling latency histogram, clamped to the configured bounds.
+        """
+        histogram = self.latencies[host.base_url]
+        delay = None
+        if len(histogram) >= NETWORK_SETTINGS["hedge_min_samples"]:
+            delay = histogram.quantile(NETWORK_SETTINGS["hedge_quantile"])
+        if delay is None:
+            delay = NETWORK_SETTINGS["hedge_max_delay"]
+        return min(max(delay, NETWORK_SETTINGS["hedge_min_delay"]), NETWORK_SETTINGS["hedge_max_delay"])
+
+    async def apost_hedged(self, path: str, payload: Dict[str, Any]) -> httpx.Response:
+        """
+        Send an idempotent JSON POST, hedging to a second host if the first is slow
+
+        If the first host has not answered within hedge_delay, the same request
+        is sent to the next available host and whichever response arrives
+        first wins; the other request is cancelled. Only use this for message
+        types that are safe to deliver twice.
+        """
+        candidates = self._candidates()
+        primary = next(candidates, None)
+        if primary is None:
+            raise HostUnavailableError("No payment host available")
+        self._activate(primary)
+
+        first = asyncio.ensure_future(self._asend(primary, path, payload))
+        done, _ = await asyncio.wait({first}, timeout=self.hedge_delay(primary))
+        if done and first.exception() is None:
+            return first.result()
+
+        secondary = next(candidates, None)
+        if secondary is None:
+            return await first
+
+        self.hedges_sent += 1
+        logger.info(f"Hedging {path} to {secondary.base_url} after slow response from {primary.base_url}")
+        second = asyncio.ensure_future(self._asend(secondary, path, payload))
+        pending = {second} if done else {first, second}
+        error = first.exception() if done else None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is second:
+                            self.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get per-host connection and circuit statistics
+
+        Returns:
+            Dict[str, Any]: The active host and the stats of every host
+        """
+        return {
+            "active_host": self.active_host,
+            "hedges_sent": self.hedges_sent,
+            "hedges_won": self.hedges_won,
+            "hosts": [
+                dict(
+                    host.get_stats(),
+                    circuit=self.breakers[host.base_url].get_stats(),
+                    latency=self.latencies[host.base_url].get_stats()
+                )
+                for host in self.hosts
+            ]
+        }
+
+    async def aclose(self) -> None:
+        """Close the async clients of all hosts (must run on the processor event loop)"""
+        for host in self.hosts:
+            await host.aclose()
@@ -0,0 +1,98 @@
+"""
+Black Rock Payment Terminal - Worker Process Identity
+"""
+
+import os
+import time
+import zlib
+import fcntl
+import logging
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+def owner_slot(terminal_id: str, worker_count: int) -> int:
+    """
+    Get the worker slot that owns a terminal's background jobs
+
+    Uses CRC32 rather than hash() so that every worker process, whatever its
+    hash seed, computes the same owner.
+
+    Args:
+        terminal_id: The terminal ID
+        worker_count: Number of worker slots
+
+    Returns:
+        int: The owning slot, 0 <= slot < worker_count
+    """
+    return zlib.crc32(terminal_id.encode("utf-8")) % worker_count
+
+
+class WorkerIdentity:
+    """
+    The slot of this process among the server's worker processes
+
+    Each worker holds an exclusive lock on one of worker_count lock files;
+    the lock is released by the OS when the process dies, so a replacement
+    worker takes over the same slot and with it the same terminals. Heartbeats,
+    offline sync and other per-terminal background jobs run only in the
+    terminal's owner; payments can be processed by any worker.
+    """
+
+    def __init__(self, worker_count: int = 1, lock_dir: Optional[str] = None,
+                 acquire_timeout: float = 10.0):
+        """
+        Claim a worker slot
+
+        Args:
+            worker_count: Number of worker processes sharing the host
+            lock_dir: Directory holding the slot lock files
+            acquire_timeout: Seconds to wait for a slot freed by an exiting worker
+        """
+        self.worker_count = max(worker_count, 1)
+        self.slot: Optional[int] = None
+        self._lock_file = None
+
+        if self.worker_count == 1:
+            self.slot = 0
+            return
+
+        os.makedirs(lock_dir, exist_ok=True)
+        deadline = time.monotonic() + acquire_timeout
+        while self.slot is None:
+            for slot in range(self.worker_count):
+                lock_file = open(os.path.join(lock_dir, f"worker-{slot}.lock"), "w")
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    lock_file.close()
+                    continue
+                lock_file.write(str(os.getpid()))
+                lock_file.flush()
+                self.slot = slot
+                self._lock_file = lock_file
+                break
+            else:
+                if time.monotonic() >= deadline:
+                    logger.warning(f"No free worker slot of {self.worker_count}; running without terminal ownership")
+                    return
+                time.sleep(0.1)
+
+        logger.info(f"Worker {os.getpid()} holds slot {self.slot} of {self.worker_count}")
+
+    @property
+    def is_shared(self) -> bool:
+        """Whether several worker processes share the host"""
+        return self.worker_count > 1
+
+    def owns(self, terminal_id: str) -> bool:
+        """Check if this worker runs the background jobs of a terminal"""
+        return self.slot is not None and owner_slot(terminal_id, self.worker_count) == self.slot
+
+    def release(self) -> None:
+        """Give up the slot"""
+        if self._lock_file is not None:
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
+            self._lock_file = None
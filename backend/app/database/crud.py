@@ -2,14 +2,20 @@
 Black Rock Payment Terminal - Database CRUD Operations
 """
 
+from functools import lru_cache
+from sqlalchemy import select, insert
 from sqlalchemy.orm import Session
 from .models import TransactionModel, PayoutSettings
 from ..core.transaction import Transaction
-from typing import List, Optional
+from ..utils.metrics import timed_stage
+from typing import Dict, Any, List, Optional, TYPE_CHECKING
 
-def create_transaction(db: Session, transaction: Transaction) -> TransactionModel:
-    """Create a new transaction in the database"""
-    db_transaction = TransactionModel(
+if TYPE_CHECKING:
+    from sqlalchemy.ext.asyncio import AsyncSession
+
+def transaction_row(transaction: Transaction) -> Dict[str, Any]:
+    """Snapshot the column values of a transaction"""
+    return dict(
         transaction_id=transaction.transaction_id,
         timestamp=transaction.timestamp,
         amount=transaction.amount,
@@ -28,15 +34,67 @@ def create_transaction(db: Session, transaction: Transaction) -> TransactionMode
         trace_number=transaction.trace_number,
         batch_number=transaction.batch_number
     )
+
+def _transaction_model(transaction: Transaction) -> TransactionModel:
+    """Build the database row of a transaction"""
+    return TransactionModel(**transaction_row(transaction))
+
+@lru_cache(maxsize=None)
+def _transaction_upsert(dialect: str):
+    """Build the bulk upsert of transaction rows for a dialect (plain insert where upserts are unsupported)"""
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return insert(TransactionModel.__table__)
+    statement = dialect_insert(TransactionModel.__table__)
+    return statement.on_conflict_do_update(
+        index_elements=["transaction_id"],
+        set_={
+            column.name: statement.excluded[column.name]
+            for column in TransactionModel.__table__.columns
+            if column.name not in ("id", "transaction_id")
+        }
+    )
+
+@timed_stage("db_commit")
+def create_transaction(db: Session, transaction: Transaction) -> TransactionModel:
+    """Create a new transaction in the database"""
+    db_transaction = _transaction_model(transaction)
     db.add(db_transaction)
     db.commit()
     db.refresh(db_transaction)
     return db_transaction
 
+def upsert_transactions(db: Session, rows: List[Dict[str, Any]]) -> None:
+    """
+    Insert or update many transaction rows in one statement, without committing
+
+    Args:
+        db: The session
+        rows: Column values as returned by transaction_row, at most one per transaction ID
+    """
+    db.execute(_transaction_upsert(db.get_bind().dialect.name), rows)
+
 def get_transaction(db: Session, transaction_id: str) -> Optional[TransactionModel]:
     """Get a transaction by ID"""
     return db.query(TransactionModel).filter(TransactionModel.transaction_id == transaction_id).first()
 
+def get_transaction_by_trace(db: Session, terminal_id: str, trace_number: str) -> Optional[TransactionModel]:
+    """Get the most recent transaction of a terminal with the given trace number"""
+    return db.query(TransactionModel).filter(
+        TransactionModel.terminal_id == terminal_id,
+        TransactionModel.trace_number == trace_number
+    ).order_by(TransactionModel.timestamp.desc()).first()
+
+def get_transactions_by_batch(db: Session, terminal_id: str, batch_number: int) -> List[TransactionModel]:
+    """Get all transactions of a terminal batch"""
+    return db.query(TransactionModel).filter(
+        TransactionModel.terminal_id == terminal_id,
+        TransactionModel.batch_number == batch_number
+    ).all()
+
 def get_transactions(db: Session, merchant_id: str, limit: int = 50) -> List[TransactionModel]:
     """Get recent transactions for a merchant"""
     return db.query(TransactionModel).filter(TransactionModel.merchant_id == merchant_id).order_by(TransactionModel.timestamp.desc()).limit(limit).all()
@@ -87,4 +145,85 @@ def get_payout_settings(db: Session, merchant_id: str, method: str) -> Optional[
 
 def get_all_payout_settings(db: Session, merchant_id: str) -> List[PayoutSettings]:
     """Get all payout settings for a merchant"""
-    return db.query(PayoutSettings).filter(PayoutSettings.merchant_id == merchant_id).all()
\ No newline at end of file
+    return db.query(PayoutSettings).filter(PayoutSettings.merchant_id == merchant_id).all()
+
+# Async variants for use from the event loop, with sessions from models.AsyncSessionLocal
+
+@timed_stage("db_commit")
+async def create_transaction_async(db: "AsyncSession", transaction: Transaction) -> TransactionModel:
+    """Create a new transaction in the database"""
+    db_transaction = _transaction_model(transaction)
+    db.add(db_transaction)
+    await db.commit()
+    return db_transaction
+
+async def get_transaction_async(db: "AsyncSession", transaction_id: str) -> Optional[TransactionModel]:
+    """Get a transaction by ID"""
+    result = await db.execute(select(TransactionModel).filter(TransactionModel.transaction_id == transaction_id).limit(1))
+    return result.scalars().first()
+
+async def get_transaction_by_trace_async(db: "AsyncSession", terminal_id: str, trace_number: str) -> Optional[TransactionModel]:
+    """Get the most recent transaction of a terminal with the given trace number"""
+    result = await db.execute(select(TransactionModel).filter(
+        TransactionModel.terminal_id == terminal_id,
+        TransactionModel.trace_number == trace_number
+    ).order_by(TransactionModel.timestamp.desc()).limit(1))
+    return result.scalars().first()
+
+async def get_transactions_by_batch_async(db: "AsyncSession", terminal_id: str, batch_number: int) -> List[TransactionModel]:
+    """Get all transactions of a terminal batch"""
+    result = await db.execute(select(TransactionModel).filter(
+        TransactionModel.terminal_id == terminal_id,
+        TransactionModel.batch_number == batch_number
+    ))
+    return list(result.scalars().all())
+
+async def get_transactions_async(db: "AsyncSession", merchant_id: str, limit: int = 50) -> List[TransactionModel]:
+    """Get recent transactions for a merchant"""
+    result = await db.execute(select(TransactionModel).filter(
+        TransactionModel.merchant_id == merchant_id
+    ).order_by(TransactionModel.timestamp.desc()).limit(limit))
+    return list(result.scalars().all())
+
+async def create_payout_settings_async(db: "AsyncSession", merchant_id: str, method: str, settings: dict) -> PayoutSettings:
+    """Create or update payout settings for a merchant"""
+    existing_settings = await get_payout_settings_async(db, merchant_id, method)
+    
+    if existing_settings:
+        for key, value in settings.items():
+            if hasattr(existing_settings, key):
+                setattr(existing_settings, key, value)
+        existing_settings.updated_at = settings.get("updated_at", None)
+        db_settings = existing_settings
+    else:
+        db_settings = PayoutSettings(
+            merchant_id=merchant_id,
+            method=method,
+            account_name=settings.get("account_name"),
+            account_number=settings.get("account_number"),
+            routing_number=settings.get("routing_number"),
+            bank_name=settings.get("bank_name"),
+            swift_code=settings.get("swift_code"),
+            iban=settings.get("iban"),
+            wallet_address=settings.get("wallet_address"),
+            crypto_currency=settings.get("currency"),
+            network=settings.get("network")
+        )
+        db.add(db_settings)
+    
+    await db.commit()
+    await db.refresh(db_settings)
+    return db_settings
+
+async def get_payout_settings_async(db: "AsyncSession", merchant_id: str, method: str) -> Optional[PayoutSettings]:
+    """Get payout settings for a merchant and method"""
+    result = await db.execute(select(PayoutSettings).filter(
+        PayoutSettings.merchant_id == merchant_id,
+        PayoutSettings.method == method
+    ).limit(1))
+    return result.scalars().first()
+
+async def get_all_payout_settings_async(db: "AsyncSession", merchant_id: str) -> List[PayoutSettings]:
+    """Get all payout settings for a merchant"""
+    result = await db.execute(select(PayoutSettings).filter(PayoutSettings.merchant_id == merchant_id))
+    return list(result.scalars().all())
@@ -2,12 +2,22 @@
 Black Rock Payment Terminal - Database Models
 """
 
-from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, Boolean, create_engine
+from sqlalchemy import Column, Integer, String, Float, DateTime, Enum, Boolean, create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.schema import CreateIndex
 from datetime import datetime
 import os
-from typing import Optional
+import threading
+from typing import Optional, Dict, Any
+
+from ..config.settings import DATABASE_SETTINGS
+
+try:
+    # Needs greenlet (sqlalchemy[asyncio])
+    from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+except ImportError:
+    AsyncSession = async_sessionmaker = create_async_engine = None
 
 Base = declarative_base()
 
@@ -23,15 +33,15 @@ class TransactionModel(Base):
     payment_method = Column(String)
     protocol = Column(String)
     merchant_id = Column(String)
-    terminal_id = Column(String)
+    terminal_id = Column(String, index=True)
     is_online = Column(Boolean)
     status = Column(String)
     approval_code = Column(String, nullable=True)
     response_code = Column(String, nullable=True)
     response_message = Column(String, nullable=True)
     mti = Column(String, nullable=True)
-    trace_number = Column(String, nullable=True)
-    batch_number = Column(Integer, nullable=True)
+    trace_number = Column(String, nullable=True, index=True)
+    batch_number = Column(Integer, nullable=True, index=True)
 
 class PayoutSettings(Base):
     __tablename__ = 'payout_settings'
@@ -52,11 +62,120 @@ class PayoutSettings(Base):
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # Database setup
-DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./payment_terminal.db")
+DATABASE_URL = DATABASE_SETTINGS["url"]
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _engine_options(url: str) -> Dict[str, Any]:
+    """Get the pooling options of an engine (in-memory SQLite uses a single static connection)"""
+    if _is_sqlite(url) and (":memory:" in url or url.rstrip("/").endswith(":")):
+        return {}
+    return {
+        "pool_size": DATABASE_SETTINGS["pool_size"],
+        "max_overflow": DATABASE_SETTINGS["max_overflow"],
+        "pool_timeout": DATABASE_SETTINGS["pool_timeout"],
+        "pool_recycle": DATABASE_SETTINGS["pool_recycle"],
+        "pool_pre_ping": DATABASE_SETTINGS["pool_pre_ping"],
+    }
+
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """Tune every new SQLite connection (WAL, relaxed fsync, mmap and page cache)"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in DATABASE_SETTINGS["sqlite_pragmas"].items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+def get_async_database_url(url: str = DATABASE_URL) -> str:
+    """
+    Get the async driver URL for a database URL
+
+    Args:
+        url: A sync SQLAlchemy URL
+
+    Returns:
+        str: ASYNC_DATABASE_URL if set, else the URL with the aiosqlite or asyncpg driver
+    """
+    if DATABASE_SETTINGS["async_url"]:
+        return DATABASE_SETTINGS["async_url"]
+    scheme, _, rest = url.partition("://")
+    driver = {"sqlite": "sqlite+aiosqlite", "postgresql": "postgresql+asyncpg", "postgres": "postgresql+asyncpg"}
+    return f"{driver.get(scheme, scheme)}://{rest}"
+
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+connect_args = {"check_same_thread": False} if _is_sqlite(DATABASE_URL) else {}
+engine = create_engine(DATABASE_URL, connect_args=connect_args, **_engine_options(DATABASE_URL))
+if _is_sqlite(DATABASE_URL):
+    event.listen(engine, "connect", _set_sqlite_pragmas)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# The async engine needs an async driver (aiosqlite, asyncpg), so it is created on first use
+_async_engine = None
+_async_session_factory = None
+_async_engine_lock = threading.Lock()
+
+
+def get_async_engine():
+    """
+    Get the process-wide async engine, creating it on first use
+
+    Returns:
+        AsyncEngine: The engine, with the same pooling and SQLite pragmas as the sync one
+
+    Raises:
+        ImportError: If SQLAlchemy's asyncio support or the async driver is not installed
+    """
+    global _async_engine, _async_session_factory
+    if create_async_engine is None:
+        raise ImportError("Async database access requires sqlalchemy[asyncio] (greenlet)")
+    if _async_engine is None:
+        with _async_engine_lock:
+            if _async_engine is None:
+                url = get_async_database_url()
+                async_engine = create_async_engine(url, **_engine_options(url))
+                if _is_sqlite(url):
+                    event.listen(async_engine.sync_engine, "connect", _set_sqlite_pragmas)
+                _async_session_factory = async_sessionmaker(async_engine, expire_on_commit=False, autoflush=False)
+                _async_engine = async_engine
+    return _async_engine
+
+
+def AsyncSessionLocal() -> "AsyncSession":
+    """Open an async session (connections are only checked out when it first queries)"""
+    get_async_engine()
+    return _async_session_factory()
+
+
+async def dispose_async_engine() -> None:
+    """Close the pooled connections of the async engine, if it was created"""
+    global _async_engine, _async_session_factory
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+        _async_session_factory = None
+
+
 def init_db():
     """Initialize the database"""
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
+    _create_missing_indexes()
+
+
+def _create_missing_indexes() -> None:
+    """
+    Create the declared indexes of tables that already existed
+
+    create_all skips existing tables, so indexes added to existing columns
+    (terminal_id, trace_number, batch_number) would never reach databases
+    created before them.
+    """
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(CreateIndex(index, if_not_exists=True))
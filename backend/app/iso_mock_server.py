@@ -0,0 +1,64 @@
+import os
+import asyncio
+import logging
+
+from app.core.host_link import read_frame, decode_tpdu, encode_tpdu, encode_frame, protocol_for_nii
+from app.protocols.handler import MTIHandler, get_protocol_handler
+from app.protocols.iso8583 import MessageSpec, BASE_FIELDS, MAX_MESSAGE_SIZE
+
+logger = logging.getLogger("iso_mock_server")
+
+# Stand-in ISO 8583 host for the terminal's TCP host link (python -m app.iso_mock_server)
+PORT = int(os.getenv("ISO_MOCK_PORT", "8583"))
+# Seconds before each response; with a delay, pipelined requests are answered out of order
+DELAY = float(os.getenv("ISO_MOCK_DELAY", "0"))
+
+# Every protocol shares the base layout, so one spec reads all requests
+REQUEST_SPEC = MessageSpec(dict(BASE_FIELDS))
+
+
+async def respond(writer, buffer, tpdu, mti, values):
+    if DELAY:
+        await asyncio.sleep(DELAY)
+    destination, source = decode_tpdu(tpdu)
+    protocol = protocol_for_nii(destination)
+    # For now always approve
+    response = {
+        11: values[11],
+        38: get_protocol_handler(protocol).generate_approval_code(),
+        39: "00",
+        41: values[41],
+    }
+    if not writer.is_closing():
+        writer.write(encode_frame(buffer, encode_tpdu(source, destination), protocol,
+                                  MTIHandler.get_response_mti(mti), response))
+
+
+async def handle_connection(reader, writer):
+    buffer = bytearray(MAX_MESSAGE_SIZE + 16)
+    try:
+        while True:
+            tpdu, message = await read_frame(reader)
+            mti, values = REQUEST_SPEC.decode(message)
+            if DELAY:
+                asyncio.ensure_future(respond(writer, buffer, tpdu, mti, values))
+            else:
+                await respond(writer, buffer, tpdu, mti, values)
+    except asyncio.IncompleteReadError:
+        pass
+    except (ValueError, ConnectionError) as e:
+        logger.warning(f"Closing connection: {str(e)}")
+    finally:
+        writer.close()
+
+
+async def main():
+    server = await asyncio.start_server(handle_connection, "0.0.0.0", PORT)
+    logger.info(f"ISO 8583 mock host listening on port {PORT}")
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
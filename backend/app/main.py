@@ -4,55 +4,105 @@ Black Rock Payment Terminal - Main Application Entry Point
 
 import logging
 import os
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 
-from .core.processor import TransactionProcessor
+from .core.registry import ProcessorRegistry
+from .core.admission import AdmissionController
+from .core.idempotency import IdempotencyCache
+from .core.shared_state import SharedStateStore
+from .core.workers import WorkerIdentity
+from .config.settings import WORKER_SETTINGS
+from .utils import metrics
+from .utils.codec import NegotiatedResponse, CodecNegotiationMiddleware
+from .utils.logging_pipeline import configure_logging, shutdown_logging
+from .config.terminal import TerminalConfig
+from .database.models import init_db, dispose_async_engine
 from .utils.receipt import ReceiptGenerator
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    filename='server.log'
-)
+# Configure logging: records are queued and written to server.log by a background thread
+configure_logging(filename='server.log')
 logger = logging.getLogger(__name__)
 
 # Global variables for application state
+registry = None
+admission = None
+idempotency = None
+shared_state = None
 processor = None
 receipt_generator = None
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager for startup and shutdown events"""
-    global processor, receipt_generator
+    global registry, admission, idempotency, shared_state, processor, receipt_generator
     
     # Startup
     logger.info("Starting Black Rock Payment Terminal backend")
     
     # Initialize components
+    init_db()
     merchant_id = os.getenv("MERCHANT_ID", "DEFAULT_MERCHANT")
     terminal_id = os.getenv("TERMINAL_ID", "DEFAULT_TERMINAL")
     server_url = os.getenv("SERVER_URL", "http://localhost:8001")
+    backup_server_url = os.getenv("BACKUP_SERVER_URL", "")
+    
+    # Under several workers (WEB_CONCURRENCY) every worker serves every terminal;
+    # idempotency keys and the transaction index live in a shared store and each
+    # terminal's background jobs run only in the worker whose slot owns it
+    worker = WorkerIdentity(WORKER_SETTINGS["workers"], WORKER_SETTINGS["lock_dir"])
+    if worker.is_shared:
+        shared_state = SharedStateStore(WORKER_SETTINGS["shared_state_path"])
     
-    processor = TransactionProcessor(merchant_id, terminal_id, server_url)
+    # All terminals hosted by this process share one runtime; the first is the default
+    registry = ProcessorRegistry(worker=worker)
+    terminal_ids = [terminal_id] + [
+        extra.strip() for extra in os.getenv("TERMINAL_IDS", "").split(",")
+        if extra.strip() and extra.strip() != terminal_id
+    ]
+    for hosted_terminal_id in terminal_ids:
+        registry.register(TerminalConfig(
+            merchant_id,
+            hosted_terminal_id,
+            server_url,
+            backup_server_url=backup_server_url
+        ))
+    processor = registry.get(terminal_id)
+    admission = AdmissionController(registry.runtime)
+    idempotency = IdempotencyCache(store=shared_state)
     receipt_generator = ReceiptGenerator()
     
+    metrics.ADMISSION_QUEUE_DEPTH.set_function(lambda: admission.get_stats()["queue_depth"])
+    metrics.OFFLINE_QUEUE_DEPTH.set_function(
+        lambda: sum(registry.get(hosted).get_offline_queue_size() for hosted in registry.terminal_ids())
+    )
+    if processor.writer is not None:
+        metrics.PERSISTENCE_BUFFER_DEPTH.set_function(processor.writer.buffered)
+    
     logger.info("Black Rock Payment Terminal backend initialized")
     yield
     # Shutdown
     logger.info("Shutting down Black Rock Payment Terminal backend")
-    processor.shutdown()
+    admission.shutdown()
+    registry.shutdown()
+    if shared_state is not None:
+        shared_state.close()
+    await dispose_async_engine()
+    shutdown_logging()
 
 # Create FastAPI app with lifespan
 app = FastAPI(
     title="Black Rock Payment Terminal API",
     description="Production-ready payment terminal backend API",
     version="1.0.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=NegotiatedResponse
 )
 
+# Answer in msgpack or JSON according to the Accept header
+app.add_middleware(CodecNegotiationMiddleware)
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -66,6 +116,11 @@ app.add_middleware(
 from .api.routes import router as api_router
 app.include_router(api_router, prefix="/api")
 
+# Prometheus scrape endpoint (per worker process)
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
 # Root endpoint
 @app.get("/")
 async def root():
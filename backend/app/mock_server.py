@@ -1,12 +1,50 @@
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 
-app = FastAPI()
+from app.utils.codec import get_codec, NegotiatedResponse, CodecNegotiationMiddleware
+
+app = FastAPI(default_response_class=NegotiatedResponse)
+app.add_middleware(CodecNegotiationMiddleware)
+
+async def read_payload(request: Request) -> dict:
+    # Terminals send JSON or msgpack, as declared by Content-Type
+    return get_codec(request.headers.get("content-type")).decode(await request.body())
 
 @app.post("/heartbeat")
 def heartbeat():
     return {"status": "ok", "message": "Heartbeat received"}
 
 @app.post("/process")
-def process_transaction(data: dict):
+async def process_transaction(request: Request):
+    data = await read_payload(request)
     # For now always approve
     return {"approved": True, "approval_code": "123456"}
+
+@app.post("/reconciliation")
+async def reconciliation(request: Request):
+    data = await read_payload(request)
+    # Totals always agree with the host's
+    return {"mti": "0530", "batch_number": data.get("batch_number"), "response_code": "00"}
+
+@app.post("/reversals")
+async def reversals(request: Request):
+    data = await read_payload(request)
+    # Every 0500 is accepted
+    return {
+        "results": [
+            {"transaction_id": reversal.get("transaction_id"), "mti": "0510", "status": "success", "response_code": "00"}
+            for reversal in data.get("reversals", [])
+        ]
+    }
+
+@app.post("/sync_offline")
+async def sync_offline(request: Request):
+    data = await read_payload(request)
+    # Accepts a single "transaction" or a bulk "transactions" list, always accepts
+    transactions = data.get("transactions") or [data.get("transaction", {})]
+    return {
+        "status": "success",
+        "results": [
+            {"transaction_id": transaction.get("transaction_id"), "status": "success"}
+            for transaction in transactions
+        ]
+    }
@@ -0,0 +1,199 @@
+"""
+Black Rock Payment Terminal - Bulk Validation
+"""
+
+from typing import Dict, Any, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+from .handler import get_protocol_handler
+from ..config.settings import PROTOCOLS
+
+_ZERO, _NINE = ord("0"), ord("9")
+_UPPER_A, _UPPER_Z = ord("A"), ord("Z")
+_LOWER_A, _LOWER_Z = ord("a"), ord("z")
+
+# Card numbers (ISO/IEC 7812) are 12 to 19 digits
+PAN_MIN_LENGTH = 12
+PAN_MAX_LENGTH = 19
+
+# No approval code is longer than this; longer strings are invalid whatever their content
+APPROVAL_CODE_MAX_LENGTH = max(config["approval_length"] for config in PROTOCOLS.values())
+
+# Luhn value of a doubled digit: 2d, minus 9 when that has two digits
+_LUHN_DOUBLED = np.array([0, 2, 4, 6, 8, 1, 3, 5, 7, 9], dtype=np.uint8)
+
+
+def _lengths(values: Sequence[str]) -> np.ndarray:
+    """Get the length of each string without laying the strings out"""
+    return np.fromiter((len(value) for value in values), dtype=np.intp, count=len(values))
+
+
+def _code_points(values: Sequence[str], max_length: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Lay out strings as a matrix of code points
+
+    Strings longer than max_length are left out of the matrix (their row is
+    all padding) so that one oversized value cannot blow up the matrix for
+    every row; their true length is still returned, so length checks fail them.
+
+    Args:
+        values: The strings
+        max_length: Length of the longest string that can be valid
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: An (n, width) uint32 matrix, zero padded,
+        with width at most max_length, and the length of each string
+    """
+    lengths = _lengths(values)
+    column = np.asarray(
+        [value if length <= max_length else "" for value, length in zip(values, lengths)], dtype=np.str_
+    )
+    if column.ndim != 1:
+        column = column.reshape(-1)
+    width = max(column.dtype.itemsize // 4, 1)
+    matrix = np.ascontiguousarray(column, dtype=f"<U{width}").view(np.uint32).reshape(len(column), width)
+    return matrix, lengths
+
+
+def _is_digit(matrix: np.ndarray) -> np.ndarray:
+    return (matrix >= _ZERO) & (matrix <= _NINE)
+
+
+def _is_alnum(matrix: np.ndarray) -> np.ndarray:
+    return (
+        _is_digit(matrix)
+        | ((matrix >= _UPPER_A) & (matrix <= _UPPER_Z))
+        | ((matrix >= _LOWER_A) & (matrix <= _LOWER_Z))
+    )
+
+
+def _validate_protocol_codes(protocol: str, matrix: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+    """Apply one protocol's approval code rules to rows of a code point matrix"""
+    handler = get_protocol_handler(protocol)
+    length = handler.approval_length
+    valid = lengths == length
+    if matrix.shape[1] < length:
+        return np.zeros(len(lengths), dtype=bool)
+    characters = matrix[:, :length]
+
+    if not handler.is_onledger:
+        # Offline approval: "OF" followed by digits
+        return (
+            valid
+            & (characters[:, 0] == ord("O"))
+            & (characters[:, 1] == ord("F"))
+            & _is_digit(characters[:, 2:]).all(axis=1)
+        )
+    if protocol.startswith("POS Terminal -101"):
+        return valid & _is_digit(characters).all(axis=1)
+    if protocol.startswith("POS Terminal -201"):
+        return valid & _is_alnum(characters).all(axis=1)
+    return valid
+
+
+def validate_approval_codes(codes: Sequence[str],
+                            protocols: Union[str, Sequence[str]]) -> np.ndarray:
+    """
+    Validate a column of approval codes
+
+    Applies the same length and format rules as
+    ProtocolHandler.validate_approval_code to every code at once, without
+    logging each failure. Formats are checked on ASCII characters.
+
+    Args:
+        codes: The approval codes
+        protocols: One protocol for all codes, or a column with the protocol of each code
+
+    Returns:
+        np.ndarray: Boolean mask, True where the code is valid
+
+    Raises:
+        ValueError: If a protocol is unknown or the columns differ in length
+    """
+    matrix, lengths = _code_points(codes, APPROVAL_CODE_MAX_LENGTH)
+    if isinstance(protocols, str):
+        return _validate_protocol_codes(protocols, matrix, lengths)
+
+    if len(protocols) != len(lengths):
+        raise ValueError("codes and protocols must have the same length")
+    # Protocol names are long strings; number them once instead of comparing them per group
+    numbering: Dict[str, int] = {}
+    protocol_ids = np.fromiter(
+        (numbering.setdefault(protocol, len(numbering)) for protocol in protocols),
+        dtype=np.int64, count=len(lengths)
+    )
+    valid = np.zeros(len(lengths), dtype=bool)
+    for protocol, protocol_id in numbering.items():
+        rows = protocol_ids == protocol_id
+        valid[rows] = _validate_protocol_codes(protocol, matrix[rows], lengths[rows])
+    return valid
+
+
+def luhn_valid(numbers: Sequence[str], max_length: int = PAN_MAX_LENGTH) -> np.ndarray:
+    """
+    Check the Luhn (mod 10) check digit of a column of digit strings
+
+    Args:
+        numbers: The numbers, e.g. card numbers
+        max_length: Longest number checked; longer strings are reported invalid
+
+    Returns:
+        np.ndarray: Boolean mask, True where the string is all digits and its
+        check digit is correct
+    """
+    matrix, lengths = _code_points(numbers, max_length)
+    columns = np.arange(matrix.shape[1], dtype=np.intp)
+    present = columns < lengths[:, None]
+    # Digit values as uint8; anything that is not a digit (including padding) ends up above 9
+    digits = (np.minimum(matrix, 255).astype(np.uint8) - np.uint8(_ZERO))
+    is_digit = digits <= 9
+    all_digits = (is_digit | ~present).all(axis=1) & (lengths > 0) & (lengths <= max_length)
+
+    digits[~is_digit] = 0
+    # Every second digit counting from the check digit (rightmost) is doubled
+    doubled = ((lengths[:, None] - columns) & 1) == 0
+    digits = np.where(doubled, _LUHN_DOUBLED[digits], digits)
+    return all_digits & (digits.sum(axis=1, dtype=np.intp) % 10 == 0)
+
+
+def validate_card_numbers(numbers: Sequence[str]) -> np.ndarray:
+    """
+    Validate a column of card numbers (length, digits and Luhn check digit)
+
+    Args:
+        numbers: The card numbers
+
+    Returns:
+        np.ndarray: Boolean mask, True where the card number is valid
+    """
+    lengths = _lengths(numbers)
+    return (lengths >= PAN_MIN_LENGTH) & (lengths <= PAN_MAX_LENGTH) & luhn_valid(numbers)
+
+
+def validate_batch(approval_codes: Optional[Sequence[str]] = None,
+                   protocols: Union[str, Sequence[str], None] = None,
+                   card_numbers: Optional[Sequence[str]] = None) -> Dict[str, Any]:
+    """
+    Validate columns of approval codes and card numbers
+
+    Args:
+        approval_codes: Approval codes to validate against protocols
+        protocols: One protocol or a protocol per approval code
+        card_numbers: Card numbers to validate
+
+    Returns:
+        Dict[str, Any]: A mask and an invalid count per supplied column
+    """
+    result: Dict[str, Any] = {}
+    if approval_codes is not None:
+        if protocols is None:
+            raise ValueError("protocols are required to validate approval codes")
+        mask = validate_approval_codes(approval_codes, protocols) if len(approval_codes) else np.zeros(0, bool)
+        result["approval_codes"] = mask
+        result["invalid_approval_codes"] = int(len(mask) - np.count_nonzero(mask))
+    if card_numbers is not None:
+        mask = validate_card_numbers(card_numbers) if len(card_numbers) else np.zeros(0, bool)
+        result["card_numbers"] = mask
+        result["invalid_card_numbers"] = int(len(mask) - np.count_nonzero(mask))
+    return result
@@ -2,38 +2,98 @@
 Black Rock Payment Terminal - Protocol Handlers
 """
 
+import re
 import logging
 import datetime
 import random
 import string
+from types import MappingProxyType
 from typing import Dict, Any, Optional, List, Tuple
 from enum import Enum
 
 from ..config import settings
 from ..core.transaction import Transaction, TransactionStatus, TransactionType
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
+def _protocol_fields(protocol_name: str, config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Derive the protocol-specific fields sent with every transaction of a protocol
+
+    Args:
+        protocol_name: The protocol name; its family (101.x or 201.x) and suffix set the format and flags
+        config: The protocol's settings.PROTOCOLS entry
+
+    Returns:
+        Dict[str, Any]: The fields
+    """
+    fields: Dict[str, Any] = {
+        "approval_code_format": "alphanumeric" if protocol_name.startswith("POS Terminal -201") else "numeric",
+        "approval_length": config["approval_length"],
+        "requires_online": config["is_onledger"],
+    }
+    if "(Pre-authorization)" in protocol_name:
+        fields["is_preauth"] = True
+    if "(PIN-LESS transaction)" in protocol_name:
+        fields["is_pinless"] = True
+    return fields
+
+
+# Protocol-specific fields sent with every transaction of the protocol
+PROTOCOL_FIELDS: Dict[str, Dict[str, Any]] = {
+    name: _protocol_fields(name, config) for name, config in settings.PROTOCOLS.items()
+}
+
+
 class ProtocolHandler:
-    """Base class for protocol handlers"""
+    """
+    Immutable handler for one protocol
+
+    Everything that depends only on the protocol (the extra transaction
+    fields, the approval code pattern and alphabet) is worked out once when
+    the handler is built, so preparing a transaction is a dict merge and
+    validating an approval code is one regex match. Handlers are shared;
+    get them from get_protocol_handler rather than constructing them.
+    """
+
+    __slots__ = ("protocol_name", "protocol_config", "approval_length", "is_onledger",
+                 "_fields", "_approval_pattern", "_approval_format", "_online_alphabet")
     
     def __init__(self, protocol_name: str):
         """Initialize the protocol handler"""
         if protocol_name not in settings.PROTOCOLS:
             raise ValueError(f"Invalid protocol: {protocol_name}")
         
-        self.protocol_name = protocol_name
-        self.protocol_config = settings.PROTOCOLS[protocol_name]
-        self.approval_length = self.protocol_config["approval_length"]
-        self.is_onledger = self.protocol_config["is_onledger"]
+        config = settings.PROTOCOLS[protocol_name]
+        length = config["approval_length"]
+        set_slot = object.__setattr__
+        set_slot(self, "protocol_name", protocol_name)
+        set_slot(self, "protocol_config", MappingProxyType(dict(config)))
+        set_slot(self, "approval_length", length)
+        set_slot(self, "is_onledger", config["is_onledger"])
+        set_slot(self, "_fields", dict(PROTOCOL_FIELDS.get(protocol_name, {})))
         
-        logger.info(f"Initialized protocol handler for {protocol_name}")
+        # Online codes of 101.x protocols are numeric, of 201.x alphanumeric;
+        # offline protocols only accept "OF" followed by digits
+        if not config["is_onledger"]:
+            pattern, approval_format = rf"OF\d{{{max(length - 2, 0)}}}", "'OF' followed by digits"
+        elif protocol_name.startswith("POS Terminal -101"):
+            pattern, approval_format = rf"\d{{{length}}}", "all digits"
+        elif protocol_name.startswith("POS Terminal -201"):
+            pattern, approval_format = rf"[^\W_]{{{length}}}", "alphanumeric"
+        else:
+            pattern, approval_format = rf".{{{length}}}", "any characters"
+        set_slot(self, "_approval_pattern", re.compile(pattern, re.ASCII))
+        set_slot(self, "_approval_format", approval_format)
+        set_slot(self, "_online_alphabet", (
+            string.ascii_uppercase + string.digits if protocol_name.startswith("POS Terminal -201") else string.digits
+        ))
+        
+        logger.debug("Initialized protocol handler for %s", protocol_name)
+    
+    def __setattr__(self, name: str, value: Any) -> None:
+        raise AttributeError(f"{type(self).__name__} is immutable")
     
     def validate_approval_code(self, approval_code: str) -> bool:
         """
@@ -45,36 +105,11 @@ class ProtocolHandler:
         Returns:
             bool: True if valid, False otherwise
         """
-        # Check length
-        if len(approval_code) != self.approval_length:
-            logger.warning(f"Invalid approval code length: expected {self.approval_length}, got {len(approval_code)}")
+        if self._approval_pattern.fullmatch(approval_code) is None:
+            logger.warning("Invalid approval code for %s: expected %s characters, %s",
+                           self.protocol_name, self.approval_length, self._approval_format)
             return False
-        
-        # For offline codes, they should start with "OF"
-        if approval_code.startswith("OF") and not self.is_onledger:
-            # Rest should be digits
-            if not approval_code[2:].isdigit():
-                logger.warning("Invalid offline approval code format: should be 'OF' followed by digits")
-                return False
-            return True
-        
-        # For online codes, they should be all digits or alphanumeric depending on protocol
-        if self.is_onledger:
-            if self.protocol_name.startswith("POS Terminal -101"):
-                # 101.x protocols use numeric approval codes
-                if not approval_code.isdigit():
-                    logger.warning("Invalid online approval code format for 101.x protocol: should be all digits")
-                    return False
-            elif self.protocol_name.startswith("POS Terminal -201"):
-                # 201.x protocols use alphanumeric approval codes
-                if not all(c.isalnum() for c in approval_code):
-                    logger.warning("Invalid online approval code format for 201.x protocol: should be alphanumeric")
-                    return False
-            
-            return True
-        
-        logger.warning("Invalid approval code format")
-        return False
+        return True
     
     def generate_approval_code(self, is_offline: bool = False) -> str:
         """
@@ -91,16 +126,8 @@ class ProtocolHandler:
             digits = ''.join(random.choices(string.digits, k=self.approval_length - 2))
             return f"OF{digits}"
         
-        # Generate online approval code
-        if self.protocol_name.startswith("POS Terminal -101"):
-            # 101.x protocols use numeric approval codes
-            return ''.join(random.choices(string.digits, k=self.approval_length))
-        elif self.protocol_name.startswith("POS Terminal -201"):
-            # 201.x protocols use alphanumeric approval codes
-            return ''.join(random.choices(string.ascii_uppercase + string.digits, k=self.approval_length))
-        
-        # Default to numeric
-        return ''.join(random.choices(string.digits, k=self.approval_length))
+        # 101.x protocols (and the default) use numeric codes, 201.x alphanumeric ones
+        return ''.join(random.choices(self._online_alphabet, k=self.approval_length))
     
     def prepare_transaction_data(self, transaction: Transaction) -> Dict[str, Any]:
         """
@@ -112,7 +139,6 @@ class ProtocolHandler:
         Returns:
             Dict[str, Any]: The prepared transaction data
         """
-        # Base transaction data
         data = {
             "protocol": self.protocol_name,
             "mti": transaction.mti,
@@ -125,50 +151,7 @@ class ProtocolHandler:
             "trace_number": transaction.trace_number,
             "batch_number": transaction.batch_number
         }
-        
-        # Add protocol-specific fields
-        if self.protocol_name == "POS Terminal -101.1 (4-digit approval)":
-            data["approval_code_format"] = "numeric"
-            data["approval_length"] = 4
-            data["requires_online"] = True
-            
-        elif self.protocol_name == "POS Terminal -101.4 (6-digit approval)":
-            data["approval_code_format"] = "numeric"
-            data["approval_length"] = 6
-            data["requires_online"] = True
-            
-        elif self.protocol_name == "POS Terminal -101.6 (Pre-authorization)":
-            data["approval_code_format"] = "numeric"
-            data["approval_length"] = 6
-            data["requires_online"] = True
-            data["is_preauth"] = True
-            
-        elif self.protocol_name == "POS Terminal -101.7 (4-digit approval)":
-            data["approval_code_format"] = "numeric"
-            data["approval_length"] = 4
-            data["requires_online"] = True
-            
-        elif self.protocol_name == "POS Terminal -101.8 (PIN-LESS transaction)":
-            data["approval_code_format"] = "numeric"
-            data["approval_length"] = 4
-            data["requires_online"] = False
-            data["is_pinless"] = True
-            
-        elif self.protocol_name == "POS Terminal -201.1 (6-digit approval)":
-            data["approval_code_format"] = "alphanumeric"
-            data["approval_length"] = 6
-            data["requires_online"] = True
-            
-        elif self.protocol_name == "POS Terminal -201.3 (6-digit approval)":
-            data["approval_code_format"] = "alphanumeric"
-            data["approval_length"] = 6
-            data["requires_online"] = False
-            
-        elif self.protocol_name == "POS Terminal -201.5 (6-digit approval)":
-            data["approval_code_format"] = "alphanumeric"
-            data["approval_length"] = 6
-            data["requires_online"] = False
-        
+        data.update(self._fields)
         return data
     
     def parse_response(self, response_data: Dict[str, Any], transaction: Transaction) -> None:
@@ -231,12 +214,27 @@ class ProtocolFactory:
         Returns:
             ProtocolHandler: The protocol handler
         """
-        if protocol_name not in settings.PROTOCOLS:
-            raise ValueError(f"Invalid protocol: {protocol_name}")
+        return get_protocol_handler(protocol_name)
+
+
+# One handler per configured protocol, built at import
+_HANDLERS: Dict[str, ProtocolHandler] = {name: ProtocolHandler(name) for name in settings.PROTOCOLS}
+
+
+def get_protocol_handler(protocol_name: str) -> ProtocolHandler:
+    """
+    Get the shared handler of a protocol
+    
+    Args:
+        protocol_name: The name of the protocol
         
-        # For now, we use the base ProtocolHandler for all protocols
-        # In a real implementation, we might have specialized handlers for each protocol
-        return ProtocolHandler(protocol_name)
+    Returns:
+        ProtocolHandler: The protocol handler
+    """
+    handler = _HANDLERS.get(protocol_name)
+    if handler is None:
+        raise ValueError(f"Invalid protocol: {protocol_name}")
+    return handler
 
 
 class MTIHandler:
@@ -286,6 +284,7 @@ class MTIHandler:
             "0200": "0210",  # Financial Transaction Request -> Financial Transaction Response
             "0220": "0230",  # Financial Transaction Advice -> Financial Transaction Advice Response
             "0500": "0510",  # Reversal Request -> Reversal Response
+            "0520": "0530",  # Reconciliation Advice -> Reconciliation Advice Response
         }
         
         if request_mti in mti_map:
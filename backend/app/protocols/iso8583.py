@@ -0,0 +1,469 @@
+"""
+Black Rock Payment Terminal - ISO 8583 Codec
+"""
+
+import logging
+import datetime
+import threading
+from typing import Dict, Any, Optional, List, Tuple, Union
+
+from ..config import settings
+from ..core.transaction import Transaction, TransactionStatus, TransactionType, PaymentMethod
+from .handler import MTIHandler
+
+logger = logging.getLogger(__name__)
+
+FieldValue = Union[str, bytes]
+
+# Largest message a host link exchanges; encode() reuses a buffer of this size per thread
+MAX_MESSAGE_SIZE = 4096
+
+# Fixed widths of fields 41 (card acceptor terminal ID) and 42 (card acceptor ID code)
+TERMINAL_ID_LENGTH = 8
+MERCHANT_ID_LENGTH = 15
+
+
+class FieldSpec:
+    """
+    Wire format of one data element
+
+    kind is "n" (digits, left padded with zeros), "an"/"ans" (text, right
+    padded with spaces; ans is UTF-8) or "b" (raw bytes). prefix is 0 for
+    fixed length fields, 2 for LLVAR and 3 for LLLVAR, with the length of
+    the value in bytes as ASCII digits. The space padding of fixed length
+    text fields is removed again on decode. Fixed length fields with pad off
+    take values of exactly their length only and are decoded as sent.
+    """
+
+    __slots__ = ("number", "name", "kind", "length", "prefix", "pad")
+
+    def __init__(self, number: int, name: str, kind: str, length: int, prefix: int = 0, pad: bool = True):
+        if kind not in ("n", "an", "ans", "b"):
+            raise ValueError(f"Unknown field kind: {kind}")
+        if prefix not in (0, 2, 3) or (prefix and length >= 10 ** prefix):
+            raise ValueError(f"Field {number}: length {length} does not fit a {prefix}-digit prefix")
+        self.number = number
+        self.name = name
+        self.kind = kind
+        self.length = length
+        self.prefix = prefix
+        self.pad = pad
+
+    def to_bytes(self, value: FieldValue) -> bytes:
+        """Convert a value to its wire bytes, without the length prefix"""
+        if self.kind == "b":
+            data = bytes(value)
+        elif self.kind == "ans":
+            data = value.encode("utf-8")
+        else:
+            data = value.encode("ascii")
+            if self.kind == "n" and not data.isdigit():
+                raise ValueError(f"Field {self.number} ({self.name}) must be numeric: {value!r}")
+
+        if self.prefix:
+            if len(data) > self.length:
+                raise ValueError(f"Field {self.number} ({self.name}) exceeds {self.length} bytes")
+            return data
+        if len(data) > self.length or (not self.pad and len(data) != self.length):
+            raise ValueError(f"Field {self.number} ({self.name}) must be {self.length} bytes")
+        if self.kind == "n":
+            return data.rjust(self.length, b"0")
+        if self.kind == "b":
+            return data.ljust(self.length, b"\x00")
+        return data.ljust(self.length, b" ")
+
+    def from_bytes(self, data: memoryview) -> FieldValue:
+        """Convert wire bytes back to a value"""
+        if self.kind == "b":
+            return bytes(data)
+        text = str(data, "utf-8" if self.kind == "ans" else "ascii")
+        if self.kind != "n" and not self.prefix and self.pad:
+            return text.rstrip(" ")
+        return text
+
+
+class MessageSpec:
+    """
+    Field layout of the messages of one protocol
+
+    A message is the 4-digit MTI, a binary primary bitmap (plus a secondary
+    bitmap when any field above 64 is present) and the present fields in
+    ascending order. Encoding writes into a caller supplied buffer through a
+    memoryview, so a message is assembled without intermediate copies.
+    """
+
+    def __init__(self, fields: Dict[int, FieldSpec]):
+        for number in fields:
+            if not 2 <= number <= 128:
+                raise ValueError(f"Field number out of range: {number}")
+        self.fields = dict(sorted(fields.items()))
+        # (number, spec, bit in the 128-bit bitmap) in wire order
+        self._layout = [(number, spec, 1 << (128 - number)) for number, spec in self.fields.items()]
+        self._defined = sum(bit for _, _, bit in self._layout)
+
+    def encode_into(self, buffer: Union[bytearray, memoryview], mti: str,
+                    values: Dict[int, FieldValue], offset: int = 0) -> int:
+        """
+        Encode a message into a preallocated buffer
+
+        Args:
+            buffer: Writable buffer
+            mti: The message type indicator
+            values: Field values by field number
+            offset: Position in the buffer to start at
+
+        Returns:
+            int: Number of bytes written
+
+        Raises:
+            ValueError: If the MTI or a value is invalid, or the buffer is too small
+        """
+        if not MTIHandler.validate_mti(mti):
+            raise ValueError(f"Invalid MTI: {mti}")
+        view = memoryview(buffer)
+        secondary = any(number > 64 for number in values)
+        bitmap_size = 16 if secondary else 8
+        position = offset + 4 + bitmap_size
+        if position > len(view):
+            raise ValueError("Message exceeds buffer")
+
+        bitmap = (1 << 127) if secondary else 0
+        written = 0
+        for number, spec, bit in self._layout:
+            value = values.get(number)
+            if value is None:
+                continue
+            data = spec.to_bytes(value)
+            end = position + spec.prefix + len(data)
+            if end > len(view):
+                raise ValueError("Message exceeds buffer")
+            if spec.prefix:
+                view[position:position + spec.prefix] = b"%0*d" % (spec.prefix, len(data))
+                position += spec.prefix
+            view[position:end] = data
+            position = end
+            bitmap |= bit
+            written += 1
+        if written != sum(1 for value in values.values() if value is not None):
+            undefined = sorted(number for number in values if number not in self.fields)
+            raise ValueError(f"Fields {undefined} are not defined for this message")
+
+        view[offset:offset + 4] = mti.encode("ascii")
+        bitmap_bytes = bitmap.to_bytes(16, "big")
+        view[offset + 4:offset + 4 + bitmap_size] = bitmap_bytes[:bitmap_size]
+        return position - offset
+
+    def encode(self, mti: str, values: Dict[int, FieldValue]) -> bytes:
+        """Encode a message using this thread's reusable buffer"""
+        buffer = _thread_buffer()
+        size = self.encode_into(buffer, mti, values)
+        return bytes(buffer[:size])
+
+    def decode(self, data: Union[bytes, bytearray, memoryview]) -> Tuple[str, Dict[int, FieldValue]]:
+        """
+        Decode a message
+
+        Args:
+            data: The encoded message
+
+        Returns:
+            Tuple[str, Dict[int, FieldValue]]: The MTI and field values by field number
+
+        Raises:
+            ValueError: If the message is truncated or has undefined fields
+        """
+        view = memoryview(data)
+        if len(view) < 12:
+            raise ValueError("Message too short")
+        mti = str(view[:4], "ascii")
+        bitmap = int.from_bytes(view[4:12], "big")
+        position = 12
+        if bitmap >> 63:
+            if len(view) < 20:
+                raise ValueError("Message too short")
+            bitmap = (bitmap << 64) | int.from_bytes(view[12:20], "big")
+            position = 20
+        else:
+            bitmap <<= 64
+        undefined = bitmap & ~self._defined & ~(1 << 127)
+        if undefined:
+            raise ValueError(f"Field {128 - undefined.bit_length() + 1} is not defined for this message")
+
+        values: Dict[int, FieldValue] = {}
+        for number, spec, bit in self._layout:
+            if not bitmap & bit:
+                continue
+            if spec.prefix:
+                length_digits = view[position:position + spec.prefix]
+                if len(length_digits) < spec.prefix:
+                    raise ValueError(f"Message truncated in field {number}")
+                length = int(length_digits)
+                position += spec.prefix
+            else:
+                length = spec.length
+            end = position + length
+            if end > len(view):
+                raise ValueError(f"Message truncated in field {number}")
+            values[number] = spec.from_bytes(view[position:end])
+            position = end
+        return mti, values
+
+
+_buffers = threading.local()
+
+
+def _thread_buffer() -> bytearray:
+    """Get this thread's reusable encoding buffer"""
+    buffer = getattr(_buffers, "buffer", None)
+    if buffer is None:
+        buffer = _buffers.buffer = bytearray(MAX_MESSAGE_SIZE)
+    return buffer
+
+
+# Data elements of every protocol: the standard ones in their ISO 8583:1987
+# formats, terminal data that has no standard element in the private ones
+BASE_FIELDS: Dict[int, FieldSpec] = {spec.number: spec for spec in (
+    FieldSpec(3, "processing_code", "n", 6),
+    FieldSpec(4, "amount", "n", 12),
+    FieldSpec(7, "transmission_date_time", "n", 10),
+    FieldSpec(11, "trace_number", "n", 6),
+    FieldSpec(12, "local_time", "n", 6),
+    FieldSpec(13, "local_date", "n", 4),
+    FieldSpec(22, "pos_entry_mode", "n", 3),
+    # Field 38 (approval code) is sized per protocol by build_message_spec
+    FieldSpec(39, "response_code", "an", 2),
+    FieldSpec(41, "terminal_id", "ans", TERMINAL_ID_LENGTH),
+    FieldSpec(42, "merchant_id", "ans", MERCHANT_ID_LENGTH),
+    FieldSpec(44, "response_message", "ans", 25, prefix=2),
+    # Private: additional data, here the transaction ID
+    FieldSpec(48, "transaction_id", "ans", 999, prefix=3),
+    FieldSpec(49, "currency_code", "n", 3),
+    FieldSpec(60, "batch_number", "n", 6, prefix=3),
+    FieldSpec(61, "terminal_flags", "n", 6, prefix=3),
+    # Private: YYYYMMDDhhmmssffffff, so the timestamp round-trips exactly
+    FieldSpec(62, "local_timestamp", "n", 20, prefix=3),
+    # Private: terminal response codes that are not 2-character ISO codes
+    FieldSpec(63, "terminal_response_code", "ans", 16, prefix=3),
+    FieldSpec(90, "original_data_elements", "n", 42),
+)}
+
+
+def build_message_spec(protocol_name: str) -> MessageSpec:
+    """
+    Build the message layout of a protocol from settings.PROTOCOLS
+
+    BASE_FIELDS plus field 38 (approval code), fixed at the protocol's
+    approval_length; codes of any other length are refused rather than padded.
+
+    Args:
+        protocol_name: The protocol name
+
+    Returns:
+        MessageSpec: The layout
+    """
+    config = settings.PROTOCOLS.get(protocol_name)
+    if config is None:
+        raise ValueError(f"Invalid protocol: {protocol_name}")
+    fields = dict(BASE_FIELDS)
+    fields[38] = FieldSpec(38, "approval_code", "an", config["approval_length"], pad=False)
+    return MessageSpec(fields)
+
+
+_SPECS: Dict[str, MessageSpec] = {name: build_message_spec(name) for name in settings.PROTOCOLS}
+
+
+def get_message_spec(protocol_name: str) -> MessageSpec:
+    """Get the message layout of a protocol"""
+    spec = _SPECS.get(protocol_name)
+    if spec is None:
+        raise ValueError(f"Invalid protocol: {protocol_name}")
+    return spec
+
+
+# Field 3 processing codes (transaction type, from and to account)
+PROCESSING_CODES = {
+    TransactionType.SALE: "000000",
+    TransactionType.REFUND: "200000",
+    TransactionType.VOID: "020000",
+    TransactionType.PRE_AUTH: "000000",
+    TransactionType.PRE_AUTH_COMPLETION: "000000",
+    TransactionType.BALANCE_INQUIRY: "310000",
+}
+
+# Field 22 POS entry modes (PAN entry mode, PIN entry capability)
+POS_ENTRY_MODES = {
+    PaymentMethod.CARD_SWIPE: "901",
+    PaymentMethod.CARD_DIP: "051",
+    PaymentMethod.CARD_NFC: "071",
+    PaymentMethod.MANUAL_ENTRY: "011",
+}
+_PAYMENT_METHODS = {code: method for method, code in POS_ENTRY_MODES.items()}
+
+# Field 61 (private) digit codes; append only, the digits are on the wire
+_TYPE_CODES: List[TransactionType] = [
+    TransactionType.SALE, TransactionType.REFUND, TransactionType.VOID, TransactionType.PRE_AUTH,
+    TransactionType.PRE_AUTH_COMPLETION, TransactionType.BALANCE_INQUIRY,
+]
+_STATUS_CODES: List[TransactionStatus] = [
+    TransactionStatus.INITIALIZED, TransactionStatus.PROCESSING, TransactionStatus.APPROVED,
+    TransactionStatus.DECLINED, TransactionStatus.ERROR, TransactionStatus.TIMEOUT,
+    TransactionStatus.CANCELLED, TransactionStatus.OFFLINE_APPROVED, TransactionStatus.PENDING,
+]
+
+_CURRENCY_BY_NUMBER = {config["numeric_code"]: code for code, config in settings.SUPPORTED_CURRENCIES.items()}
+
+
+def validate_card_acceptor_ids(terminal_id: str, merchant_id: str) -> None:
+    """
+    Check that a terminal's IDs fit the fixed width fields 41 and 42
+
+    Raises:
+        ValueError: If the terminal ID exceeds 8 or the merchant ID 15 characters
+    """
+    if len(terminal_id.encode("utf-8")) > TERMINAL_ID_LENGTH:
+        raise ValueError(f"Terminal ID {terminal_id!r} exceeds {TERMINAL_ID_LENGTH} characters (ISO 8583 field 41)")
+    if len(merchant_id.encode("utf-8")) > MERCHANT_ID_LENGTH:
+        raise ValueError(f"Merchant ID {merchant_id!r} exceeds {MERCHANT_ID_LENGTH} characters (ISO 8583 field 42)")
+
+
+def transmission_date_time(timestamp: datetime.datetime) -> str:
+    """Format a local timestamp as field 7 (MMDDhhmmss, UTC)"""
+    utc = timestamp.astimezone(datetime.timezone.utc)
+    return f"{utc.month:02d}{utc.day:02d}{utc.hour:02d}{utc.minute:02d}{utc.second:02d}"
+
+
+def original_data_elements(transaction: Transaction) -> str:
+    """
+    Build field 90 of a reversal, which identifies the message it reverses
+
+    Args:
+        transaction: The original transaction, as it was sent
+
+    Returns:
+        str: Original MTI, STAN (field 11) and transmission date and time
+        (field 7), followed by zero acquiring and forwarding institution IDs
+    """
+    mti = transaction.mti or MTIHandler.get_mti_for_transaction_type(transaction.transaction_type)
+    return f"{mti}{transaction.trace_number or '':0>6}{transmission_date_time(transaction.timestamp)}{'0' * 22}"
+
+
+def transaction_to_fields(transaction: Transaction) -> Tuple[str, Dict[int, FieldValue]]:
+    """
+    Map a transaction onto ISO 8583 fields
+
+    Args:
+        transaction: The transaction
+
+    Returns:
+        Tuple[str, Dict[int, FieldValue]]: The MTI (derived from the transaction
+        type if none is set) and the field values
+    """
+    currency = settings.SUPPORTED_CURRENCIES[transaction.currency]
+    mti = transaction.mti or MTIHandler.get_mti_for_transaction_type(transaction.transaction_type)
+    timestamp = transaction.timestamp
+    values: Dict[int, FieldValue] = {
+        3: PROCESSING_CODES[transaction.transaction_type],
+        4: str(int(round(transaction.amount * 10 ** currency["decimal_places"]))),
+        7: transmission_date_time(timestamp),
+        12: f"{timestamp.hour:02d}{timestamp.minute:02d}{timestamp.second:02d}",
+        13: f"{timestamp.month:02d}{timestamp.day:02d}",
+        22: POS_ENTRY_MODES[transaction.payment_method],
+        41: transaction.terminal_id,
+        42: transaction.merchant_id,
+        48: transaction.transaction_id,
+        49: currency["numeric_code"],
+        # type, status (2 digits), online flag, whether the MTI was set, reserved
+        61: (f"{_TYPE_CODES.index(transaction.transaction_type)}"
+             f"{_STATUS_CODES.index(transaction.status):02d}"
+             f"{int(bool(transaction.is_online))}{int(transaction.mti is not None)}0"),
+        62: (f"{timestamp.year:04d}{timestamp.month:02d}{timestamp.day:02d}{timestamp.hour:02d}"
+             f"{timestamp.minute:02d}{timestamp.second:02d}{timestamp.microsecond:06d}"),
+    }
+    if transaction.trace_number is not None:
+        values[11] = transaction.trace_number
+    if transaction.approval_code is not None:
+        values[38] = transaction.approval_code
+    if transaction.response_code is not None:
+        if len(transaction.response_code) == 2:
+            values[39] = transaction.response_code
+        else:
+            values[63] = transaction.response_code
+    if transaction.response_message is not None:
+        values[44] = transaction.response_message.encode("utf-8")[:25].decode("utf-8", "ignore")
+    if transaction.batch_number is not None:
+        values[60] = str(transaction.batch_number)
+    return mti, values
+
+
+def fields_to_transaction(protocol_name: str, mti: str, values: Dict[int, FieldValue]) -> Transaction:
+    """
+    Rebuild a transaction from ISO 8583 fields
+
+    Without the private timestamp (field 62) the time comes from fields 12
+    and 13 in the current year. Response messages are cut to field 44's 25 bytes.
+
+    Args:
+        protocol_name: The protocol of the host link the message came from
+        mti: The message MTI
+        values: The field values
+
+    Returns:
+        Transaction: The transaction (built with from_dict, so not re-validated)
+    """
+    currency = _CURRENCY_BY_NUMBER[values[49]]
+    flags = values[61]
+    timestamp = values.get(62) or f"{datetime.date.today().year:04d}{values[13]}{values[12]}000000"
+    decimal_places = settings.SUPPORTED_CURRENCIES[currency]["decimal_places"]
+    return Transaction.from_dict({
+        "transaction_id": values[48],
+        "timestamp": (f"{timestamp[0:4]}-{timestamp[4:6]}-{timestamp[6:8]}T{timestamp[8:10]}:"
+                      f"{timestamp[10:12]}:{timestamp[12:14]}.{timestamp[14:20]}"),
+        "amount": int(values[4]) / 10 ** decimal_places,
+        "currency": currency,
+        "transaction_type": _TYPE_CODES[int(flags[0])].value,
+        "payment_method": _PAYMENT_METHODS[values[22]].value,
+        "protocol": protocol_name,
+        "merchant_id": values[42],
+        "terminal_id": values[41],
+        "is_online": flags[3] == "1",
+        "status": _STATUS_CODES[int(flags[1:3])].value,
+        "approval_code": values.get(38),
+        "response_code": values.get(63, values.get(39)),
+        "response_message": values.get(44),
+        "mti": mti if flags[4] == "1" else None,
+        "trace_number": values.get(11),
+        "batch_number": int(values[60]) if 60 in values else None,
+    })
+
+
+def encode_transaction(transaction: Transaction, buffer: Optional[bytearray] = None) -> Union[bytes, int]:
+    """
+    Encode a transaction as an ISO 8583 message of its protocol
+
+    Args:
+        transaction: The transaction
+        buffer: Preallocated buffer to encode into; a new bytes object is returned when omitted
+
+    Returns:
+        Union[bytes, int]: The message, or the number of bytes written into buffer
+    """
+    spec = get_message_spec(transaction.protocol)
+    mti, values = transaction_to_fields(transaction)
+    if buffer is not None:
+        return spec.encode_into(buffer, mti, values)
+    return spec.encode(mti, values)
+
+
+def decode_transaction(protocol_name: str, data: Union[bytes, bytearray, memoryview]) -> Transaction:
+    """
+    Decode an ISO 8583 message into a transaction
+
+    Args:
+        protocol_name: The protocol of the host link
+        data: The encoded message
+
+    Returns:
+        Transaction: The decoded transaction
+    """
+    mti, values = get_message_spec(protocol_name).decode(data)
+    return fields_to_transaction(protocol_name, mti, values)
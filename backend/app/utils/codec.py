@@ -0,0 +1,191 @@
+"""
+Black Rock Payment Terminal - Payload Codecs
+"""
+
+import json
+import contextvars
+from typing import Dict, Any, Optional
+
+from starlette.responses import Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_CONTENT_TYPE = "application/json"
+MSGPACK_CONTENT_TYPE = "application/msgpack"
+
+
+class Codec:
+    """Encodes and decodes message payloads for one content type"""
+
+    content_type = ""
+
+    def encode(self, data: Any) -> bytes:
+        raise NotImplementedError
+
+    def decode(self, body: bytes) -> Any:
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    """Stdlib JSON, the fallback when orjson is not installed"""
+
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, data: Any) -> bytes:
+        return json.dumps(data, separators=(",", ":"), default=str).encode("utf-8")
+
+    def decode(self, body: bytes) -> Any:
+        return json.loads(body)
+
+
+class OrjsonCodec(Codec):
+    """JSON encoded and decoded by orjson; same wire format as JsonCodec"""
+
+    content_type = JSON_CONTENT_TYPE
+
+    def encode(self, data: Any) -> bytes:
+        return orjson.dumps(data, default=str, option=orjson.OPT_NON_STR_KEYS)
+
+    def decode(self, body: bytes) -> Any:
+        return orjson.loads(body)
+
+
+class MsgpackCodec(Codec):
+    """MessagePack, the compact binary encoding for constrained links"""
+
+    content_type = MSGPACK_CONTENT_TYPE
+
+    def encode(self, data: Any) -> bytes:
+        return msgpack.packb(data, default=str, use_bin_type=True)
+
+    def decode(self, body: bytes) -> Any:
+        return msgpack.unpackb(body, raw=False)
+
+
+JSON_CODEC: Codec = OrjsonCodec() if orjson is not None else JsonCodec()
+MSGPACK_CODEC: Optional[Codec] = MsgpackCodec() if msgpack is not None else None
+
+# Content type (without parameters) -> codec
+_CODECS: Dict[str, Codec] = {JSON_CONTENT_TYPE: JSON_CODEC}
+if MSGPACK_CODEC is not None:
+    _CODECS[MSGPACK_CONTENT_TYPE] = MSGPACK_CODEC
+    _CODECS["application/x-msgpack"] = MSGPACK_CODEC
+
+
+def _media_type(content_type: Optional[str]) -> str:
+    """Strip parameters and normalize a Content-Type or Accept item"""
+    return (content_type or "").split(";", 1)[0].strip().lower()
+
+
+def get_codec(content_type: Optional[str]) -> Codec:
+    """
+    Get the codec for a Content-Type header
+
+    Args:
+        content_type: The header value, e.g. "application/msgpack"
+
+    Returns:
+        Codec: The matching codec, or the JSON codec for unknown or missing types
+    """
+    return _CODECS.get(_media_type(content_type), JSON_CODEC)
+
+
+def negotiate(accept: Optional[str]) -> Codec:
+    """
+    Pick the response codec for an Accept header
+
+    Items are taken in order of their q value; items with q=0 are not
+    acceptable and are skipped. Wildcards and unsupported types fall back
+    to JSON.
+
+    Args:
+        accept: The Accept header value
+
+    Returns:
+        Codec: The preferred supported codec
+    """
+    if not accept:
+        return JSON_CODEC
+    best, best_q = JSON_CODEC, -1.0
+    for item in accept.split(","):
+        media_type, _, params = item.partition(";")
+        codec = _CODECS.get(_media_type(media_type))
+        if codec is None:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q <= 0.0:
+            continue
+        if q > best_q:
+            best, best_q = codec, q
+    return best
+
+
+def decode_response(response) -> Any:
+    """
+    Decode an httpx response body according to its Content-Type
+
+    Args:
+        response: The httpx.Response
+
+    Returns:
+        Any: The decoded payload
+    """
+    return get_codec(response.headers.get("content-type")).decode(response.content)
+
+
+# Codec negotiated for the request being served; set by CodecNegotiationMiddleware
+_response_codec: contextvars.ContextVar = contextvars.ContextVar("response_codec", default=None)
+
+
+class NegotiatedResponse(Response):
+    """
+    Response rendered with the codec negotiated for the current request
+
+    Used as the application's default response class, so every route that
+    returns plain data answers in msgpack or JSON according to the client's
+    Accept header.
+    """
+
+    media_type = JSON_CONTENT_TYPE
+
+    def render(self, content: Any) -> bytes:
+        codec = _response_codec.get() or JSON_CODEC
+        self.media_type = codec.content_type
+        return codec.encode(content)
+
+
+class CodecNegotiationMiddleware:
+    """ASGI middleware that negotiates the response codec from the Accept header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        accept = None
+        for name, value in scope["headers"]:
+            if name == b"accept":
+                accept = value.decode("latin-1")
+                break
+        token = _response_codec.set(negotiate(accept))
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _response_codec.reset(token)
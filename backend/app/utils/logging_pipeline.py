@@ -0,0 +1,195 @@
+"""
+Black Rock Payment Terminal - Logging Pipeline
+"""
+
+import json
+import time
+import queue
+import atexit
+import logging
+import datetime
+import threading
+import logging.handlers
+from typing import Dict, Any, Optional, List
+
+from ..config.settings import LOGGING_SETTINGS
+
+# Attributes every LogRecord has; anything else was passed via extra= and is emitted as a field
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": datetime.datetime.fromtimestamp(record.created, datetime.timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.msg if isinstance(record.msg, str) else str(record.msg),
+            "message": record.getMessage()
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps a fixed fraction of the records of selected events
+
+    Rates are keyed by the unformatted message (the event) or by logger
+    name; every 1/rate-th record of a sampled event is kept, so sampling is
+    deterministic and costs one counter increment.
+    """
+
+    def __init__(self, rates: Dict[str, float]):
+        super().__init__()
+        self.rates = rates
+        self._seen: Dict[str, int] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        key = record.msg if isinstance(record.msg, str) and record.msg in self.rates else record.name
+        rate = self.rates.get(key)
+        if rate is None or rate >= 1:
+            return True
+        if rate <= 0:
+            return False
+        seen = self._seen.get(key, 0)
+        self._seen[key] = seen + 1
+        return seen % max(int(round(1 / rate)), 1) == 0
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Token bucket per event (logger name and unformatted message)
+
+    Records beyond burst plus per_second refill are dropped; the next record
+    of the event that gets through carries the number dropped in between as
+    its "suppressed" field. Warnings and errors are never limited.
+    """
+
+    def __init__(self, per_second: float, burst: int):
+        super().__init__()
+        self.per_second = per_second
+        self.burst = burst
+        self._buckets: Dict[tuple, List[float]] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        key = (record.name, record.msg if isinstance(record.msg, str) else type(record.msg).__name__)
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            # [tokens, last refill, suppressed]
+            bucket = self._buckets[key] = [float(self.burst), now, 0]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.per_second)
+        bucket[1] = now
+        if bucket[0] < 1:
+            bucket[2] += 1
+            return False
+        bucket[0] -= 1
+        if bucket[2]:
+            record.suppressed = bucket[2]
+            bucket[2] = 0
+        return True
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that never blocks and never formats on the caller's thread
+
+    The stdlib QueueHandler formats the message before enqueueing; here the
+    record is enqueued as is and the listener thread does all formatting,
+    so a log call on the hot path costs the filters plus one put_nowait.
+    When the queue is full the record is dropped and counted.
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class _Listener(logging.handlers.QueueListener):
+    """QueueListener whose stop waits for room in a full queue instead of failing"""
+
+    def enqueue_sentinel(self) -> None:
+        self.queue.put(self._sentinel)
+
+
+_listener: Optional[_Listener] = None
+_queue_handler: Optional[NonBlockingQueueHandler] = None
+_lock = threading.Lock()
+
+
+def configure_logging(filename: Optional[str] = None, settings: Optional[Dict[str, Any]] = None) -> None:
+    """
+    Route all logging through a bounded queue to a background writer thread
+
+    Replaces the root logger's handlers; safe to call more than once.
+
+    Args:
+        filename: Log file path; logs go to stderr when omitted
+        settings: Overrides for LOGGING_SETTINGS
+    """
+    global _listener, _queue_handler
+    config = dict(LOGGING_SETTINGS)
+    if settings:
+        config.update(settings)
+
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+
+        output = logging.FileHandler(filename) if filename else logging.StreamHandler()
+        if config["json"]:
+            output.setFormatter(JsonFormatter())
+        else:
+            output.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+        _queue_handler = NonBlockingQueueHandler(queue.Queue(maxsize=config["queue_size"]))
+        if config["sample_rates"]:
+            _queue_handler.addFilter(SamplingFilter(config["sample_rates"]))
+        if config["rate_limit_per_second"]:
+            _queue_handler.addFilter(RateLimitFilter(config["rate_limit_per_second"], config["rate_limit_burst"]))
+
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        root.addHandler(_queue_handler)
+        root.setLevel(config["level"])
+
+        _listener = _Listener(_queue_handler.queue, output, respect_handler_level=True)
+        _listener.start()
+
+
+def shutdown_logging() -> None:
+    """Write out queued records and stop the writer thread"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def get_stats() -> Dict[str, Any]:
+    """Get the queue depth and the number of records dropped because the queue was full"""
+    if _queue_handler is None:
+        return {"queued": 0, "dropped": 0}
+    return {"queued": _queue_handler.queue.qsize(), "dropped": _queue_handler.dropped}
+
+
+atexit.register(shutdown_logging)
@@ -0,0 +1,317 @@
+"""
+Black Rock Payment Terminal - Metrics
+"""
+
+import time
+import bisect
+import inspect
+import functools
+import threading
+from typing import Dict, Any, Optional, List, Tuple, Callable, Sequence
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value: str) -> str:
+    """Escape a label value for the Prometheus text format"""
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    """Format a label set, e.g. {stage="validation",le="0.5"}"""
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    """Format a sample value"""
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    """Base class of labelled metrics; one child per label value combination"""
+
+    metric_type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: Optional["MetricsRegistry"] = None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: str):
+        """Get the child for a label value combination, creating it on first use"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> List[str]:
+        """Render the metric's samples in the Prometheus text format"""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        for values, child in list(self._children.items()):
+            lines.extend(child.samples(self.name, self.labelnames, values))
+        return lines
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def samples(self, name: str, labelnames, values) -> List[str]:
+        return [f"{name}_total{_format_labels(labelnames, values)} {_format_value(self.value)}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    metric_type = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+
+class _HistogramChild:
+    __slots__ = ("buckets", "counts", "sum", "count", "_lock")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> "Timer":
+        """Time a block and observe its duration"""
+        return Timer(self.observe)
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile as the upper bound of the bucket that holds it"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = q * self.count
+            seen = 0
+            for index, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank and count:
+                    return self.buckets[index] if index < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def samples(self, name: str, labelnames, values) -> List[str]:
+        with self._lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += bucket_count
+            le = f'le="{_format_value(bound)}"'
+            lines.append(f"{name}_bucket{_format_labels(labelnames, values, le)} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labelnames, values)} {_format_value(total)}")
+        lines.append(f"{name}_count{_format_labels(labelnames, values)} {count}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values (latencies in seconds)"""
+
+    metric_type = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Optional["MetricsRegistry"] = None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+
+class Gauge(_Metric):
+    """Current value read from a callback at scrape time"""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, function: Callable[[], float] = None,
+                 registry: Optional["MetricsRegistry"] = None):
+        super().__init__(name, documentation, (), registry)
+        self.function = function
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """Set the callback that provides the value"""
+        self.function = function
+
+    def collect(self) -> List[str]:
+        if self.function is None:
+            return []
+        try:
+            value = self.function()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge",
+                f"{self.name} {_format_value(float(value))}"]
+
+
+class Timer:
+    """Context manager that measures a block with perf_counter"""
+
+    __slots__ = ("_observe", "_started")
+
+    def __init__(self, observe: Callable[[float], None]):
+        self._observe = observe
+        self._started = 0.0
+
+    def __enter__(self) -> "Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self._observe(time.perf_counter() - self._started)
+
+
+class StageTimer:
+    """
+    Times one processing stage into STAGE_SECONDS
+
+    The outcome defaults to "ok", becomes "error" if the block raises and
+    may be set by the caller before the block ends.
+    """
+
+    __slots__ = ("stage", "protocol", "mti", "outcome", "_started")
+
+    def __init__(self, stage: str, protocol: str = "", mti: str = "", outcome: str = "ok"):
+        self.stage = stage
+        self.protocol = protocol
+        self.mti = mti
+        self.outcome = outcome
+        self._started = 0.0
+
+    def __enter__(self) -> "StageTimer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is not None:
+            self.outcome = "error"
+        STAGE_SECONDS.labels(self.stage, self.protocol, self.mti or "", self.outcome).observe(
+            time.perf_counter() - self._started
+        )
+
+
+def timed_stage(stage: str, transaction_arg: str = "transaction"):
+    """
+    Decorator that times a function as a processing stage
+
+    The protocol and MTI labels are read from the function's transaction
+    argument. Coroutine functions are timed until they complete.
+
+    Args:
+        stage: The stage label, e.g. "db_commit"
+        transaction_arg: Name of the parameter holding the Transaction
+    """
+    def decorator(function):
+        position = list(inspect.signature(function).parameters).index(transaction_arg)
+
+        if inspect.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                transaction = kwargs[transaction_arg] if transaction_arg in kwargs else args[position]
+                with StageTimer(stage, transaction.protocol, transaction.mti or ""):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            transaction = kwargs[transaction_arg] if transaction_arg in kwargs else args[position]
+            with StageTimer(stage, transaction.protocol, transaction.mti or ""):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._names = set()
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> None:
+        """Add a metric (names must be unique)"""
+        with self._lock:
+            if metric.name in self._names:
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._names.add(metric.name)
+            self._metrics.append(metric)
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for metric in list(self._metrics):
+            lines.extend(metric.collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+STAGE_SECONDS = Histogram(
+    "payment_stage_seconds",
+    "Time spent in each payment processing stage",
+    ["stage", "protocol", "mti", "outcome"]
+)
+TRANSACTIONS = Counter(
+    "payment_transactions",
+    "Processed transactions by final status",
+    ["protocol", "mti", "outcome"]
+)
+HOST_REQUEST_SECONDS = Histogram(
+    "payment_host_request_seconds",
+    "Round trip time of requests to a payment host",
+    ["host", "path", "outcome"]
+)
+HOST_RETRIES = Counter(
+    "payment_host_retries",
+    "Retried host requests",
+    ["protocol", "mti", "reason"]
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "payment_admission_queue_depth",
+    "Admitted payments waiting for a worker"
+)
+OFFLINE_QUEUE_DEPTH = Gauge(
+    "payment_offline_queue_depth",
+    "Offline transactions not yet synced, over all hosted terminals"
+)
+PERSISTENCE_BUFFER_DEPTH = Gauge(
+    "payment_persistence_buffer_depth",
+    "Transaction rows buffered or being committed by the write-behind writer"
+)
@@ -8,12 +8,8 @@ from typing import Dict, Any, Optional, List
 
 from ..core.transaction import Transaction, TransactionStatus, TransactionType
 from ..config.settings import PROTOCOLS, MTI_TYPES, SUPPORTED_CURRENCIES, TERMINAL_SETTINGS
+from .metrics import timed_stage
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
 logger = logging.getLogger(__name__)
 
 
@@ -33,6 +29,7 @@ class ReceiptGenerator:
         self.header = TERMINAL_SETTINGS["receipt_header"]
         self.footer = TERMINAL_SETTINGS["receipt_footer"]
     
+    @timed_stage("receipt_render")
     def generate_text_receipt(self, transaction: Transaction, 
                              merchant_copy: bool = False) -> str:
         """
@@ -142,6 +139,7 @@ class ReceiptGenerator:
         
         return "\\n".join(receipt_lines)
     
+    @timed_stage("receipt_render")
     def generate_html_receipt(self, transaction: Transaction,
                              merchant_copy: bool = False) -> str:
         """
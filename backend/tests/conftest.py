@@ -0,0 +1,47 @@
+"""
+Black Rock Payment Terminal - Test Configuration
+"""
+
+import os
+import tempfile
+
+# The process-wide stores open their files on first use; keep them out of the working tree
+_STATE_DIR = tempfile.mkdtemp(prefix="payment-terminal-tests-")
+for _variable, _file in (
+    ("DATABASE_URL", "payment_terminal.db"),
+    ("OFFLINE_QUEUE_PATH", "offline_queue.db"),
+    ("REVERSAL_QUEUE_PATH", "reversal_queue.db"),
+    ("STAN_STATE_PATH", "stan_state.db"),
+    ("SETTLEMENT_STATE_PATH", "settlement.db"),
+    ("SHARED_STATE_PATH", "shared_state.db"),
+):
+    os.environ[_variable] = (
+        f"sqlite:///{os.path.join(_STATE_DIR, _file)}" if _variable == "DATABASE_URL"
+        else os.path.join(_STATE_DIR, _file)
+    )
+os.environ["WORKER_LOCK_DIR"] = os.path.join(_STATE_DIR, "run")
+
+import pytest
+
+from app.core.transaction import Transaction, TransactionType, PaymentMethod
+
+PROTOCOL = "POS Terminal -101.1 (4-digit approval)"
+
+
+@pytest.fixture
+def make_transaction():
+    """Factory for transactions of a test terminal"""
+    def make(amount: float = 10.0, protocol: str = PROTOCOL, terminal_id: str = "TERM0001",
+             transaction_type: TransactionType = TransactionType.SALE, currency: str = "USD",
+             is_online: bool = True) -> Transaction:
+        return Transaction(
+            amount=amount,
+            currency=currency,
+            transaction_type=transaction_type,
+            payment_method=PaymentMethod.CARD_DIP,
+            protocol=protocol,
+            merchant_id="MERCHANT0000001",
+            terminal_id=terminal_id,
+            is_online=is_online
+        )
+    return make
@@ -0,0 +1,124 @@
+"""
+Black Rock Payment Terminal - Admission Control Tests
+"""
+
+import sys
+import time
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import app as app_package
+from app.api.routes import router
+from app.core.admission import AdmissionController, AdmissionRejected
+from app.core.idempotency import IdempotencyCache
+from app.core.runtime import ProcessorRuntime
+
+PROTOCOL = "POS Terminal -101.1 (4-digit approval)"
+
+
+class BlockingProcessor:
+    """Stand-in processor whose transactions finish when released"""
+
+    def __init__(self, terminal_id: str):
+        self.terminal_id = terminal_id
+        self.merchant_id = "MERCHANT0000001"
+        self.released = threading.Event()
+        self.processed = []
+
+    async def process_transaction_async(self, transaction):
+        while not self.released.is_set():
+            await asyncio.sleep(0.005)
+        self.processed.append(transaction)
+        return transaction
+
+
+def wait_until(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "condition not reached"
+        time.sleep(0.005)
+
+
+@pytest.fixture
+def runtime():
+    runtime = ProcessorRuntime()
+    yield runtime
+    runtime.shutdown()
+
+
+def test_terminal_over_its_cap_gets_429(runtime, make_transaction):
+    controller = AdmissionController(runtime, {"workers": 4, "max_queue_depth": 100, "per_terminal_max_inflight": 2})
+    busy, other = BlockingProcessor("T1"), BlockingProcessor("T2")
+
+    controller.submit(busy, make_transaction(terminal_id="T1"))
+    controller.submit(busy, make_transaction(terminal_id="T1"))
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.submit(busy, make_transaction(terminal_id="T1"))
+    # Other terminals are still admitted
+    controller.submit(other, make_transaction(terminal_id="T2"))
+
+    assert rejected.value.status_code == 429
+    assert rejected.value.retry_after >= controller.min_retry_after
+    assert controller.get_stats()["rejected_terminal_limit"] == 1
+
+    busy.released.set()
+    other.released.set()
+    wait_until(lambda: controller.get_stats()["completed"] == 3)
+    controller.submit(busy, make_transaction(terminal_id="T1"))
+    controller.shutdown()
+
+
+def test_full_queue_gets_503(runtime, make_transaction):
+    controller = AdmissionController(runtime, {"workers": 1, "max_queue_depth": 1, "per_terminal_max_inflight": 10})
+    processor = BlockingProcessor("T1")
+    completed = []
+
+    controller.submit(processor, make_transaction(terminal_id="T1"), on_complete=completed.append)
+    wait_until(lambda: controller.get_stats()["workers_busy"] == 1)
+    controller.submit(processor, make_transaction(terminal_id="T1"), on_complete=completed.append)
+    with pytest.raises(AdmissionRejected) as rejected:
+        controller.submit(processor, make_transaction(terminal_id="T1"))
+
+    assert rejected.value.status_code == 503
+    assert controller.get_stats()["rejected_saturated"] == 1
+
+    processor.released.set()
+    wait_until(lambda: len(completed) == 2)
+    assert processor.processed == completed
+    controller.shutdown()
+
+
+@pytest.mark.parametrize("status_code", [429, 503])
+def test_rejections_reach_the_client_with_retry_after(monkeypatch, status_code):
+    processor = BlockingProcessor("T1")
+
+    def reject(*args, **kwargs):
+        raise AdmissionRejected(status_code, "Rejected for test", 7)
+
+    idempotency = IdempotencyCache(ttl=60, max_entries=100)
+    main = SimpleNamespace(
+        registry=SimpleNamespace(get=lambda terminal_id: processor),
+        admission=SimpleNamespace(submit=reject),
+        idempotency=idempotency,
+        shared_state=None,
+    )
+    monkeypatch.setitem(sys.modules, "app.main", main)
+    monkeypatch.setattr(app_package, "main", main, raising=False)
+    api = FastAPI()
+    api.include_router(router, prefix="/api")
+    body = {
+        "amount": 10, "currency": "USD", "card_number": "4111111111111111",
+        "expiry_date": "12/30", "protocol": PROTOCOL, "transaction_type": "SALE",
+    }
+
+    response = TestClient(api).post("/api/payment", json=body, headers={"Idempotency-Key": "key-1"})
+
+    assert response.status_code == status_code
+    assert response.headers["Retry-After"] == "7"
+    # A rejected request never ran, so its key is free for the retry
+    assert asyncio.run(idempotency.reserve_async("T1", "key-1", "fingerprint"))[1]
@@ -0,0 +1,98 @@
+"""
+Black Rock Payment Terminal - Payload Codec Tests
+"""
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.utils.codec import (
+    JSON_CODEC, MSGPACK_CODEC, CodecNegotiationMiddleware, NegotiatedResponse, get_codec, negotiate
+)
+
+msgpack = pytest.importorskip("msgpack")
+
+PAYLOAD = {"transaction_id": "T1", "amount": 12.5, "approved": True, "codes": ["00", "51"]}
+
+
+@pytest.mark.parametrize("accept", [
+    None,
+    "",
+    "*/*",
+    "application/*",
+    "text/html",
+    "text/html, application/xml;q=0.9",
+])
+def test_wildcards_and_unknown_types_fall_back_to_json(accept):
+    assert negotiate(accept) is JSON_CODEC
+
+
+@pytest.mark.parametrize("accept, codec", [
+    ("application/msgpack", MSGPACK_CODEC),
+    ("application/x-msgpack", MSGPACK_CODEC),
+    ("Application/MsgPack; charset=binary", MSGPACK_CODEC),
+    ("application/json, application/msgpack", JSON_CODEC),
+    ("application/json;q=0.5, application/msgpack", MSGPACK_CODEC),
+    ("application/msgpack;q=0.4, application/json;q=0.8", JSON_CODEC),
+    ("application/json;q=0.9, application/msgpack;q=0.9", JSON_CODEC),
+    ("*/*, application/msgpack;q=0.1", MSGPACK_CODEC),
+])
+def test_highest_q_value_wins(accept, codec):
+    assert negotiate(accept) is codec
+
+
+@pytest.mark.parametrize("accept", [
+    "application/msgpack;q=0",
+    "application/msgpack;q=0.0, text/html",
+    "application/msgpack;q=bogus",
+])
+def test_unacceptable_types_are_skipped(accept):
+    assert negotiate(accept) is JSON_CODEC
+
+
+def test_get_codec_ignores_parameters_and_defaults_to_json():
+    assert get_codec("application/msgpack; charset=binary") is MSGPACK_CODEC
+    assert get_codec("application/json; charset=utf-8") is JSON_CODEC
+    assert get_codec("text/plain") is JSON_CODEC
+    assert get_codec(None) is JSON_CODEC
+
+
+@pytest.mark.parametrize("codec", [JSON_CODEC, MSGPACK_CODEC])
+def test_codecs_round_trip(codec):
+    assert codec.decode(codec.encode(PAYLOAD)) == PAYLOAD
+
+
+@pytest.fixture
+def client():
+    app = FastAPI(default_response_class=NegotiatedResponse)
+    app.add_middleware(CodecNegotiationMiddleware)
+
+    @app.get("/payload")
+    async def payload():
+        return PAYLOAD
+
+    with TestClient(app) as client:
+        yield client
+
+
+def test_response_is_msgpack_when_preferred(client):
+    response = client.get("/payload", headers={"Accept": "application/json;q=0.5, application/msgpack"})
+
+    assert response.headers["content-type"] == "application/msgpack"
+    assert msgpack.unpackb(response.content, raw=False) == PAYLOAD
+
+
+@pytest.mark.parametrize("accept", ["*/*", "application/msgpack;q=0", "text/html"])
+def test_response_falls_back_to_json(client, accept):
+    response = client.get("/payload", headers={"Accept": accept})
+
+    assert response.headers["content-type"].startswith("application/json")
+    assert response.json() == PAYLOAD
+
+
+def test_negotiation_does_not_leak_between_requests(client):
+    client.get("/payload", headers={"Accept": "application/msgpack"})
+
+    response = client.get("/payload", headers={"Accept": "application/json"})
+
+    assert response.json() == PAYLOAD
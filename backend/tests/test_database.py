@@ -0,0 +1,113 @@
+"""
+Black Rock Payment Terminal - Database Engine Tests
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine, inspect, text
+
+from app.config.settings import DATABASE_SETTINGS
+from app.database import models
+
+pytest.importorskip("aiosqlite")
+pytest.importorskip("greenlet")
+
+
+def test_async_url_uses_the_async_driver(monkeypatch):
+    monkeypatch.setitem(DATABASE_SETTINGS, "async_url", "")
+
+    assert models.get_async_database_url("sqlite:///./terminal.db") == "sqlite+aiosqlite:///./terminal.db"
+    assert models.get_async_database_url("postgresql://host/db") == "postgresql+asyncpg://host/db"
+    assert models.get_async_database_url("postgres://host/db") == "postgresql+asyncpg://host/db"
+
+    monkeypatch.setitem(DATABASE_SETTINGS, "async_url", "postgresql+asyncpg://other/db")
+    assert models.get_async_database_url("sqlite:///./terminal.db") == "postgresql+asyncpg://other/db"
+
+
+def test_in_memory_sqlite_is_not_pooled():
+    assert models._engine_options("sqlite://") == {}
+    assert models._engine_options("sqlite:///:memory:") == {}
+    assert models._engine_options("sqlite:///./terminal.db")["pool_size"] == DATABASE_SETTINGS["pool_size"]
+
+
+def test_sync_engine_applies_pragmas():
+    with models.engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA busy_timeout")).scalar() == 5000
+
+
+@pytest.fixture
+def async_engine():
+    """Run a coroutine against a fresh process-wide async engine, disposing it afterwards"""
+    def run(scenario):
+        async def main():
+            try:
+                return await scenario(models.get_async_engine())
+            finally:
+                await models.dispose_async_engine()
+
+        return asyncio.run(main())
+
+    return run
+
+
+def test_async_engine_is_shared_and_pooled(async_engine):
+    async def scenario(engine):
+        return engine, models.get_async_engine()
+
+    engine, again = async_engine(scenario)
+    pool = engine.sync_engine.pool
+
+    assert again is engine
+    assert engine.url.drivername == "sqlite+aiosqlite"
+    assert pool.size() == DATABASE_SETTINGS["pool_size"]
+    assert pool._max_overflow == DATABASE_SETTINGS["max_overflow"]
+    assert pool.timeout() == DATABASE_SETTINGS["pool_timeout"]
+    assert pool._recycle == DATABASE_SETTINGS["pool_recycle"]
+    assert pool._pre_ping is DATABASE_SETTINGS["pool_pre_ping"]
+
+
+def test_async_sessions_get_the_sqlite_pragmas(async_engine):
+    async def scenario(engine):
+        async with models.AsyncSessionLocal() as session:
+            return [
+                (await session.execute(text(f"PRAGMA {name}"))).scalar()
+                for name in ("journal_mode", "synchronous", "busy_timeout", "temp_store")
+            ]
+
+    # synchronous=NORMAL reads back as 1, temp_store=MEMORY as 2
+    assert async_engine(scenario) == ["wal", 1, 5000, 2]
+
+
+def test_async_engine_is_recreated_after_dispose(async_engine):
+    async def scenario(engine):
+        return engine
+
+    first = async_engine(scenario)
+    second = async_engine(scenario)
+
+    assert second is not first
+
+
+def test_missing_indexes_are_added_to_existing_tables(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as connection:
+        # The transactions table as created before its lookup indexes were declared
+        connection.execute(text(
+            "CREATE TABLE transactions (id INTEGER PRIMARY KEY, transaction_id VARCHAR, timestamp DATETIME, "
+            "amount FLOAT, currency VARCHAR, transaction_type VARCHAR, payment_method VARCHAR, protocol VARCHAR, "
+            "merchant_id VARCHAR, terminal_id VARCHAR, is_online BOOLEAN, status VARCHAR, approval_code VARCHAR, "
+            "response_code VARCHAR, response_message VARCHAR, mti VARCHAR, trace_number VARCHAR, batch_number INTEGER)"
+        ))
+    monkeypatch.setattr(models, "engine", engine)
+
+    models.Base.metadata.create_all(bind=engine)
+    assert inspect(engine).get_indexes("transactions") == []
+
+    models._create_missing_indexes()
+    models._create_missing_indexes()
+
+    indexed = {index["column_names"][0] for index in inspect(engine).get_indexes("transactions")}
+    assert {"transaction_id", "terminal_id", "trace_number", "batch_number"} <= indexed
+    engine.dispose()
@@ -0,0 +1,156 @@
+"""
+Black Rock Payment Terminal - Transaction History Tests
+"""
+
+import asyncio
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from app.core.history import TransactionHistory
+from app.database import crud
+from app.database.models import Base
+
+TERMINAL_ID = "TERM0001"
+
+
+@pytest.fixture
+def database(tmp_path):
+    """Path and sync session factory of a fresh transactions database"""
+    path = tmp_path / "transactions.db"
+    engine = create_engine(f"sqlite:///{path}")
+    Base.metadata.create_all(engine)
+    yield path, sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def store(session_factory, *transactions) -> None:
+    db = session_factory()
+    try:
+        crud.upsert_transactions(db, [crud.transaction_row(transaction) for transaction in transactions])
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_least_recently_used_transactions_are_evicted(make_transaction):
+    history = TransactionHistory(TERMINAL_ID, max_entries=3)
+    first, second, third, fourth = (make_transaction() for _ in range(4))
+    for transaction in (first, second, third):
+        history.add(transaction)
+
+    # A lookup makes the first one the most recently used
+    assert history.get(first.transaction_id) is first
+    history.add(fourth)
+
+    assert len(history) == 3
+    assert history.evictions == 1
+    assert history.get(second.transaction_id) is None
+    assert history.recent() == [fourth, first, third]
+    assert history.recent(limit=1) == [fourth]
+
+
+def test_readding_a_transaction_does_not_grow_the_history(make_transaction):
+    history = TransactionHistory(TERMINAL_ID, max_entries=2)
+    transaction = make_transaction()
+
+    for _ in range(5):
+        history.add(transaction)
+
+    assert len(history) == 1
+    assert history.evictions == 0
+
+
+def test_trace_and_batch_indexes(make_transaction):
+    history = TransactionHistory(TERMINAL_ID, max_entries=10)
+    transactions = [make_transaction() for _ in range(3)]
+    transactions[2].batch_number = transactions[0].batch_number + 1
+    for transaction in transactions:
+        history.add(transaction)
+
+    assert history.find_by_trace(transactions[1].trace_number) is transactions[1]
+    assert history.find_by_trace("999999") is None
+    assert history.find_by_batch(transactions[0].batch_number) == transactions[:2]
+    assert history.find_by_batch(transactions[2].batch_number) == [transactions[2]]
+
+
+def test_eviction_removes_index_entries(make_transaction):
+    history = TransactionHistory(TERMINAL_ID, max_entries=1)
+    evicted, kept = make_transaction(), make_transaction()
+    kept.batch_number = evicted.batch_number + 1
+    history.add(evicted)
+    history.add(kept)
+
+    assert history.find_by_trace(evicted.trace_number) is None
+    assert history.find_by_batch(evicted.batch_number) == []
+    assert history._by_batch == {kept.batch_number: {kept.transaction_id: None}}
+
+
+def test_evicted_transactions_are_read_from_the_database(database, make_transaction):
+    _, session_factory = database
+    history = TransactionHistory(TERMINAL_ID, max_entries=1, session_factory=session_factory)
+    evicted, kept = make_transaction(amount=7.5), make_transaction()
+    store(session_factory, evicted, kept)
+    history.add(evicted)
+    history.add(kept)
+
+    restored = history.get(evicted.transaction_id)
+
+    assert restored is not evicted
+    assert restored.to_dict() == evicted.to_dict()
+    assert history.find_by_trace(evicted.trace_number).transaction_id == evicted.transaction_id
+    # Batch lookups merge memory and database without duplicates
+    batch = history.find_by_batch(evicted.batch_number)
+    assert sorted(t.transaction_id for t in batch) == sorted([evicted.transaction_id, kept.transaction_id])
+    assert kept in batch
+    assert history.get("unknown") is None
+
+
+def test_database_errors_are_treated_as_misses(make_transaction):
+    def broken_session():
+        raise RuntimeError("database unavailable")
+
+    history = TransactionHistory(TERMINAL_ID, session_factory=broken_session)
+
+    assert history.get(make_transaction().transaction_id) is None
+    assert history.find_by_batch(1) == []
+
+
+def test_get_async_falls_through_to_the_database(database, make_transaction):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    path, session_factory = database
+    evicted, kept = make_transaction(), make_transaction()
+    store(session_factory, evicted)
+
+    async def lookups():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+        history = TransactionHistory(
+            TERMINAL_ID, max_entries=1, async_session_factory=async_sessionmaker(engine, expire_on_commit=False)
+        )
+        history.add(evicted)
+        history.add(kept)
+        try:
+            return [
+                await history.get_async(transaction_id)
+                for transaction_id in (kept.transaction_id, evicted.transaction_id, "unknown")
+            ]
+        finally:
+            await engine.dispose()
+
+    in_memory, restored, unknown = asyncio.run(lookups())
+
+    assert in_memory is kept
+    assert restored.to_dict() == evicted.to_dict()
+    assert unknown is None
+
+
+def test_get_async_without_a_database_only_reads_memory(make_transaction):
+    history = TransactionHistory(TERMINAL_ID)
+    transaction = make_transaction()
+    history.add(transaction)
+
+    assert asyncio.run(history.get_async(transaction.transaction_id)) is transaction
+    assert asyncio.run(history.get_async("unknown")) is None
@@ -0,0 +1,122 @@
+"""
+Black Rock Payment Terminal - ISO 8583 Host Link Tests
+"""
+
+import asyncio
+
+import httpx
+import pytest
+
+from app.core.host_link import IsoHostLink, decode_tpdu, encode_frame, encode_tpdu, protocol_for_nii, read_frame
+from app.core.stan import format_trace_number
+from app.protocols.iso8583 import MAX_MESSAGE_SIZE, get_message_spec, transaction_to_fields
+
+PROTOCOL = "POS Terminal -101.1 (4-digit approval)"
+
+
+class FakeHost:
+    """
+    ISO host that holds requests until a batch is complete and answers
+    them in reverse order, echoing the amount (field 4) of each request
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.server = None
+        self.port = None
+
+    async def start(self) -> None:
+        self.server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        buffer = bytearray(MAX_MESSAGE_SIZE + 16)
+        held = []
+        try:
+            while True:
+                tpdu, message = await read_frame(reader)
+                destination, source = decode_tpdu(tpdu)
+                protocol = protocol_for_nii(destination)
+                _, values = get_message_spec(protocol).decode(message)
+                if int(values[4]) == 0:
+                    # Never answered
+                    continue
+                held.append((encode_tpdu(source, destination), protocol, values))
+                if len(held) < self.batch_size:
+                    continue
+                for response_tpdu, protocol, values in reversed(held):
+                    response = {39: "00", 4: values[4], 11: values[11], 41: values[41]}
+                    writer.write(encode_frame(buffer, response_tpdu, protocol, "0210", response))
+                held = []
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            writer.close()
+
+
+def request_fields(make_transaction, sequence: int, amount: float):
+    transaction = make_transaction(amount=amount)
+    transaction.trace_number = format_trace_number(sequence)
+    return transaction_to_fields(transaction)
+
+
+def run_with_host(batch_size: int, scenario):
+    async def main():
+        host = FakeHost(batch_size)
+        await host.start()
+        link = IsoHostLink(f"tcp://127.0.0.1:{host.port}", settings={"connections": 1, "request_timeout": 2})
+        try:
+            return await scenario(link)
+        finally:
+            await link.aclose()
+            await host.stop()
+
+    return asyncio.run(main())
+
+
+def test_out_of_order_responses_are_matched_by_stan(make_transaction):
+    requests = [request_fields(make_transaction, sequence, amount=sequence + 1) for sequence in range(5)]
+
+    async def scenario(link):
+        return await asyncio.gather(*(link.request(PROTOCOL, mti, values) for mti, values in requests))
+
+    responses = run_with_host(len(requests), scenario)
+
+    for (_, request), (mti, response) in zip(requests, responses):
+        assert mti == "0210"
+        assert (response[11], int(response[4])) == (request[11], int(request[4]))
+
+
+def test_duplicate_outstanding_stan_is_refused(make_transaction):
+    mti, values = request_fields(make_transaction, 0, amount=5)
+
+    async def scenario(link):
+        first = asyncio.ensure_future(link.request(PROTOCOL, mti, values))
+        await asyncio.sleep(0.1)
+        with pytest.raises(ValueError):
+            await link.request(PROTOCOL, mti, dict(values))
+        # Completes the held batch so the first request is answered
+        _, other = request_fields(make_transaction, 1, amount=6)
+        second = link.request(PROTOCOL, mti, other)
+        return await asyncio.gather(first, second)
+
+    (_, first), (_, second) = run_with_host(2, scenario)
+
+    assert (first[11], second[11]) == ("000001", "000002")
+
+
+def test_unanswered_request_times_out(make_transaction):
+    mti, values = request_fields(make_transaction, 0, amount=0)
+
+    async def scenario(link):
+        with pytest.raises(httpx.ReadTimeout):
+            await link.request(PROTOCOL, mti, values, timeout=0.2)
+        return link.get_stats()
+
+    stats = run_with_host(1, scenario)
+
+    assert stats["timeouts"] == 1
+    assert stats["in_flight"] == 0
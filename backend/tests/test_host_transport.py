@@ -0,0 +1,92 @@
+"""
+Black Rock Payment Terminal - Pooled Host Transport Tests
+"""
+
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from app.core.transport import HostTransport
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    """Echoes the request path over HTTP/1.1 keep-alive connections"""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        body = json.dumps({"path": self.path}).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def host_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_client_is_created_once_and_reused():
+    transport = HostTransport("http://acquirer.test/")
+
+    async def clients():
+        first = transport._get_async_client()
+        second = transport._get_async_client()
+        await transport.aclose()
+        return first, second
+
+    first, second = asyncio.run(clients())
+
+    assert first is second
+    assert transport.base_url == "http://acquirer.test"
+    assert first.timeout.connect == transport.timeout.connect
+
+
+def test_sequential_requests_share_one_connection(host_url):
+    transport = HostTransport(host_url)
+
+    async def send():
+        try:
+            return [
+                (await transport.apost(path, {"amount": 1})).json()
+                for path in ("/heartbeat", "/process", "/sync_offline")
+            ]
+        finally:
+            await transport.aclose()
+
+    responses = asyncio.run(send())
+    stats = transport.get_stats()
+
+    assert [response["path"] for response in responses] == ["/heartbeat", "/process", "/sync_offline"]
+    assert (stats["requests"], stats["connections_opened"], stats["connections_reused"]) == (3, 1, 2)
+    assert stats["reuse_ratio"] == pytest.approx(2 / 3)
+
+
+def test_concurrent_requests_are_bounded_by_the_pool(host_url):
+    transport = HostTransport(host_url, {"max_connections": 2, "max_keepalive_connections": 2})
+
+    async def send():
+        try:
+            await asyncio.gather(*(transport.apost("/process", {"amount": 1}) for _ in range(8)))
+        finally:
+            await transport.aclose()
+
+    asyncio.run(send())
+    stats = transport.get_stats()
+
+    assert stats["requests"] == 8
+    assert stats["connections_opened"] <= 2
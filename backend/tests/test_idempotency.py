@@ -0,0 +1,193 @@
+"""
+Black Rock Payment Terminal - Idempotency Key Tests
+"""
+
+import time
+import asyncio
+import sqlite3
+
+import pytest
+
+from app.core.idempotency import IdempotencyCache, request_fingerprint
+from app.core.shared_state import SharedStateStore
+
+RESPONSE = {"transaction_id": "tx-1", "status": "APPROVED"}
+
+
+@pytest.fixture
+def shared_store(tmp_path):
+    store = SharedStateStore(str(tmp_path / "shared_state.db"))
+    yield store
+    store.close()
+
+
+def reserve(cache, terminal_id, key, fingerprint):
+    return asyncio.run(cache.reserve_async(terminal_id, key, fingerprint))
+
+
+def test_fingerprint_ignores_key_order():
+    assert request_fingerprint({"amount": 10, "currency": "USD"}) == request_fingerprint({"currency": "USD", "amount": 10})
+    assert request_fingerprint({"amount": 10}) != request_fingerprint({"amount": 11})
+
+
+def test_duplicate_key_coalesces_onto_original():
+    cache = IdempotencyCache(ttl=60, max_entries=100)
+    fingerprint = request_fingerprint({"amount": 10})
+
+    original, created = reserve(cache, "T1", "key-1", fingerprint)
+    duplicate, duplicate_created = reserve(cache, "T1", "key-1", fingerprint)
+
+    assert created and not duplicate_created
+    assert duplicate is original
+    assert cache.coalesced == 1
+
+    async def wait_for_original():
+        waiter = asyncio.ensure_future(cache.wait(duplicate, timeout=5))
+        await asyncio.sleep(0.01)
+        assert not waiter.done()
+        cache.complete(original, RESPONSE)
+        await waiter
+
+    asyncio.run(wait_for_original())
+    assert duplicate.result.result() == RESPONSE
+
+    _, replay_created = reserve(cache, "T1", "key-1", fingerprint)
+    assert not replay_created
+    assert cache.hits == 1
+
+
+def test_keys_are_per_terminal():
+    cache = IdempotencyCache(ttl=60, max_entries=100)
+
+    _, first = reserve(cache, "T1", "key-1", "a")
+    _, second = reserve(cache, "T2", "key-1", "a")
+
+    assert first and second
+
+
+def test_released_key_can_be_retried():
+    cache = IdempotencyCache(ttl=60, max_entries=100)
+    entry, _ = reserve(cache, "T1", "key-1", "a")
+
+    cache.release("T1", "key-1", entry)
+
+    assert entry.result.cancelled()
+    assert reserve(cache, "T1", "key-1", "a")[1]
+
+
+def test_oldest_keys_are_evicted():
+    cache = IdempotencyCache(ttl=60, max_entries=2)
+    for index in range(3):
+        reserve(cache, "T1", f"key-{index}", "a")
+
+    reserve(cache, "T1", "key-3", "a")
+
+    assert len(cache) == 3
+    assert cache.evictions == 1
+    assert reserve(cache, "T1", "key-0", "a")[1]
+
+
+def test_duplicate_on_another_worker_gets_original_response(shared_store):
+    worker_a = IdempotencyCache(ttl=60, max_entries=100, store=shared_store)
+    worker_b = IdempotencyCache(ttl=60, max_entries=100, store=shared_store)
+    worker_b.poll_interval = 0.01
+
+    original, created = reserve(worker_a, "T1", "key-1", "a")
+    remote, remote_created = reserve(worker_b, "T1", "key-1", "a")
+
+    assert created and not remote_created
+    assert remote.remote and not remote.completed
+
+    worker_a.complete(original, RESPONSE)
+    asyncio.run(worker_b.wait(remote, timeout=5))
+
+    assert remote.result.result() == RESPONSE
+
+
+def test_shared_store_reservations(shared_store):
+    assert shared_store.reserve_key("T1", "key-1", "a", ttl=60) is None
+    assert shared_store.reserve_key("T1", "key-1", "b", ttl=60) == ("a", None)
+
+    shared_store.complete_key("T1", "key-1", RESPONSE)
+    assert shared_store.get_key("T1", "key-1") == ("a", RESPONSE)
+
+    # Completed keys are kept; only unprocessed reservations can be released
+    shared_store.release_key("T1", "key-1")
+    assert shared_store.get_key("T1", "key-1") == ("a", RESPONSE)
+    shared_store.reserve_key("T1", "key-2", "a", ttl=60)
+    shared_store.release_key("T1", "key-2")
+    assert shared_store.get_key("T1", "key-2") is None
+
+
+def test_shared_store_expires_reservations(shared_store):
+    shared_store.reserve_key("T1", "key-1", "a", ttl=60)
+
+    assert shared_store.reserve_key("T1", "key-1", "b", ttl=-1) is None
+    assert shared_store.get_key("T1", "key-1") == ("b", None)
+
+
+def test_shared_store_transaction_index(shared_store):
+    shared_store.index_transaction("T1", RESPONSE)
+    shared_store.index_transaction("T1", dict(RESPONSE, status="DECLINED"))
+
+    assert shared_store.get_indexed_transaction("tx-1")["status"] == "DECLINED"
+    assert shared_store.get_indexed_transaction("tx-2") is None
+    assert shared_store.purge_expired(ttl=-1) == 1
+
+
+def test_store_calls_stay_off_the_event_loop(shared_store):
+    cache = IdempotencyCache(ttl=60, max_entries=100, store=shared_store)
+    ticks = []
+
+    async def reserve_while_store_is_locked():
+        async def tick():
+            while True:
+                ticks.append(time.monotonic())
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.ensure_future(tick())
+        # Another writer holds the store, as a busy worker would hold the SQLite write lock
+        shared_store._lock.acquire()
+        asyncio.get_running_loop().call_later(0.2, shared_store._lock.release)
+        try:
+            return await asyncio.gather(*(cache.reserve_async("T1", "key-1", "a") for _ in range(3)))
+        finally:
+            ticker.cancel()
+
+    (original, created), *duplicates = asyncio.run(reserve_while_store_is_locked())
+
+    # The loop kept running while the reservation waited for the store
+    assert len(ticks) > 5
+    assert created
+    assert [entry is original and not entry_created for entry, entry_created in duplicates] == [True, True]
+    assert shared_store.get_key("T1", "key-1") == ("a", None)
+
+
+def test_completion_never_waits_for_the_store(shared_store):
+    cache = IdempotencyCache(ttl=60, max_entries=100, store=shared_store)
+    entry, _ = reserve(cache, "T1", "key-1", "a")
+
+    with shared_store._lock:
+        started = time.monotonic()
+        cache.complete(entry, RESPONSE)
+        assert time.monotonic() - started < 0.1
+        assert entry.result.result(timeout=0) == RESPONSE
+
+    # Submitted writes are applied in order
+    shared_store.submit(lambda: None).result(timeout=5)
+    assert shared_store.get_key("T1", "key-1") == ("a", RESPONSE)
+
+
+def test_failed_store_reservation_leaves_the_key_free(shared_store, monkeypatch):
+    cache = IdempotencyCache(ttl=60, max_entries=100, store=shared_store)
+
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(shared_store, "reserve_key", locked)
+    with pytest.raises(sqlite3.OperationalError):
+        reserve(cache, "T1", "key-1", "a")
+    monkeypatch.undo()
+
+    assert len(cache) == 0
+    assert reserve(cache, "T1", "key-1", "a")[1]
@@ -0,0 +1,111 @@
+"""
+Black Rock Payment Terminal - ISO 8583 Codec Tests
+"""
+
+import pytest
+
+from app.config import settings
+from app.core.transaction import TransactionStatus, TransactionType
+from app.protocols.handler import get_protocol_handler
+from app.protocols.iso8583 import (
+    encode_transaction, decode_transaction, get_message_spec, original_data_elements,
+    transaction_to_fields, validate_card_acceptor_ids
+)
+
+PROTOCOLS = list(settings.PROTOCOLS)
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_round_trip(protocol, make_transaction):
+    transaction = make_transaction(amount=1234.56, protocol=protocol)
+    transaction.set_mti("0200")
+    transaction.set_approval_code(get_protocol_handler(protocol).generate_approval_code())
+    transaction.update_status(TransactionStatus.APPROVED, response_code="00", response_message="Approved")
+    transaction.batch_number = 7
+
+    decoded = decode_transaction(protocol, encode_transaction(transaction))
+
+    assert decoded.to_dict() == transaction.to_dict()
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_round_trip_into_buffer(protocol, make_transaction):
+    transaction = make_transaction(protocol=protocol, transaction_type=TransactionType.REFUND)
+    buffer = bytearray(8192)
+
+    size = encode_transaction(transaction, buffer)
+
+    assert bytes(buffer[:size]) == encode_transaction(transaction)
+    assert decode_transaction(protocol, buffer[:size]).to_dict() == transaction.to_dict()
+
+
+def test_standard_fields_keep_iso_formats(make_transaction):
+    transaction = make_transaction(terminal_id="T1")
+    transaction.update_status(TransactionStatus.DECLINED, response_code="05", response_message="Do not honor")
+    message = encode_transaction(transaction)
+
+    _, values = get_message_spec(transaction.protocol).decode(message)
+
+    # Fixed width card acceptor IDs are space padded on the wire and stripped on decode
+    assert b"T1      " in message
+    assert values[41] == "T1"
+    assert values[39] == "05"
+    assert len(values[12]) == 6 and len(values[13]) == 4
+
+
+def test_terminal_response_codes_use_private_field(make_transaction):
+    transaction = make_transaction()
+    transaction.update_status(TransactionStatus.ERROR, response_code="E2003", response_message="x" * 40)
+
+    _, values = transaction_to_fields(transaction)
+    decoded = decode_transaction(transaction.protocol, encode_transaction(transaction))
+
+    assert 39 not in values and values[63] == "E2003"
+    assert decoded.response_code == "E2003"
+    # Field 44 holds at most 25 bytes
+    assert decoded.response_message == "x" * 25
+
+
+def test_original_data_elements(make_transaction):
+    transaction = make_transaction()
+    transaction.set_mti("0200")
+
+    elements = original_data_elements(transaction)
+
+    assert len(elements) == 42
+    assert elements.startswith("0200" + transaction.trace_number)
+    assert elements.endswith("0" * 22)
+
+
+def test_card_acceptor_ids_must_fit():
+    validate_card_acceptor_ids("TERM0001", "MERCHANT0000001")
+    with pytest.raises(ValueError):
+        validate_card_acceptor_ids("TERMINAL9", "M1")
+    with pytest.raises(ValueError):
+        validate_card_acceptor_ids("T1", "MERCHANT00000001")
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_approval_code_field_matches_the_protocol(protocol, make_transaction):
+    approval_length = settings.PROTOCOLS[protocol]["approval_length"]
+    spec = get_message_spec(protocol).fields[38]
+    transaction = make_transaction(protocol=protocol)
+    code = get_protocol_handler(protocol).generate_approval_code()
+    transaction.set_approval_code(code)
+
+    message = encode_transaction(transaction)
+
+    assert (spec.length, spec.pad) == (approval_length, False)
+    # The code fills the field exactly: no padding to strip on decode
+    assert len(spec.to_bytes(code)) == approval_length
+    assert decode_transaction(protocol, message).approval_code == code
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_approval_codes_of_another_length_are_refused(protocol):
+    approval_length = settings.PROTOCOLS[protocol]["approval_length"]
+    spec = get_message_spec(protocol)
+
+    for code in ("1" * (approval_length - 1), "1" * (approval_length + 1)):
+        with pytest.raises(ValueError):
+            spec.encode("0100", {38: code, 41: "T1"})
@@ -0,0 +1,148 @@
+"""
+Black Rock Payment Terminal - Logging Pipeline Tests
+"""
+
+import json
+import queue
+import logging
+
+import pytest
+
+from app.utils import logging_pipeline
+from app.utils.logging_pipeline import NonBlockingQueueHandler, RateLimitFilter, SamplingFilter
+
+
+def make_record(msg: str = "Transaction %s approved", level: int = logging.INFO,
+                name: str = "app.core.processor") -> logging.LogRecord:
+    return logging.LogRecord(name, level, __file__, 1, msg, ("T1",), None)
+
+
+class FakeClock:
+    """Stands in for the time module inside the logging pipeline"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(logging_pipeline, "time", clock)
+    return clock
+
+
+def test_rate_limit_drops_records_beyond_the_burst(clock):
+    limiter = RateLimitFilter(per_second=10, burst=3)
+
+    kept = [limiter.filter(make_record()) for _ in range(5)]
+
+    assert kept == [True, True, True, False, False]
+
+
+def test_next_record_after_a_drop_reports_the_suppressed_count(clock):
+    limiter = RateLimitFilter(per_second=10, burst=2)
+    for _ in range(5):
+        limiter.filter(make_record())
+
+    # 100ms refills one token
+    clock.now += 0.1
+    record = make_record()
+
+    assert limiter.filter(record)
+    assert record.suppressed == 3
+    assert not limiter.filter(make_record())
+    clock.now += 0.1
+    assert limiter.filter(make_record())
+
+
+def test_rate_limit_is_per_event(clock):
+    limiter = RateLimitFilter(per_second=1, burst=1)
+
+    assert limiter.filter(make_record("Heartbeat successful"))
+    assert not limiter.filter(make_record("Heartbeat successful"))
+    assert limiter.filter(make_record("Batch sent"))
+    assert limiter.filter(make_record("Heartbeat successful", name="app.core.sync"))
+
+
+def test_warnings_are_never_rate_limited(clock):
+    limiter = RateLimitFilter(per_second=1, burst=1)
+
+    assert all(limiter.filter(make_record(level=logging.WARNING)) for _ in range(10))
+    assert all(limiter.filter(make_record(level=logging.ERROR)) for _ in range(10))
+
+
+def test_sampling_keeps_every_nth_record_of_an_event():
+    sampler = SamplingFilter({"Transaction %s approved": 0.25})
+
+    kept = [sampler.filter(make_record()) for _ in range(8)]
+
+    assert kept == [True, False, False, False, True, False, False, False]
+    # Other events are not sampled
+    assert all(sampler.filter(make_record("Batch sent")) for _ in range(4))
+
+
+def test_sampling_by_logger_name():
+    sampler = SamplingFilter({"app.core.sync": 0.5, "app.core.transport": 0})
+
+    assert [sampler.filter(make_record(name="app.core.sync")) for _ in range(4)] == [True, False, True, False]
+    assert not sampler.filter(make_record(name="app.core.transport"))
+    assert sampler.filter(make_record(name="app.core.processor"))
+
+
+def test_full_queue_drops_and_counts_records():
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=2))
+    records = [make_record() for _ in range(5)]
+
+    for record in records:
+        handler.handle(record)
+
+    assert handler.dropped == 3
+    assert handler.queue.qsize() == 2
+    # Records are queued unformatted, as created
+    assert handler.queue.get_nowait() is records[0]
+    assert records[0].msg == "Transaction %s approved"
+
+
+def test_filters_run_before_the_record_is_queued(clock):
+    handler = NonBlockingQueueHandler(queue.Queue(maxsize=10))
+    handler.addFilter(RateLimitFilter(per_second=1, burst=2))
+
+    for _ in range(5):
+        handler.handle(make_record())
+
+    # Rate-limited records are filtered, not counted as queue drops
+    assert handler.queue.qsize() == 2
+    assert handler.dropped == 0
+
+
+@pytest.fixture
+def root_logger():
+    """Restore the root logger after configure_logging replaced its handlers"""
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    logging_pipeline.shutdown_logging()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def test_configured_pipeline_writes_json_lines(root_logger, tmp_path):
+    path = tmp_path / "terminal.log"
+    logging_pipeline.configure_logging(str(path), {"level": "INFO", "rate_limit_per_second": 0})
+
+    logging.getLogger("app.core.processor").info("Transaction %s approved", "T1", extra={"terminal_id": "TERM0001"})
+    logging.getLogger("app.core.processor").debug("Not written")
+    logging_pipeline.shutdown_logging()
+
+    [line] = path.read_text().splitlines()
+    entry = json.loads(line)
+    assert (entry["level"], entry["logger"]) == ("INFO", "app.core.processor")
+    assert (entry["event"], entry["message"]) == ("Transaction %s approved", "Transaction T1 approved")
+    assert entry["terminal_id"] == "TERM0001"
+    assert logging_pipeline.get_stats() == {"queued": 0, "dropped": 0}
@@ -0,0 +1,178 @@
+"""
+Black Rock Payment Terminal - Metrics Tests
+"""
+
+import asyncio
+import inspect
+
+import pytest
+
+from app.utils.metrics import (
+    CONTENT_TYPE, STAGE_SECONDS, Counter, Gauge, Histogram, MetricsRegistry, StageTimer, timed_stage
+)
+
+
+@pytest.fixture
+def registry():
+    return MetricsRegistry()
+
+
+def test_counter_exposition(registry):
+    requests = Counter("test_requests", "Requests served", ["path", "outcome"], registry=registry)
+    requests.labels("/payment", "ok").inc()
+    requests.labels("/payment", "ok").inc(2)
+    requests.labels("/refund", "error").inc()
+
+    assert registry.render() == (
+        "# HELP test_requests Requests served\n"
+        "# TYPE test_requests counter\n"
+        'test_requests_total{path="/payment",outcome="ok"} 3.0\n'
+        'test_requests_total{path="/refund",outcome="error"} 1.0\n'
+    )
+    assert CONTENT_TYPE == "text/plain; version=0.0.4; charset=utf-8"
+
+
+def test_labels_must_match_the_declared_names(registry):
+    requests = Counter("test_requests", "Requests served", ["path"], registry=registry)
+
+    with pytest.raises(ValueError):
+        requests.labels("/payment", "ok")
+    assert requests.labels("/payment") is requests.labels("/payment")
+
+
+def test_duplicate_metric_names_are_refused(registry):
+    Counter("test_requests", "Requests served", registry=registry)
+
+    with pytest.raises(ValueError):
+        Gauge("test_requests", "Requests served", registry=registry)
+
+
+def test_label_values_are_escaped(registry):
+    counter = Counter("test_escaped", "Escaping", ["value"], registry=registry)
+    counter.labels('a "quoted"\\path\nnext').inc()
+
+    assert 'test_escaped_total{value="a \\"quoted\\"\\\\path\\nnext"} 1.0' in registry.render().splitlines()
+
+
+def test_histogram_buckets_are_cumulative(registry):
+    latency = Histogram("test_latency_seconds", "Latency", ["stage"], buckets=(0.5, 0.1, 1.0), registry=registry)
+    child = latency.labels("validation")
+    for value in (0.05, 0.1, 0.3, 0.7, 2.0):
+        child.observe(value)
+
+    lines = registry.render().splitlines()
+
+    assert lines[1] == "# TYPE test_latency_seconds histogram"
+    assert lines[2:] == [
+        # Bounds are inclusive: 0.1 falls in the le="0.1" bucket
+        'test_latency_seconds_bucket{stage="validation",le="0.1"} 2',
+        'test_latency_seconds_bucket{stage="validation",le="0.5"} 3',
+        'test_latency_seconds_bucket{stage="validation",le="1.0"} 4',
+        'test_latency_seconds_bucket{stage="validation",le="+Inf"} 5',
+        'test_latency_seconds_sum{stage="validation"} 3.15',
+        'test_latency_seconds_count{stage="validation"} 5',
+    ]
+
+
+def test_histogram_quantiles_are_bucket_upper_bounds(registry):
+    child = Histogram("test_quantiles", "Quantiles", buckets=(0.1, 1.0), registry=registry).labels()
+
+    assert child.quantile(0.5) is None
+    for value in (0.05, 0.05, 0.05, 0.5, 5.0):
+        child.observe(value)
+
+    assert child.quantile(0.5) == 0.1
+    assert child.quantile(0.8) == 1.0
+    assert child.quantile(1.0) == float("inf")
+
+
+def test_histogram_timer(registry):
+    child = Histogram("test_timed", "Timed", registry=registry).labels()
+
+    with child.time():
+        pass
+
+    assert child.count == 1
+
+
+def test_gauge_reads_its_callback_at_scrape_time(registry):
+    depth = [3]
+    gauge = Gauge("test_depth", "Queue depth", registry=registry)
+
+    assert registry.render() == "\n"
+
+    gauge.set_function(lambda: depth[0])
+    depth[0] = 7
+    assert registry.render().splitlines()[-1] == "test_depth 7.0"
+
+    # A failing callback drops the sample instead of failing the scrape
+    gauge.set_function(lambda: 1 / 0)
+    assert registry.render() == "\n"
+
+
+def stage_count(stage: str, transaction, outcome: str = "ok") -> int:
+    return STAGE_SECONDS.labels(stage, transaction.protocol, transaction.mti or "", outcome).count
+
+
+def test_stage_timer_records_errors(make_transaction):
+    transaction = make_transaction()
+
+    with pytest.raises(RuntimeError):
+        with StageTimer("test_stage_error", transaction.protocol):
+            raise RuntimeError("failed")
+
+    assert stage_count("test_stage_error", transaction, "error") == 1
+
+
+def test_timed_stage_times_a_coroutine_until_it_completes(make_transaction):
+    @timed_stage("test_async_stage")
+    async def commit(db, transaction):
+        await asyncio.sleep(0.05)
+        return transaction.transaction_id
+
+    transaction = make_transaction()
+    transaction.set_mti("0200")
+    child = STAGE_SECONDS.labels("test_async_stage", transaction.protocol, "0200", "ok")
+
+    assert inspect.iscoroutinefunction(commit)
+    assert asyncio.run(commit(None, transaction=transaction)) == transaction.transaction_id
+    assert child.count == 1
+    assert child.sum >= 0.05
+
+
+def test_timed_stage_records_failed_coroutines(make_transaction):
+    @timed_stage("test_async_failure")
+    async def commit(db, transaction):
+        raise RuntimeError("database is locked")
+
+    transaction = make_transaction()
+
+    with pytest.raises(RuntimeError):
+        asyncio.run(commit(None, transaction))
+
+    assert stage_count("test_async_failure", transaction, "error") == 1
+    assert stage_count("test_async_failure", transaction) == 0
+
+
+def test_async_commits_are_timed_as_db_commit(tmp_path, make_transaction):
+    pytest.importorskip("aiosqlite")
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+    from app.database import crud
+    from app.database.models import Base
+
+    transaction = make_transaction()
+    before = stage_count("db_commit", transaction)
+
+    async def commit():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'transactions.db'}")
+        try:
+            async with engine.begin() as connection:
+                await connection.run_sync(Base.metadata.create_all)
+            async with async_sessionmaker(engine)() as db:
+                await crud.create_transaction_async(db, transaction)
+        finally:
+            await engine.dispose()
+
+    asyncio.run(commit())
+
+    assert stage_count("db_commit", transaction) == before + 1
@@ -0,0 +1,145 @@
+"""
+Black Rock Payment Terminal - Offline Queue Tests
+"""
+
+import asyncio
+import queue
+import sqlite3
+
+import pytest
+
+from app.core.offline_queue import OfflineQueue, OfflineQueueStore
+
+
+class FailingCommits:
+    """Connection wrapper whose COMMITs fail while failing is set"""
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.failing = True
+
+    def execute(self, sql, *args):
+        if self.failing and sql == "COMMIT":
+            raise sqlite3.OperationalError("disk I/O error")
+        return self.conn.execute(sql, *args)
+
+    def __getattr__(self, name):
+        return getattr(self.conn, name)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "offline_queue.db")
+
+
+@pytest.fixture
+def store(path):
+    store = OfflineQueueStore(path)
+    yield store
+    store.close()
+
+
+def committed_ids(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT transaction_id FROM offline_queue ORDER BY seq")]
+    finally:
+        conn.close()
+
+
+def test_put_returns_once_committed(store, path, make_transaction):
+    offline_queue = OfflineQueue("T1", store)
+    transaction = make_transaction(terminal_id="T1")
+
+    offline_queue.put(transaction)
+
+    # Visible to another connection as soon as put returns
+    assert committed_ids(path) == [transaction.transaction_id]
+    assert offline_queue.qsize() == 1
+
+
+def test_concurrent_puts_share_commits(store, path, make_transaction):
+    offline_queue = OfflineQueue("T1", store)
+    transactions = [make_transaction(terminal_id="T1") for _ in range(50)]
+
+    async def put_all():
+        await asyncio.gather(*(offline_queue.put_async(transaction) for transaction in transactions))
+
+    asyncio.run(put_all())
+
+    assert sorted(committed_ids(path)) == sorted(transaction.transaction_id for transaction in transactions)
+    assert offline_queue.qsize() == 50
+
+
+def test_duplicate_put_is_counted_once(store, make_transaction):
+    offline_queue = OfflineQueue("T1", store)
+    transaction = make_transaction(terminal_id="T1")
+
+    offline_queue.put(transaction)
+    offline_queue.put(transaction)
+
+    assert offline_queue.qsize() == 1
+
+
+def test_failed_commit_fails_the_put(store, path, make_transaction):
+    offline_queue = OfflineQueue("T1", store)
+    failing = FailingCommits(store._conn)
+    store._conn = failing
+
+    with pytest.raises(sqlite3.OperationalError):
+        offline_queue.put(make_transaction(terminal_id="T1"))
+
+    assert offline_queue.qsize() == 0
+    assert committed_ids(path) == []
+
+    failing.failing = False
+    transaction = make_transaction(terminal_id="T1")
+    offline_queue.put(transaction)
+    assert committed_ids(path) == [transaction.transaction_id]
+
+
+def test_unsynced_entries_survive_a_restart(path, make_transaction):
+    store = OfflineQueueStore(path)
+    transactions = [make_transaction(terminal_id="T1") for _ in range(3)]
+    for transaction in transactions:
+        OfflineQueue("T1", store).put(transaction)
+    store.close()
+
+    reopened = OfflineQueueStore(path)
+    try:
+        offline_queue = OfflineQueue("T1", reopened)
+        assert offline_queue.qsize() == 3
+        assert [t.transaction_id for t in offline_queue.get_batch(10)] == [t.transaction_id for t in transactions]
+    finally:
+        reopened.close()
+
+
+def test_lease_ack_release_and_retry(store, make_transaction):
+    offline_queue = OfflineQueue("T1", store)
+    first, second, third = (make_transaction(terminal_id="T1") for _ in range(3))
+    for transaction in (first, second, third):
+        offline_queue.put(transaction)
+
+    leased = offline_queue.get_batch(2)
+    assert [t.transaction_id for t in leased] == [first.transaction_id, second.transaction_id]
+    # Leased entries are not handed out twice
+    assert [t.transaction_id for t in offline_queue.get_batch(10)] == [third.transaction_id]
+
+    offline_queue.ack(first.transaction_id)
+    offline_queue.release(third.transaction_id)
+    offline_queue.retry(second.transaction_id, delay=60)
+
+    assert offline_queue.qsize() == 2
+    # The retried entry keeps its place but is not due yet
+    assert [t.transaction_id for t in offline_queue.get_batch(10)] == [third.transaction_id]
+    with pytest.raises(queue.Empty):
+        offline_queue.get()
+
+
+def test_terminals_are_isolated(store, make_transaction):
+    mine, theirs = OfflineQueue("T1", store), OfflineQueue("T2", store)
+    mine.put(make_transaction(terminal_id="T1"))
+
+    assert mine.qsize() == 1
+    assert theirs.empty()
+    assert theirs.get_batch(10) == []
@@ -0,0 +1,134 @@
+"""
+Black Rock Payment Terminal - Write-Behind Persistence Tests
+"""
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+from app.core.persistence import TransactionWriter, WriteBufferFull
+from app.database.models import Base, TransactionModel
+
+# Flushed by hand: the flusher thread only runs after an hour
+MANUAL = {"flush_interval": 3600, "flush_batch": 100000, "retry_delay": 0}
+
+
+@pytest.fixture
+def session_factory(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'transactions.db'}")
+    Base.metadata.create_all(engine)
+    yield sessionmaker(bind=engine)
+    engine.dispose()
+
+
+def make_writer(session_factory, **settings) -> TransactionWriter:
+    writer = TransactionWriter(session_factory, dict(MANUAL, **settings))
+    # Stop the flusher so the test decides when commits happen
+    writer._stop.set()
+    writer._wakeup.set()
+    writer._flusher.join()
+    return writer
+
+
+def stored(session_factory):
+    db = session_factory()
+    try:
+        return {row.transaction_id: row for row in db.query(TransactionModel).all()}
+    finally:
+        db.close()
+
+
+class FailingSessions:
+    """Session factory whose sessions fail to connect while failing is set"""
+
+    def __init__(self, session_factory):
+        self.session_factory = session_factory
+        self.failing = True
+
+    def __call__(self):
+        if self.failing:
+            raise OperationalError("COMMIT", {}, Exception("database is locked"))
+        return self.session_factory()
+
+
+def test_durable_put_resolves_after_commit(session_factory, make_transaction):
+    writer = make_writer(session_factory)
+    transaction = make_transaction()
+
+    ack = writer.put(transaction, durable=True)
+    assert not ack.done()
+    assert stored(session_factory) == {}
+
+    writer.flush()
+
+    assert ack.result(timeout=0) is None
+    assert stored(session_factory)[transaction.transaction_id].amount == transaction.amount
+    assert writer.get_stats()["rows_written"] == 1
+
+
+def test_rewrites_between_commits_collapse(session_factory, make_transaction):
+    writer = make_writer(session_factory)
+    transaction = make_transaction()
+
+    writer.put(transaction)
+    transaction.set_approval_code("1234")
+    writer.put(transaction)
+    writer.flush()
+
+    assert writer.get_stats()["last_commit_rows"] == 1
+    assert stored(session_factory)[transaction.transaction_id].approval_code == "1234"
+
+
+def test_failed_commit_keeps_rows_buffered(session_factory, make_transaction):
+    sessions = FailingSessions(session_factory)
+    writer = make_writer(sessions)
+    transactions = [make_transaction() for _ in range(3)]
+    acks = [writer.put(transaction, durable=True) for transaction in transactions]
+
+    with pytest.raises(OperationalError):
+        writer.flush()
+
+    assert all(isinstance(ack.exception(timeout=0), OperationalError) for ack in acks)
+    assert writer.buffered() == 3
+    assert writer.get_stats()["quarantined_rows"] == 0
+
+    sessions.failing = False
+    writer.flush()
+
+    assert writer.buffered() == 0
+    assert set(stored(session_factory)) == {transaction.transaction_id for transaction in transactions}
+
+
+def test_poison_row_is_quarantined(session_factory, make_transaction):
+    writer = make_writer(session_factory, max_row_attempts=2)
+    transactions = [make_transaction() for _ in range(10)]
+    acks = [writer.put(transaction, durable=True) for transaction in transactions]
+    poison = transactions[6].transaction_id
+    # A value the database driver cannot bind
+    writer._pending[poison]["amount"] = object()
+
+    with pytest.raises(Exception):
+        writer.flush()
+
+    # Every other row committed; the poison row is retried once more, then dropped
+    assert set(stored(session_factory)) == {t.transaction_id for t in transactions} - {poison}
+    assert [ack.exception(timeout=0) is None for ack in acks] == [index != 6 for index in range(10)]
+    assert writer.buffered() == 1
+
+    writer.flush()
+
+    assert writer.buffered() == 0
+    assert [row["transaction_id"] for row in writer.quarantined()] == [poison]
+    assert writer.get_stats()["quarantined_rows"] == 1
+
+
+def test_full_buffer_refuses_writes(session_factory, make_transaction):
+    writer = make_writer(session_factory, max_buffered=2)
+    writer.put(make_transaction())
+    writer.put(make_transaction())
+
+    with pytest.raises(WriteBufferFull):
+        writer.put(make_transaction(), timeout=0.01)
+
+    assert writer.get_stats()["rejected_puts"] == 1
@@ -0,0 +1,132 @@
+"""
+Black Rock Payment Terminal - Transaction Processor Tests
+"""
+
+import asyncio
+import itertools
+import threading
+
+import httpx
+import pytest
+
+from app.config.settings import NETWORK_SETTINGS
+from app.config.terminal import TerminalConfig
+from app.core.processor import TransactionProcessor
+from app.core.transaction import TransactionStatus
+
+HOST_URL = "http://acquirer.test"
+PIN_LESS = "POS Terminal -101.8 (PIN-LESS transaction)"
+
+_terminal_ids = (f"PRC{number:05d}" for number in itertools.count())
+
+
+class StubHost:
+    """Answers /process with the queued (status, body) pairs, repeating the last one"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses) or [(200, {"approved": True, "approval_code": "1234"})]
+        self.calls = 0
+        self.threads = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        self.threads.add(threading.current_thread())
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.in_flight -= 1
+        status, body = self.responses[min(self.calls, len(self.responses)) - 1]
+        return httpx.Response(status, json=body)
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """Processor on a private runtime whose HTTP host is processor.host"""
+    terminal_id = next(_terminal_ids)
+    config = TerminalConfig("MERCHANT0000001", terminal_id, HOST_URL, heartbeat_interval=3600)
+    processor = TransactionProcessor(config.merchant_id, terminal_id, config.server_url, config=config)
+    processor.host = StubHost()
+    for host in processor.transport.hosts:
+        host._async_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: processor.host(request)))
+    monkeypatch.setattr(processor, "_retry_delay", lambda retry_count: 0)
+    yield processor
+    processor.shutdown()
+
+
+def test_sync_wrapper_runs_on_the_processor_loop(processor, make_transaction):
+    transaction = make_transaction(terminal_id=processor.terminal_id)
+
+    result = processor.process_transaction(transaction)
+
+    assert result is transaction
+    assert transaction.status == TransactionStatus.APPROVED
+    assert transaction.approval_code == "1234"
+    assert transaction.mti == "0200"
+    assert processor.host.threads == {processor.runtime.loop_thread}
+
+
+def test_async_path_serves_concurrent_callers_from_another_loop(processor, make_transaction):
+    transactions = [make_transaction(terminal_id=processor.terminal_id) for _ in range(20)]
+
+    async def process_all():
+        return await asyncio.gather(*(processor.process_transaction_async(t) for t in transactions))
+
+    results = asyncio.run(process_all())
+
+    assert [t.status for t in results] == [TransactionStatus.APPROVED] * 20
+    assert processor.host.threads == {processor.runtime.loop_thread}
+    # Host calls overlap instead of running one after another
+    assert processor.host.max_in_flight > 1
+
+
+def test_server_errors_are_retried(processor, make_transaction):
+    processor.host = StubHost((503, {}), (500, {}), (200, {"approved": True, "approval_code": "4321"}))
+    transaction = make_transaction(terminal_id=processor.terminal_id)
+
+    processor.process_transaction(transaction)
+
+    assert processor.host.calls == 3
+    assert transaction.status == TransactionStatus.APPROVED
+    assert transaction.approval_code == "4321"
+
+
+def test_retries_are_bounded(processor, make_transaction):
+    processor.host = StubHost((500, {}))
+    transaction = make_transaction(terminal_id=processor.terminal_id)
+
+    processor.process_transaction(transaction)
+
+    assert processor.host.calls == NETWORK_SETTINGS["retry_attempts"] + 1
+    assert transaction.status == TransactionStatus.ERROR
+    assert transaction.response_code == "E2002"
+
+
+def test_declines_are_not_retried(processor, make_transaction):
+    processor.host = StubHost((200, {"approved": False, "response_code": "51", "response_message": "Insufficient funds"}))
+    transaction = make_transaction(terminal_id=processor.terminal_id)
+
+    processor.process_transaction(transaction)
+
+    assert processor.host.calls == 1
+    assert transaction.status == TransactionStatus.DECLINED
+    assert (transaction.response_code, transaction.response_message) == ("51", "Insufficient funds")
+
+
+def test_offline_terminal_only_approves_off_ledger_protocols(processor, make_transaction, monkeypatch):
+    processor.is_online = False
+    # Keep the approval in the queue instead of syncing it to the stub host
+    monkeypatch.setattr(processor, "_start_offline_sync", lambda: None)
+    on_ledger = make_transaction(terminal_id=processor.terminal_id)
+    off_ledger = make_transaction(terminal_id=processor.terminal_id, protocol=PIN_LESS)
+
+    processor.process_transaction(on_ledger)
+    processor.process_transaction(off_ledger)
+
+    assert processor.host.calls == 0
+    assert (on_ledger.status, on_ledger.response_code) == (TransactionStatus.ERROR, "E1001")
+    assert off_ledger.status == TransactionStatus.OFFLINE_APPROVED
+    assert processor.offline_queue.qsize() == 1
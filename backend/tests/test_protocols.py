@@ -0,0 +1,141 @@
+"""
+Black Rock Payment Terminal - Protocol Validation Tests
+"""
+
+import random
+
+import pytest
+from pydantic import ValidationError
+
+from app.api.models import BulkValidationRequest
+from app.config import settings
+from app.protocols.bulk import (
+    APPROVAL_CODE_MAX_LENGTH, _code_points, luhn_valid, validate_approval_codes, validate_batch,
+    validate_card_numbers
+)
+from app.protocols.handler import get_protocol_handler
+
+PROTOCOLS = list(settings.PROTOCOLS)
+
+# ASCII digits and letters plus characters each validator must reject the same way:
+# Unicode digits and letters, punctuation, whitespace and a newline
+ALPHABET = "0123456789AZaz_-! \né١٢٣३１"
+
+EDGE_CASES = [
+    "",
+    "1234", "123456", "ABC123", "abc123",
+    "OF12", "OF1234", "of1234", "OFAB12",
+    "١٢٣٤",
+    "١٢٣٤٥٦",
+    "OF١٢٣٤",
+    "１２３４５６",
+    "12345é", "ABC12É",
+    "12345\n", "1234\n",
+    "12_456", "12 456",
+]
+
+
+def _random_codes(count: int, seed: int):
+    rng = random.Random(seed)
+    codes = []
+    for _ in range(count):
+        length = rng.choice([3, 4, 5, 6, 7])
+        prefix = "OF" if rng.random() < 0.2 else ""
+        codes.append(prefix + "".join(rng.choice(ALPHABET) for _ in range(max(length - len(prefix), 0))))
+    return codes
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_bulk_matches_handler(protocol):
+    handler = get_protocol_handler(protocol)
+    codes = EDGE_CASES + _random_codes(500, seed=len(protocol))
+    # Include codes the handler itself produces, online and offline
+    codes += [handler.generate_approval_code(is_offline=offline) for offline in (False, True) for _ in range(20)]
+
+    bulk = validate_approval_codes(codes, protocol)
+
+    assert [bool(valid) for valid in bulk] == [handler.validate_approval_code(code) for code in codes]
+
+
+def test_bulk_matches_handler_per_row_protocol():
+    codes = EDGE_CASES + _random_codes(500, seed=0)
+    rng = random.Random(1)
+    protocols = [rng.choice(PROTOCOLS) for _ in codes]
+
+    bulk = validate_approval_codes(codes, protocols)
+
+    expected = [get_protocol_handler(protocol).validate_approval_code(code) for code, protocol in zip(codes, protocols)]
+    assert [bool(valid) for valid in bulk] == expected
+
+
+@pytest.mark.parametrize("protocol", PROTOCOLS)
+def test_non_ascii_digits_rejected(protocol):
+    handler = get_protocol_handler(protocol)
+    code = "١" * handler.approval_length
+
+    assert not handler.validate_approval_code(code)
+    assert not validate_approval_codes([code], protocol)[0]
+
+
+VALID_PANS = [
+    "4111111111111111",  # Visa
+    "4012888888881881",
+    "5500005555555559",  # Mastercard
+    "378282246310005",  # Amex, 15 digits
+    "6011111111111117",  # Discover
+    "4222222222222",  # 13 digits
+    "6304000000000000000",  # 19 digits
+]
+
+INVALID_PANS = [
+    "4111111111111112",  # Wrong check digit
+    "5500005555555557",
+    "4111 1111 1111 1111",  # Not all digits
+    "41111111111111a1",
+    "٤١١١١١١١١١١١١١١١",  # Arabic-Indic digits
+    "",
+]
+
+
+def test_known_card_numbers():
+    mask = validate_card_numbers(VALID_PANS + INVALID_PANS)
+
+    assert mask.tolist() == [True] * len(VALID_PANS) + [False] * len(INVALID_PANS)
+    assert luhn_valid(VALID_PANS).all()
+    assert not luhn_valid(INVALID_PANS).any()
+
+
+def test_card_number_length_is_checked_besides_luhn():
+    too_short = "79927398713"  # Luhn valid, 11 digits
+    too_long = "4" + "0" * 18 + "4"  # Luhn valid, 20 digits
+
+    assert luhn_valid([too_short]).tolist() == [True]
+    assert validate_card_numbers([too_short, too_long]).tolist() == [False, False]
+
+
+def test_oversized_values_do_not_widen_the_matrix():
+    huge = "4" * 1_000_000
+    codes = ["1234", huge, "OF12"]
+
+    matrix, lengths = _code_points(codes, APPROVAL_CODE_MAX_LENGTH)
+
+    assert matrix.shape == (3, 4)
+    assert lengths.tolist() == [4, 1_000_000, 4]
+    assert validate_approval_codes(codes, PROTOCOLS[0]).tolist() == [True, False, False]
+    assert validate_card_numbers(["4111111111111111", huge]).tolist() == [True, False]
+
+
+def test_column_lengths_must_match():
+    with pytest.raises(ValueError):
+        validate_approval_codes(["1234", "5678"], PROTOCOLS[:1])
+    with pytest.raises(ValueError):
+        validate_batch(approval_codes=["1234"])
+
+
+def test_request_columns_are_bounded():
+    max_rows = settings.BULK_VALIDATION_SETTINGS["max_rows"]
+
+    assert len(BulkValidationRequest(card_numbers=["4111111111111111"] * max_rows).card_numbers) == max_rows
+    for column in ("approval_codes", "protocols", "card_numbers"):
+        with pytest.raises(ValidationError):
+            BulkValidationRequest(**{column: ["1"] * (max_rows + 1)})
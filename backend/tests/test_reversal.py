@@ -0,0 +1,110 @@
+"""
+Black Rock Payment Terminal - Timeout Reversal Tests
+"""
+
+import itertools
+
+import httpx
+import pytest
+
+from app.config.terminal import TerminalConfig
+from app.core.processor import TransactionProcessor
+from app.core.reversal import is_ambiguous, needs_reversal
+from app.core.transaction import TransactionStatus, TransactionType
+
+PIN_LESS = "POS Terminal -101.8 (PIN-LESS transaction)"
+
+_terminal_ids = (f"REV{number:05d}" for number in itertools.count())
+
+
+@pytest.mark.parametrize("error, ambiguous", [
+    (httpx.ReadTimeout("read"), True),
+    (httpx.ReadError("reset"), True),
+    (httpx.RemoteProtocolError("eof"), True),
+    (httpx.ConnectError("refused"), False),
+    (httpx.ConnectTimeout("connect"), False),
+    (httpx.PoolTimeout("pool"), False),
+])
+def test_only_errors_after_sending_are_ambiguous(error, ambiguous):
+    assert is_ambiguous(error) is ambiguous
+
+
+def test_balance_inquiries_are_not_reversed(make_transaction):
+    assert needs_reversal(make_transaction())
+    assert not needs_reversal(make_transaction(transaction_type=TransactionType.BALANCE_INQUIRY))
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """Processor whose host calls all fail with the error set on processor.host_error"""
+    terminal_id = next(_terminal_ids)
+    config = TerminalConfig("MERCHANT0000001", terminal_id, "http://127.0.0.1:1", heartbeat_interval=3600)
+    processor = TransactionProcessor(config.merchant_id, terminal_id, config.server_url, config=config)
+    processor.host_error = httpx.ReadTimeout("no response")
+
+    async def send_online(transaction, payload):
+        raise processor.host_error
+
+    monkeypatch.setattr(processor, "_send_online", send_online)
+    monkeypatch.setattr(processor, "_retry_delay", lambda retry_count: 0)
+    # Keep queued reversals in place instead of sending them to the unreachable host
+    monkeypatch.setattr(processor, "_start_reversals", lambda: None)
+    yield processor
+    processor.shutdown()
+
+
+def test_unanswered_on_ledger_transaction_is_reversed(processor, make_transaction):
+    transaction = make_transaction(terminal_id=processor.terminal_id)
+
+    processor.process_transaction(transaction)
+
+    assert transaction.status == TransactionStatus.TIMEOUT
+    assert transaction.response_code == "E2004"
+    assert processor.reversal_queue.qsize() == 1
+    assert [t.transaction_id for t in processor.reversal_queue.get_batch(10)] == [transaction.transaction_id]
+
+
+def test_unanswered_off_ledger_transaction_is_reversed_not_approved_offline(processor, make_transaction):
+    transaction = make_transaction(terminal_id=processor.terminal_id, protocol=PIN_LESS)
+
+    processor.process_transaction(transaction)
+
+    # An offline advice of the same sale could reach the host before its reversal
+    assert transaction.status == TransactionStatus.TIMEOUT
+    assert transaction.response_code == "E2004"
+    assert processor.reversal_queue.qsize() == 1
+    assert processor.offline_queue.empty()
+
+
+def test_unreachable_host_falls_back_offline_for_off_ledger_protocols(processor, make_transaction, monkeypatch):
+    processor.host_error = httpx.ConnectError("refused")
+    monkeypatch.setattr(processor, "_start_offline_sync", lambda: None)
+    transaction = make_transaction(terminal_id=processor.terminal_id, protocol=PIN_LESS)
+
+    processor.process_transaction(transaction)
+
+    assert transaction.status == TransactionStatus.OFFLINE_APPROVED
+    assert processor.reversal_queue.empty()
+    assert processor.offline_queue.qsize() == 1
+
+
+def test_unreachable_host_needs_no_reversal(processor, make_transaction):
+    processor.host_error = httpx.ConnectError("refused")
+    transaction = make_transaction(terminal_id=processor.terminal_id)
+
+    processor.process_transaction(transaction)
+
+    assert transaction.status == TransactionStatus.ERROR
+    assert transaction.response_code == "E2003"
+    assert processor.reversal_queue.empty()
+
+
+def test_unanswered_balance_inquiry_is_not_reversed(processor, make_transaction):
+    transaction = make_transaction(
+        terminal_id=processor.terminal_id, transaction_type=TransactionType.BALANCE_INQUIRY
+    )
+
+    processor.process_transaction(transaction)
+
+    assert transaction.response_code == "E2003"
+    assert processor.reversal_queue.empty()
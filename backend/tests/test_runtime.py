@@ -0,0 +1,211 @@
+"""
+Black Rock Payment Terminal - Processor Runtime Tests
+"""
+
+import asyncio
+import itertools
+import threading
+
+import pytest
+
+from app.config.terminal import TerminalConfig
+from app.core.registry import ProcessorRegistry
+from app.core.runtime import ProcessorRuntime, TimerWheel
+from app.core.workers import WorkerIdentity
+
+# Refuses connections, so heartbeats fail fast
+HOST_URL = "http://127.0.0.1:1"
+
+_terminal_ids = (f"REG{number:05d}" for number in itertools.count())
+
+
+def make_wheel(wheel_size: int = 8) -> TimerWheel:
+    # Ticks are driven by hand through _fire; the loop is never run
+    return TimerWheel(loop=None, tick_interval=0.1, wheel_size=wheel_size)
+
+
+def advance(wheel: TimerWheel, ticks: int) -> None:
+    for _ in range(ticks):
+        wheel._tick += 1
+        wheel._fire(wheel._tick)
+
+
+def test_timers_fire_at_their_tick():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(0.1, lambda: fired.append("first"))
+    wheel.schedule(0.25, lambda: fired.append("third"))
+    wheel.schedule(0.2, lambda: fired.append("second"))
+
+    advance(wheel, 1)
+    assert fired == ["first"]
+    advance(wheel, 2)
+    assert fired == ["first", "second", "third"]
+    assert wheel.scheduled == 0
+
+
+def test_zero_delay_fires_on_the_next_tick():
+    wheel = make_wheel()
+    fired = []
+    wheel.schedule(0, lambda: fired.append(wheel._tick))
+
+    advance(wheel, 2)
+
+    assert fired == [1]
+
+
+def test_cancelled_timers_do_not_fire():
+    wheel = make_wheel()
+    fired = []
+    handle = wheel.schedule(0.3, lambda: fired.append("cancelled"))
+    wheel.schedule(0.3, lambda: fired.append("kept"))
+
+    handle.cancel()
+    advance(wheel, 3)
+
+    assert fired == ["kept"]
+    assert wheel.scheduled == 0
+
+
+def test_timers_beyond_one_revolution_wait_for_their_round():
+    wheel = make_wheel(wheel_size=4)
+    fired = []
+    wheel.schedule(1.0, lambda: fired.append(wheel._tick))
+
+    advance(wheel, 9)
+    assert fired == []
+    advance(wheel, 1)
+    assert fired == [10]
+
+
+def test_callbacks_can_reschedule_and_errors_are_contained():
+    wheel = make_wheel()
+    fired = []
+
+    def periodic():
+        fired.append(wheel._tick)
+        if len(fired) < 3:
+            wheel.schedule(0.2, periodic)
+
+    def broken():
+        raise RuntimeError("boom")
+
+    wheel.schedule(0.1, broken)
+    wheel.schedule(0.1, periodic)
+    advance(wheel, 10)
+
+    assert fired == [1, 3, 5]
+
+
+def test_runtime_runs_the_wheel_on_its_loop():
+    runtime = ProcessorRuntime()
+    fired = threading.Event()
+    try:
+        def schedule():
+            assert runtime.in_loop()
+            runtime.wheel.schedule(0.05, fired.set)
+
+        runtime.call_soon(schedule)
+        assert fired.wait(timeout=5)
+
+        async def on_loop():
+            return asyncio.get_running_loop()
+
+        assert asyncio.run_coroutine_threadsafe(on_loop(), runtime.loop).result(timeout=5) is runtime.loop
+    finally:
+        runtime.shutdown()
+
+
+def terminal(server_url: str = HOST_URL) -> TerminalConfig:
+    return TerminalConfig("MERCHANT0000001", next(_terminal_ids), server_url, heartbeat_interval=3600)
+
+
+@pytest.fixture
+def registry():
+    registry = ProcessorRegistry()
+    yield registry
+    registry.shutdown()
+
+
+def test_registry_shares_one_runtime_between_terminals(registry):
+    first = registry.register(terminal())
+    second = registry.register(terminal())
+    elsewhere = registry.register(terminal("http://127.0.0.1:2"))
+
+    assert len(registry) == 3
+    assert first.runtime is second.runtime is elsewhere.runtime is registry.runtime
+    assert first.loop is registry.runtime.loop
+    # One pooled transport per host
+    assert first.transport is second.transport
+    assert elsewhere.transport is not first.transport
+    assert len(registry.get_stats()["transports"]) == 2
+
+
+def test_registering_a_terminal_again_returns_its_processor(registry):
+    config = terminal()
+    processor = registry.register(config)
+
+    assert registry.register(config) is processor
+    assert len(registry) == 1
+    assert config.terminal_id in registry
+
+
+def test_lookup_and_default_terminal(registry):
+    first = registry.register(terminal())
+    second = registry.register(terminal())
+
+    assert registry.get() is first
+    assert registry.get(second.terminal_id) is second
+    assert registry.get("UNKNOWN") is None
+    assert registry.terminal_ids() == [first.terminal_id, second.terminal_id]
+
+    registry.unregister(first.terminal_id)
+
+    # The default moves to a remaining terminal
+    assert registry.get() is second
+    assert first.terminal_id not in registry
+    assert first.stop_threads.is_set()
+
+
+def test_unregistering_the_last_terminal_clears_the_default(registry):
+    processor = registry.register(terminal())
+
+    registry.unregister(processor.terminal_id)
+    registry.unregister(processor.terminal_id)
+
+    assert registry.default_terminal_id is None
+    assert registry.get() is None
+
+
+def test_single_worker_owns_every_terminal(registry):
+    processors = [registry.register(terminal()) for _ in range(5)]
+
+    assert all(processor.owner for processor in processors)
+    assert registry.get_stats()["terminals_owned"] == 5
+
+
+def test_worker_owns_only_its_share_of_terminals(tmp_path):
+    worker = WorkerIdentity(2, str(tmp_path / "run"))
+    registry = ProcessorRegistry(worker=worker)
+    try:
+        processors = [registry.register(terminal()) for _ in range(8)]
+
+        assert [processor.owner for processor in processors] == [
+            worker.owns(processor.terminal_id) for processor in processors
+        ]
+        stats = registry.get_stats()
+        assert (stats["worker_slot"], stats["worker_count"]) == (worker.slot, 2)
+        assert stats["terminals_owned"] == sum(processor.owner for processor in processors)
+    finally:
+        registry.shutdown()
+
+
+def test_shutdown_stops_every_processor_and_the_runtime():
+    registry = ProcessorRegistry()
+    processors = [registry.register(terminal()) for _ in range(3)]
+
+    registry.shutdown()
+
+    assert len(registry) == 0
+    assert all(processor.stop_threads.is_set() for processor in processors)
+    assert not registry.runtime.loop_thread.is_alive()
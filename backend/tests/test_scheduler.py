@@ -0,0 +1,141 @@
+"""
+Black Rock Payment Terminal - Processor Scheduler Tests
+"""
+
+import time
+import asyncio
+import itertools
+import threading
+
+import httpx
+import pytest
+
+from app.config.terminal import TerminalConfig
+from app.core.processor import ProcessorScheduler, TransactionProcessor
+from app.core.runtime import ProcessorRuntime
+
+HOST_URL = "http://acquirer.test"
+PIN_LESS = "POS Terminal -101.8 (PIN-LESS transaction)"
+
+_terminal_ids = (f"SCH{number:05d}" for number in itertools.count())
+
+
+@pytest.fixture
+def runtime():
+    runtime = ProcessorRuntime()
+    yield runtime
+    runtime.shutdown()
+
+
+def on_loop(runtime: ProcessorRuntime, coroutine):
+    return asyncio.run_coroutine_threadsafe(coroutine, runtime.loop).result(timeout=5)
+
+
+def test_wake_from_another_thread_ends_the_wait_at_once(runtime):
+    scheduler = ProcessorScheduler(runtime, heartbeat_interval=3600)
+
+    async def wait():
+        event = asyncio.Event()
+        threading.Timer(0.05, scheduler.wake, args=(event,)).start()
+        started = time.monotonic()
+        await scheduler.wait_for_work(event, timeout=30)
+        return time.monotonic() - started, event.is_set()
+
+    waited, still_set = on_loop(runtime, wait())
+
+    assert waited < 1.0
+    # The event is cleared so the next wait sleeps again
+    assert not still_set
+
+
+def test_wait_ends_after_the_timeout_without_a_wakeup(runtime):
+    scheduler = ProcessorScheduler(runtime, heartbeat_interval=3600)
+
+    async def wait():
+        started = time.monotonic()
+        await scheduler.wait_for_work(asyncio.Event(), timeout=0.2)
+        return time.monotonic() - started
+
+    assert 0.15 <= on_loop(runtime, wait()) < 1.0
+    assert runtime.wheel.scheduled == 0
+
+
+def test_heartbeats_are_suppressed_while_the_host_is_live(runtime):
+    scheduler = ProcessorScheduler(runtime, heartbeat_interval=0.3)
+    heartbeats = []
+
+    async def heartbeat():
+        heartbeats.append(time.monotonic())
+        scheduler.record_liveness()
+
+    scheduler.record_liveness()
+    scheduler.start_heartbeats(heartbeat)
+    try:
+        # Host traffic every 100ms keeps the link live
+        for _ in range(10):
+            time.sleep(0.1)
+            scheduler.record_liveness()
+        assert heartbeats == []
+        assert scheduler.heartbeats_suppressed > 0
+
+        # Once traffic stops a heartbeat follows within one interval
+        silent_since = time.monotonic()
+        time.sleep(0.6)
+        assert heartbeats
+        assert heartbeats[0] - silent_since < 0.3 + 0.15
+    finally:
+        scheduler.stop()
+
+
+def test_heartbeat_delay_counts_from_the_last_exchange(runtime):
+    scheduler = ProcessorScheduler(runtime, heartbeat_interval=10)
+
+    # Nothing exchanged yet: due now
+    assert scheduler.heartbeat_delay() == 0.0
+    scheduler.record_liveness()
+    assert 9.9 < scheduler.heartbeat_delay() <= 10
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """Processor whose host approves payments and accepts every synced transaction"""
+    terminal_id = next(_terminal_ids)
+    config = TerminalConfig("MERCHANT0000001", terminal_id, HOST_URL, heartbeat_interval=3600)
+    processor = TransactionProcessor(config.merchant_id, terminal_id, config.server_url, config=config)
+
+    def host(request: httpx.Request) -> httpx.Response:
+        if request.url.path == "/sync_offline":
+            transactions = processor.transport.hosts[0].codec.decode(request.content)["transactions"]
+            results = [{"transaction_id": t["transaction_id"], "status": "success"} for t in transactions]
+            return httpx.Response(200, json={"results": results})
+        return httpx.Response(200, json={"approved": True, "approval_code": "1234"})
+
+    for transport in processor.transport.hosts:
+        transport._async_client = httpx.AsyncClient(transport=httpx.MockTransport(host))
+    yield processor
+    processor.shutdown()
+
+
+def test_successful_payment_counts_as_liveness(processor, make_transaction):
+    processor.scheduler.last_liveness = 0.0
+
+    processor.process_transaction(make_transaction(terminal_id=processor.terminal_id))
+
+    assert processor.scheduler.heartbeat_delay() > 3500
+
+
+def test_reconnection_drains_the_offline_queue_without_waiting_for_the_poll(processor, make_transaction):
+    processor.is_online = False
+    transaction = make_transaction(terminal_id=processor.terminal_id, protocol=PIN_LESS)
+    processor.process_transaction(transaction)
+    assert processor.offline_queue.qsize() == 1
+    # Give the engine time to go idle on its 30s poll interval
+    time.sleep(0.2)
+
+    started = time.monotonic()
+    processor.runtime.call_soon(processor._handle_online_mode)
+    while not processor.offline_queue.empty():
+        assert time.monotonic() - started < 2.0, "sync engine was not woken"
+        time.sleep(0.01)
+
+    assert processor.sync_engine.get_stats()["items_synced"] == 1
@@ -0,0 +1,134 @@
+"""
+Black Rock Payment Terminal - Batch Settlement Tests
+"""
+
+import time
+import threading
+
+import pytest
+
+from app.core.settlement import SettlementLedger, SettlementStore
+from app.core.stan import TraceNumberAllocator
+from app.core.transaction import TransactionStatus, TransactionType
+
+
+@pytest.fixture
+def stores(tmp_path):
+    opened = []
+
+    def open_stores(worker_id: str = None, shared: bool = False):
+        store = SettlementStore(str(tmp_path / "settlement.db"), flush_interval=0.05, shared=shared)
+        if worker_id is not None:
+            store.worker_id = worker_id
+        allocator = TraceNumberAllocator(str(tmp_path / "stan_state.db"), batch_refresh_interval=0)
+        opened.append((store, allocator))
+        return store, allocator
+
+    yield open_stores
+    for store, allocator in opened:
+        store.close()
+        allocator.close()
+
+
+def complete(ledger, transaction, status=TransactionStatus.APPROVED):
+    transaction.update_status(status)
+    ledger.record(transaction)
+
+
+def close_in_background(ledger):
+    result = {}
+    thread = threading.Thread(target=lambda: result.setdefault("advice", ledger.close_batch()))
+    thread.start()
+    return thread, result
+
+
+def test_close_totals_by_side(stores, make_transaction):
+    store, allocator = stores()
+    ledger = SettlementLedger("T1", "M1", store=store, allocator=allocator)
+    for amount, transaction_type, status in (
+        (10.00, TransactionType.SALE, TransactionStatus.APPROVED),
+        (2.50, TransactionType.SALE, TransactionStatus.OFFLINE_APPROVED),
+        (4.00, TransactionType.REFUND, TransactionStatus.APPROVED),
+        (99.00, TransactionType.SALE, TransactionStatus.DECLINED),
+    ):
+        transaction = make_transaction(amount=amount, terminal_id="T1", transaction_type=transaction_type)
+        ledger.begin(transaction)
+        complete(ledger, transaction, status)
+
+    advice = ledger.close_batch()
+
+    usd = advice["currencies"]["USD"]
+    assert advice["transaction_count"] == 4
+    assert (usd["debits_number"], usd["debits_amount"]) == (2, 1250)
+    assert (usd["credits_number"], usd["credits_amount"]) == (1, 400)
+    assert usd["net_settlement_amount"] == 850
+
+
+def test_close_waits_for_in_flight_transactions(stores, make_transaction):
+    store, allocator = stores()
+    ledger = SettlementLedger("T1", "M1", store=store, allocator=allocator, drain_timeout=5)
+    done = make_transaction(amount=10, terminal_id="T1")
+    in_flight = make_transaction(amount=20, terminal_id="T1")
+    ledger.begin(done)
+    complete(ledger, done)
+    ledger.begin(in_flight)
+    closed_batch = in_flight.batch_number
+
+    thread, result = close_in_background(ledger)
+    time.sleep(0.2)
+    assert thread.is_alive()
+
+    # Transactions started after the close go to the next batch
+    later = make_transaction(amount=40, terminal_id="T1")
+    ledger.begin(later)
+    assert later.batch_number == closed_batch + 1
+
+    complete(ledger, in_flight)
+    thread.join(timeout=5)
+
+    advice = result["advice"]
+    assert advice["batch_number"] == closed_batch
+    assert advice["transaction_count"] == 2
+    assert advice["currencies"]["USD"]["debits_amount"] == 3000
+    assert ledger.late_transactions == 0
+
+
+def test_close_gives_up_after_drain_timeout(stores, make_transaction):
+    store, allocator = stores()
+    ledger = SettlementLedger("T1", "M1", store=store, allocator=allocator, drain_timeout=0.1)
+    stuck = make_transaction(amount=20, terminal_id="T1")
+    ledger.begin(stuck)
+
+    advice = ledger.close_batch()
+    complete(ledger, stuck)
+
+    assert advice["transaction_count"] == 0
+    assert ledger.late_transactions == 1
+    # The late transaction is still kept with its batch
+    store.flush()
+    assert sum(count for count, _ in store.load("T1", advice["batch_number"]).values()) == 1
+
+
+def test_close_waits_for_other_workers(stores, make_transaction):
+    store_a, allocator_a = stores("worker-a", shared=True)
+    store_b, allocator_b = stores("worker-b", shared=True)
+    closing = SettlementLedger("T1", "M1", store=store_a, allocator=allocator_a, drain_timeout=5)
+    other = SettlementLedger("T1", "M1", store=store_b, allocator=allocator_b, drain_timeout=5)
+    closing.shared = other.shared = True
+
+    in_flight = make_transaction(amount=15, terminal_id="T1")
+    other.begin(in_flight)
+    # The other worker's fence for the open batch is committed
+    store_b.flush()
+
+    thread, result = close_in_background(closing)
+    time.sleep(0.3)
+    assert thread.is_alive()
+
+    complete(other, in_flight)
+    thread.join(timeout=5)
+
+    advice = result["advice"]
+    assert advice["batch_number"] == in_flight.batch_number
+    assert advice["transaction_count"] == 1
+    assert advice["currencies"]["USD"]["debits_amount"] == 1500
@@ -0,0 +1,85 @@
+"""
+Black Rock Payment Terminal - Trace Number Allocation Tests
+"""
+
+import threading
+
+import pytest
+
+from app.core.stan import TraceNumberAllocator, format_trace_number
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "stan_state.db")
+
+
+def test_format_cycles_through_six_digits():
+    assert format_trace_number(0) == "000001"
+    assert format_trace_number(999998) == "999999"
+    assert format_trace_number(999999) == "000001"
+
+
+def test_blocks_are_reserved_once_per_block_size(path):
+    allocator = TraceNumberAllocator(path, block_size=10)
+
+    trace_numbers = [allocator.next_trace_number("T1") for _ in range(25)]
+
+    assert trace_numbers == [format_trace_number(sequence) for sequence in range(25)]
+    assert allocator.get_stats()["blocks_reserved"] == 3
+    allocator.close()
+
+
+def test_terminals_have_their_own_sequences(path):
+    allocator = TraceNumberAllocator(path, block_size=10)
+
+    assert allocator.next_trace_number("T1") == "000001"
+    assert allocator.next_trace_number("T2") == "000001"
+    assert allocator.next_trace_number("T1") == "000002"
+    allocator.close()
+
+
+def test_restart_skips_the_unused_rest_of_a_block(path):
+    first = TraceNumberAllocator(path, block_size=10)
+    used = [first.next_trace_number("T1") for _ in range(3)]
+    first.close()
+
+    second = TraceNumberAllocator(path, block_size=10)
+    after_restart = second.next_trace_number("T1")
+    second.close()
+
+    assert used == ["000001", "000002", "000003"]
+    assert after_restart == "000011"
+
+
+def test_workers_sharing_a_file_never_hand_out_the_same_number(path):
+    allocators = [TraceNumberAllocator(path, block_size=7) for _ in range(3)]
+    allocated = []
+    lock = threading.Lock()
+
+    def allocate(allocator):
+        numbers = [allocator.next_trace_number("T1") for _ in range(200)]
+        with lock:
+            allocated.extend(numbers)
+
+    threads = [threading.Thread(target=allocate, args=(allocator,)) for allocator in allocators for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(allocated) == 1200
+    assert len(set(allocated)) == 1200
+    for allocator in allocators:
+        allocator.close()
+
+
+def test_batch_close_is_seen_by_other_workers(path):
+    closing = TraceNumberAllocator(path, batch_refresh_interval=0)
+    other = TraceNumberAllocator(path, batch_refresh_interval=0)
+    opened = closing.batch_number("T1")
+
+    assert closing.close_batch("T1") == (opened, opened + 1)
+    assert other.batch_number("T1") == opened + 1
+    closing.close()
+    other.close()
@@ -0,0 +1,189 @@
+"""
+Black Rock Payment Terminal - Offline Synchronization Tests
+"""
+
+import time
+import asyncio
+import itertools
+from collections import defaultdict
+
+import httpx
+import pytest
+
+from app.config.settings import OFFLINE_SYNC_SETTINGS
+from app.config.terminal import TerminalConfig
+from app.core.offline_queue import OfflineQueue, OfflineQueueStore
+from app.core.processor import TransactionProcessor
+from app.core.sync import OfflineSyncEngine
+from app.utils.codec import get_codec
+
+HOST_URL = "http://acquirer.test"
+
+_terminal_ids = (f"SYN{number:05d}" for number in itertools.count())
+
+
+class SyncHost:
+    """
+    Answers /sync_offline, rejecting each transaction ID in reject[id] that
+    many times before accepting it; every other request succeeds
+    """
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.reject = {}
+        self.sent = defaultdict(list)
+        self.batch_sizes = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path != "/sync_offline":
+            return httpx.Response(200, json={})
+        payload = get_codec(request.headers.get("content-type")).decode(request.content)
+        self.batch_sizes.append(len(payload["transactions"]))
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(self.delay)
+        finally:
+            self.in_flight -= 1
+
+        results = []
+        for transaction in payload["transactions"]:
+            transaction_id = transaction["transaction_id"]
+            self.sent[transaction_id].append(time.monotonic())
+            if self.reject.get(transaction_id, 0) >= len(self.sent[transaction_id]):
+                results.append({"transaction_id": transaction_id, "status": "error", "message": "Retry later"})
+            else:
+                results.append({"transaction_id": transaction_id, "status": "success"})
+        return httpx.Response(200, json={"results": results})
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    """Online processor whose host is processor.host; its own sync engine stays idle"""
+    terminal_id = next(_terminal_ids)
+    config = TerminalConfig("MERCHANT0000001", terminal_id, HOST_URL, heartbeat_interval=3600)
+    processor = TransactionProcessor(config.merchant_id, terminal_id, config.server_url, config=config)
+    processor.host = SyncHost()
+    for host in processor.transport.hosts:
+        host._async_client = httpx.AsyncClient(transport=httpx.MockTransport(lambda request: processor.host(request)))
+    monkeypatch.setattr(processor, "_start_offline_sync", lambda: None)
+    yield processor
+    processor.shutdown()
+
+
+@pytest.fixture
+def make_engine(processor, tmp_path):
+    """Factory for engines draining a private queue of the processor's terminal"""
+    store = OfflineQueueStore(str(tmp_path / "offline_queue.db"))
+    engines = []
+
+    def make(**settings) -> OfflineSyncEngine:
+        queue = OfflineQueue(processor.terminal_id, store)
+        engine = OfflineSyncEngine(processor, queue, dict(OFFLINE_SYNC_SETTINGS, **settings))
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        engine.stop()
+    store.close()
+
+
+def enqueue(engine: OfflineSyncEngine, make_transaction, count: int):
+    transactions = [make_transaction(terminal_id=engine.processor.terminal_id, is_online=False) for _ in range(count)]
+    for transaction in transactions:
+        engine.queue.put(transaction)
+    return transactions
+
+
+def drain(engine: OfflineSyncEngine, timeout: float = 5.0) -> None:
+    engine.start()
+    deadline = time.monotonic() + timeout
+    while not engine.queue.empty() or engine.get_stats()["inflight_batches"]:
+        assert time.monotonic() < deadline, "offline queue was not drained"
+        time.sleep(0.01)
+
+
+def test_batch_size_grows_additively_and_halves_on_failure(make_engine):
+    engine = make_engine(batch_size=20, min_batch_size=4, max_batch_size=45, batch_size_step=10,
+                         target_batch_latency=1.0)
+
+    engine._adapt(0.5)
+    engine._adapt(1.0)
+    assert engine.batch_size == 40
+    engine._adapt(0.1)
+    assert engine.batch_size == 45
+
+    # A slow batch and a failed one each halve it, down to the floor
+    engine._adapt(1.5)
+    assert engine.batch_size == 22
+    engine._adapt(None)
+    engine._adapt(None)
+    engine._adapt(None)
+    assert engine.batch_size == 4
+
+
+def test_fast_batches_grow_the_batch_size(processor, make_engine, make_transaction):
+    engine = make_engine(batch_size=2, batch_size_step=2, max_parallel_batches=1)
+    enqueue(engine, make_transaction, 20)
+
+    drain(engine)
+
+    # Each batch leases batch_size items after the previous batch grew it
+    assert processor.host.batch_sizes == [2, 4, 6, 8]
+    assert engine.get_stats()["items_synced"] == 20
+
+
+def test_failed_batch_halves_the_batch_size_and_is_retried(processor, make_engine, make_transaction, monkeypatch):
+    engine = make_engine(batch_size=8, max_parallel_batches=1)
+    transactions = enqueue(engine, make_transaction, 8)
+    # All items become due again together
+    monkeypatch.setattr("app.core.sync.backoff_delay", lambda attempt, base_delay, max_delay: 0.05)
+    original = engine._send
+    calls = itertools.count()
+
+    async def send(batch):
+        if next(calls) == 0:
+            raise httpx.HTTPError("HTTP 503")
+        return await original(batch)
+
+    engine._send = send
+
+    drain(engine)
+
+    assert engine.stats["batches_failed"] == 1
+    assert engine.stats["items_retried"] == 8
+    # The host never saw the failed batch; the retry went out in halved batches
+    assert processor.host.batch_sizes == [4, 4]
+    assert set(processor.host.sent) == {t.transaction_id for t in transactions}
+
+
+def test_rejected_items_are_retried_with_backoff(processor, make_engine, make_transaction):
+    engine = make_engine(retry_base_delay=0.2, retry_max_delay=1.0)
+    transactions = enqueue(engine, make_transaction, 5)
+    rejected, other = transactions[1].transaction_id, transactions[3].transaction_id
+    processor.host.reject = {rejected: 2, other: 1}
+
+    drain(engine)
+
+    sent = processor.host.sent
+    assert [len(sent[t.transaction_id]) for t in transactions] == [1, 3, 1, 2, 1]
+    # Jittered exponential backoff: at least half of 0.2s, then half of 0.4s
+    first, second, third = sent[rejected]
+    assert second - first >= 0.1
+    assert third - second >= 0.2
+    assert engine.stats["items_retried"] == 3
+    assert engine.stats["items_synced"] == 5
+
+
+def test_parallel_batches_are_bounded(processor, make_engine, make_transaction):
+    engine = make_engine(batch_size=1, batch_size_step=0, max_parallel_batches=3)
+    processor.host.delay = 0.05
+    enqueue(engine, make_transaction, 12)
+
+    drain(engine)
+
+    assert processor.host.max_in_flight == 3
+    assert processor.host.batch_sizes == [1] * 12
@@ -0,0 +1,88 @@
+"""
+Black Rock Payment Terminal - Transaction Model Tests
+"""
+
+import pytest
+
+from app.core.transaction import Transaction, TransactionStatus
+
+
+def test_to_dict_is_cached_until_the_transaction_changes(make_transaction):
+    transaction = make_transaction()
+    first = transaction.to_dict()
+
+    assert transaction.to_dict() is first
+
+    transaction.update_status(TransactionStatus.DECLINED, "51", "Insufficient funds")
+    updated = transaction.to_dict()
+
+    assert updated is not first
+    assert (updated["status"], updated["response_code"], updated["response_message"]) == (
+        "DECLINED", "51", "Insufficient funds"
+    )
+    assert first["status"] == "INITIALIZED"
+
+
+def test_batch_number_assignment_rebuilds_the_dict(make_transaction):
+    transaction = make_transaction()
+    before = transaction.to_dict()
+
+    transaction.batch_number = "000042"
+
+    assert transaction.to_dict() is not before
+    assert transaction.to_dict()["batch_number"] == "000042"
+
+
+def test_card_data_is_not_serialized(make_transaction):
+    transaction = make_transaction()
+    before = transaction.to_dict()
+
+    transaction.set_card_data({"pan": "4111111111111111"})
+
+    assert transaction.to_dict() is before
+    assert "card_data" not in before
+
+
+def test_transactions_have_no_instance_dict(make_transaction):
+    transaction = make_transaction()
+
+    assert not hasattr(transaction, "__dict__")
+    with pytest.raises(AttributeError):
+        transaction.unknown = 1
+
+
+def test_from_dict_round_trips(make_transaction):
+    transaction = make_transaction(amount=12.5, currency="EUR")
+    transaction.set_mti("0200")
+    transaction.set_approval_code("1234")
+    data = dict(transaction.to_dict())
+
+    restored = Transaction.from_dict(data)
+
+    assert restored.to_dict() == data
+    assert restored.timestamp == transaction.timestamp
+    assert (restored.status, restored.transaction_type, restored.payment_method) == (
+        transaction.status, transaction.transaction_type, transaction.payment_method
+    )
+    assert restored.card_data == {}
+
+
+def test_restored_transaction_rebuilds_its_dict_after_changes(make_transaction):
+    restored = Transaction.from_dict(make_transaction().to_dict())
+    before = restored.to_dict()
+
+    restored.update_status(TransactionStatus.ERROR, "E2002")
+
+    assert restored.to_dict() is not before
+    assert restored.to_dict()["status"] == "ERROR"
+    assert restored.to_dict()["response_code"] == "E2002"
+
+
+def test_from_dict_keeps_the_stored_trace_number(make_transaction):
+    data = make_transaction().to_dict()
+
+    restored = Transaction.from_dict(data)
+
+    # No new number is allocated for a restored transaction
+    assert restored.trace_number == data["trace_number"]
+    assert restored.batch_number == data["batch_number"]
@@ -0,0 +1,282 @@
+"""
+Black Rock Payment Terminal - Host Transport Tests
+"""
+
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from app.config.settings import NETWORK_SETTINGS
+from app.config.terminal import TerminalConfig
+from app.core.breaker import CircuitBreaker, CircuitState
+from app.core.processor import TransactionProcessor
+from app.core.transaction import TransactionType
+from app.core.transport import FailoverTransport, HostUnavailableError
+
+PRIMARY = "http://primary.test"
+BACKUP = "http://backup.test"
+
+# Opens after 3 calls at a 50% failure rate; probes after 50ms
+FAST_BREAKER = {"min_requests": 3, "failure_rate_threshold": 0.5, "open_timeout": 0.05, "window_size": 10}
+
+
+class StubHosts:
+    """
+    Payment hosts behind one MockTransport
+
+    behaviour maps a host name to "ok", "error" (HTTP 500), "refuse"
+    (connect error), "timeout" (read timeout) or a delay in seconds.
+    """
+
+    def __init__(self, **behaviour):
+        self.behaviour = {"primary.test": "ok", "backup.test": "ok"}
+        self.behaviour.update({f"{name}.test": value for name, value in behaviour.items()})
+        self.calls = []
+        self.cancelled = []
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        self.calls.append((host, time.monotonic()))
+        behaviour = self.behaviour[host]
+        if behaviour == "refuse":
+            raise httpx.ConnectError("refused", request=request)
+        if behaviour == "timeout":
+            raise httpx.ReadTimeout("no response", request=request)
+        if behaviour == "error":
+            return httpx.Response(500, json={})
+        if behaviour != "ok":
+            try:
+                await asyncio.sleep(behaviour)
+            except asyncio.CancelledError:
+                self.cancelled.append(host)
+                raise
+        return httpx.Response(200, json={"host": host})
+
+    def hosts_called(self):
+        return [host.split(".")[0] for host, _ in self.calls]
+
+
+def make_transport(hosts: StubHosts, breaker_settings=None) -> FailoverTransport:
+    transport = FailoverTransport(PRIMARY, BACKUP)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(hosts))
+    for host in transport.hosts:
+        host._async_client = client
+        transport.breakers[host.base_url] = CircuitBreaker(host.base_url, breaker_settings or FAST_BREAKER)
+    return transport
+
+
+def post(transport: FailoverTransport, times: int = 1):
+    async def send():
+        responses = []
+        for _ in range(times):
+            responses.append(await transport.apost("/process", {"amount": 1}))
+        return responses
+
+    return asyncio.run(send())
+
+
+def test_breaker_opens_probes_and_closes():
+    breaker = CircuitBreaker("host", FAST_BREAKER)
+    breaker.record_success(0.01)
+    breaker.record_failure(0.01)
+    assert breaker.state == CircuitState.CLOSED
+
+    breaker.record_failure(0.01)
+
+    assert breaker.state == CircuitState.OPEN
+    assert not breaker.allow_request()
+    time.sleep(0.06)
+    # One probe is let through while half-open
+    assert breaker.allow_request()
+    assert breaker.state == CircuitState.HALF_OPEN
+    assert not breaker.allow_request()
+
+    breaker.record_success(0.01)
+
+    assert breaker.state == CircuitState.CLOSED
+    assert breaker.allow_request()
+    assert breaker.failure_rate() == 0.0
+
+
+def test_failed_probe_reopens_the_circuit():
+    breaker = CircuitBreaker("host", FAST_BREAKER)
+    for _ in range(3):
+        breaker.record_failure(0.01)
+    time.sleep(0.06)
+    assert breaker.allow_request()
+
+    breaker.record_failure(0.01)
+
+    assert breaker.state == CircuitState.OPEN
+    assert breaker.times_opened == 2
+    assert not breaker.allow_request()
+
+
+def test_slow_calls_count_as_failures():
+    breaker = CircuitBreaker("host", dict(FAST_BREAKER, slow_call_threshold=0.5))
+    for _ in range(3):
+        breaker.record_success(1.0)
+
+    assert breaker.state == CircuitState.OPEN
+
+
+def test_refused_connection_fails_over_within_the_call():
+    hosts = StubHosts(primary="refuse")
+    transport = make_transport(hosts)
+
+    [response] = post(transport)
+
+    assert response.json() == {"host": "backup.test"}
+    assert hosts.hosts_called() == ["primary", "backup"]
+    assert transport.active_host == BACKUP
+
+
+def test_open_circuit_sends_traffic_to_the_backup_then_fails_back():
+    hosts = StubHosts(primary="error")
+    transport = make_transport(hosts)
+
+    # 5xx answers are returned to the caller but open the primary's circuit
+    assert [response.status_code for response in post(transport, 3)] == [500] * 3
+    assert transport.breakers[PRIMARY].state == CircuitState.OPEN
+
+    hosts.calls.clear()
+    assert post(transport)[0].json() == {"host": "backup.test"}
+    assert hosts.hosts_called() == ["backup"]
+    assert transport.active_host == BACKUP
+
+    # After open_timeout a probe goes to the recovered primary and closes its circuit
+    hosts.behaviour["primary.test"] = "ok"
+    time.sleep(0.06)
+    hosts.calls.clear()
+    assert post(transport)[0].json() == {"host": "primary.test"}
+    assert transport.breakers[PRIMARY].state == CircuitState.CLOSED
+    assert transport.active_host == PRIMARY
+
+
+def test_unanswered_request_is_not_sent_to_the_backup():
+    hosts = StubHosts(primary="timeout")
+    transport = make_transport(hosts)
+
+    # The primary may have processed it, so it is not repeated elsewhere
+    with pytest.raises(httpx.ReadTimeout):
+        post(transport)
+
+    assert hosts.hosts_called() == ["primary"]
+
+
+def test_no_available_host():
+    hosts = StubHosts(primary="refuse", backup="refuse")
+    transport = make_transport(hosts)
+
+    with pytest.raises(HostUnavailableError):
+        post(transport)
+    for _ in range(3):
+        with pytest.raises(HostUnavailableError):
+            post(transport)
+
+    # Both circuits are open now: the hosts are not even tried
+    hosts.calls.clear()
+    with pytest.raises(HostUnavailableError):
+        post(transport)
+    assert hosts.calls == []
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """Hedge after 100ms until the primary has enough latency samples"""
+    monkeypatch.setitem(NETWORK_SETTINGS, "hedge_min_delay", 0.01)
+    monkeypatch.setitem(NETWORK_SETTINGS, "hedge_max_delay", 0.1)
+    monkeypatch.setitem(NETWORK_SETTINGS, "hedge_min_samples", 20)
+
+
+def post_hedged(transport: FailoverTransport) -> httpx.Response:
+    async def send():
+        response = await transport.apost_hedged("/process", {"amount": 1})
+        # Let cancelled requests finish unwinding
+        await asyncio.sleep(0.01)
+        return response
+
+    return asyncio.run(send())
+
+
+def test_hedge_delay_follows_the_primary_latency(hedging):
+    transport = make_transport(StubHosts())
+    primary = transport.hosts[0]
+    histogram = transport.latencies[PRIMARY]
+
+    # Too few samples: the upper bound
+    assert transport.hedge_delay(primary) == 0.1
+    for _ in range(20):
+        histogram.record(0.03)
+    assert 0.03 <= transport.hedge_delay(primary) <= 0.03 * 1.25
+    for _ in range(20):
+        histogram.record(5.0)
+    assert transport.hedge_delay(primary) == 0.1
+
+
+def test_fast_primary_is_not_hedged(hedging):
+    hosts = StubHosts()
+    transport = make_transport(hosts)
+
+    assert post_hedged(transport).json() == {"host": "primary.test"}
+    assert hosts.hosts_called() == ["primary"]
+    assert transport.hedges_sent == 0
+
+
+def test_slow_primary_is_hedged_after_the_delay(hedging):
+    hosts = StubHosts(primary=1.0)
+    transport = make_transport(hosts)
+    for _ in range(20):
+        transport.latencies[PRIMARY].record(0.05)
+    delay = transport.hedge_delay(transport.hosts[0])
+
+    response = post_hedged(transport)
+
+    assert response.json() == {"host": "backup.test"}
+    (_, primary_sent), (_, backup_sent) = hosts.calls
+    assert 0.05 <= delay < 0.1
+    assert backup_sent - primary_sent >= delay - 0.005
+    # The losing primary request is cancelled
+    assert hosts.cancelled == ["primary.test"]
+    assert (transport.hedges_sent, transport.hedges_won) == (1, 1)
+
+
+def test_hedge_that_loses_is_cancelled(hedging):
+    hosts = StubHosts(primary=0.2, backup=2.0)
+    transport = make_transport(hosts)
+
+    response = post_hedged(transport)
+
+    assert response.json() == {"host": "primary.test"}
+    assert hosts.cancelled == ["backup.test"]
+    assert (transport.hedges_sent, transport.hedges_won) == (1, 0)
+
+
+@pytest.fixture
+def processor(hedging, monkeypatch):
+    monkeypatch.setitem(NETWORK_SETTINGS, "hedging_enabled", True)
+    config = TerminalConfig("MERCHANT0000001", "HEDGE001", PRIMARY, backup_server_url=BACKUP, heartbeat_interval=3600)
+    processor = TransactionProcessor(config.merchant_id, config.terminal_id, config.server_url, config=config)
+    processor.hosts = StubHosts(primary=0.3)
+    client = httpx.AsyncClient(transport=httpx.MockTransport(processor.hosts))
+    for host in processor.transport.hosts:
+        host._async_client = client
+    yield processor
+    processor.shutdown()
+
+
+@pytest.mark.parametrize("transaction_type, hedged", [
+    (TransactionType.BALANCE_INQUIRY, True),
+    (TransactionType.SALE, False),
+    (TransactionType.REFUND, False),
+    (TransactionType.PRE_AUTH, False),
+])
+def test_only_idempotent_messages_are_hedged(processor, make_transaction, transaction_type, hedged):
+    transaction = make_transaction(terminal_id=processor.terminal_id, transaction_type=transaction_type)
+
+    processor.process_transaction(transaction)
+
+    assert processor._is_idempotent(transaction) is hedged
+    assert processor.hosts.hosts_called() == (["primary", "backup"] if hedged else ["primary"])
@@ -0,0 +1,77 @@
+"""
+Black Rock Payment Terminal - Worker Process Identity Tests
+"""
+
+import zlib
+
+import pytest
+
+from app.core.workers import WorkerIdentity, owner_slot
+
+TERMINAL_IDS = [f"TERM{number:04d}" for number in range(200)]
+
+
+@pytest.fixture
+def identities(tmp_path):
+    claimed = []
+
+    def claim(worker_count: int, acquire_timeout: float = 1.0) -> WorkerIdentity:
+        identity = WorkerIdentity(worker_count, str(tmp_path / "run"), acquire_timeout=acquire_timeout)
+        claimed.append(identity)
+        return identity
+
+    yield claim
+    for identity in claimed:
+        identity.release()
+
+
+def test_owner_slot_is_stable_across_processes():
+    # CRC32, not the per-process salted hash()
+    assert owner_slot("TERM0001", 4) == zlib.crc32(b"TERM0001") % 4
+    assert all(0 <= owner_slot(terminal_id, 3) < 3 for terminal_id in TERMINAL_IDS)
+    assert len({owner_slot(terminal_id, 3) for terminal_id in TERMINAL_IDS}) == 3
+
+
+def test_single_worker_owns_every_terminal(identities):
+    identity = identities(1)
+
+    assert identity.slot == 0
+    assert not identity.is_shared
+    assert all(identity.owns(terminal_id) for terminal_id in TERMINAL_IDS)
+
+
+def test_workers_claim_distinct_slots(identities):
+    workers = [identities(3) for _ in range(3)]
+
+    assert sorted(worker.slot for worker in workers) == [0, 1, 2]
+    assert all(worker.is_shared for worker in workers)
+
+
+def test_every_terminal_has_exactly_one_owner(identities):
+    workers = [identities(3) for _ in range(3)]
+
+    for terminal_id in TERMINAL_IDS:
+        owners = [worker.slot for worker in workers if worker.owns(terminal_id)]
+        assert owners == [owner_slot(terminal_id, 3)]
+
+
+def test_worker_without_a_free_slot_owns_nothing(identities):
+    for _ in range(2):
+        identities(2)
+
+    extra = identities(2, acquire_timeout=0.2)
+
+    assert extra.slot is None
+    assert not any(extra.owns(terminal_id) for terminal_id in TERMINAL_IDS)
+
+
+def test_replacement_worker_takes_over_a_released_slot(identities):
+    workers = [identities(3) for _ in range(3)]
+    leaving = next(worker for worker in workers if worker.slot == 1)
+    owned = [terminal_id for terminal_id in TERMINAL_IDS if leaving.owns(terminal_id)]
+
+    leaving.release()
+    replacement = identities(3)
+
+    assert replacement.slot == 1
+    assert all(replacement.owns(terminal_id) for terminal_id in owned)